@@ -0,0 +1,116 @@
+"""
+Составные ответы API Gateway: один запрос клиента - несколько запросов к сервисам
+
+GET /api/bookings/<id>/details - бронь, её платежи и последние уведомления
+одним ответом вместо трёх последовательных запросов клиента. Части
+запрашиваются одновременно, поэтому задержка - самая долгая из частей, а не
+их сумма; каждая часть ждётся не дольше общего таймаута.
+
+Частичный отказ: если не получена обязательная часть (бронь), ответ - её
+ошибка (404 - брони нет; 503 / 504; остальное - 502). Необязательная часть
+(платежи, уведомления) при ошибке - null, её код и ошибка - в "errors",
+"partial": true.
+
+Части с политикой кэша (Part.endpoint) берутся из кэша gateway и кладутся в
+него по тем же ключам и тегам, что и отдельные запросы к этим маршрутам.
+
+fan_out - для потоков (Flask-режим); asyncio-режим запрашивает части
+через asyncio.gather (async_gateway.py).
+"""
+import json
+from concurrent.futures import Executor, wait
+from http import HTTPStatus
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, quote
+
+
+class Part(NamedTuple):
+    """
+    Часть составного ответа: запрос GET path?query к сервису по префиксу path;
+    endpoint / view_args - маршрут gateway для политики кэша (None - не кэшируется);
+    field - поле ответа сервиса (None - весь ответ)
+    """
+
+    name: str
+    path: str
+    query: str = ""
+    endpoint: Optional[str] = None
+    view_args: dict = {}
+    field: Optional[str] = None
+    required: bool = False
+
+    @property
+    def target(self) -> str:
+        target = quote(self.path)
+        return f"{target}?{self.query}" if self.query else target
+
+    @property
+    def args(self) -> dict:
+        return dict(parse_qsl(self.query))
+
+
+class PartResult(NamedTuple):
+    """Результат части: код ответа сервиса (или gateway), данные при 200, иначе ошибка"""
+
+    status: int
+    data: object = None
+    error: Optional[str] = None
+
+
+def part_result(part: Part, status: int, body: bytes) -> PartResult:
+    """Ответ сервиса -> данные части"""
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+        if status == 200:
+            return PartResult(502, error="Ответ сервиса - не JSON")
+    if status != 200:
+        error = data.get("error") if isinstance(data, dict) else None
+        return PartResult(status, error=str(error or _reason(status)))
+    if part.field is not None:
+        data = data.get(part.field) if isinstance(data, dict) else None
+    return PartResult(200, data)
+
+
+def merge(parts: List[Part], results: List[PartResult]) -> Tuple[int, dict]:
+    """Части -> (код, JSON составного ответа)"""
+    data = {}
+    errors = {}
+    for part, result in zip(parts, results):
+        if result.error is None:
+            data[part.name] = result.data
+            continue
+        if part.required:
+            status = result.status if result.status in (404, 503, 504) else 502
+            return status, {"error": f"{part.name}: {result.error}"}
+        data[part.name] = None
+        errors[part.name] = {"status": result.status, "error": result.error}
+    return 200, {**data, "partial": bool(errors), "errors": errors}
+
+
+def fan_out(
+    executor: Executor, fetch: Callable[[Part], PartResult], parts: List[Part], timeout: float
+) -> List[PartResult]:
+    """Все части одновременно в пуле потоков; не успевшая за timeout - 504"""
+    futures = [executor.submit(fetch, part) for part in parts]
+    wait(futures, timeout)
+    results = []
+    for part, future in zip(parts, futures):
+        if not future.done():
+            # Запрос дорабатывает в пуле сам (таймаут запроса к сервису - тот же)
+            future.cancel()
+            results.append(PartResult(504, error=f"Нет ответа за {timeout} с"))
+        elif future.exception() is not None:
+            print(f"[Gateway] Error fetching {part.name} {part.target}: {future.exception()}")
+            results.append(PartResult(502, error=str(future.exception())))
+        else:
+            results.append(future.result())
+    return results
+
+
+def _reason(status: int) -> str:
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return f"HTTP {status}"
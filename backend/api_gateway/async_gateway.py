@@ -0,0 +1,696 @@
+"""
+Asyncio-режим API Gateway (GATEWAY_MODE=asyncio)
+
+Те же маршруты, что у Flask-gateway (api_gateway/main.py): запрос
+сопоставляется с url_map приложения Flask, поэтому 404 / 405 и набор
+маршрутов в обоих режимах совпадают. Ответ сервиса передаётся так же -
+код, заголовки (по политике proxy.py) и тело потоком, без разбора JSON.
+
+Отличие - модель исполнения: один поток и цикл событий вместо потока на
+запрос. Запрос, ждущий медленный сервис, - это корутина и два сокета, а не
+поток, занятый на весь таймаут, поэтому тысячи одновременных медленных
+запросов обслуживаются на одном ядре.
+
+Для каждого сервиса (AsyncUpstream):
+- лимит одновременных запросов (GATEWAY_ASYNC_MAX_CONCURRENCY) и очередь
+  ожидания слота (GATEWAY_ASYNC_QUEUE_SIZE): очередь заполнена или слот не
+  освободился за GATEWAY_QUEUE_TIMEOUT - 503 с Retry-After;
+- таймаут (GATEWAY_UPSTREAM_TIMEOUT) на ожидание слота и заголовков ответа
+  вместе - 504; он же - на каждое чтение тела ответа;
+- пул keep-alive соединений (до GATEWAY_POOL_SIZE простаивающих).
+
+Кэш ответов (cache.GatewayCache) - общий с Flask-режимом по политикам и
+тегам; одинаковые одновременные GET объединяются (coalesce.AsyncSingleFlight);
+маршруты gateway без сервиса (/broker/consume, /gateway/*, /metrics)
+обслуживаются обработчиками local (доступ - authorize, общий с Flask-режимом); составные ответы (aggregates,
+/api/bookings/<id>/details) - части из сервисов одновременно (asyncio.gather).
+
+HTTP/1.1 реализован минимально, на asyncio streams стандартной библиотеки:
+тело запроса - только с Content-Length, без pipelining; keep-alive - только
+для HTTP/1.1.
+
+Запуск (из каталога backend):
+    GATEWAY_MODE=asyncio python api_gateway/main.py
+"""
+import asyncio
+import json
+import resource
+import ssl
+from http import HTTPStatus
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, RequestRedirect
+
+try:
+    from aggregate import Part, PartResult, merge, part_result
+    from coalesce import AsyncSingleFlight, SharedResponse, flight_key
+    from proxy import CHUNK_SIZE, FORWARDED_REQUEST_HEADERS, is_passed_through
+    from ratelimit import RateLimiter, client_id, retry_after_header
+except ImportError:
+    from api_gateway.aggregate import Part, PartResult, merge, part_result
+    from api_gateway.coalesce import AsyncSingleFlight, SharedResponse, flight_key
+    from api_gateway.proxy import CHUNK_SIZE, FORWARDED_REQUEST_HEADERS, is_passed_through
+    from api_gateway.ratelimit import RateLimiter, client_id, retry_after_header
+
+# Пределы входящего запроса
+MAX_HEAD_SIZE = 64 * 1024
+MAX_BODY_SIZE = 10 * 2**20
+# Сколько держать простаивающее keep-alive соединение клиента, с
+CLIENT_IDLE_TIMEOUT = 75
+# Очередь входящих соединений: тысячи клиентов подключаются одновременно
+LISTEN_BACKLOG = 4096
+
+Headers = List[Tuple[str, str]]
+
+
+class UpstreamError(Exception):
+    """Запрос к сервису не выполнен; status - код ответа клиенту, retry_after - для Retry-After, с"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class UpstreamResponse:
+    """Статус и заголовки ответа сервиса; тело читается потоком через body()"""
+
+    def __init__(self, upstream: "AsyncUpstream", reader, writer, status: int, headers: Headers, framing, keep_alive: bool):
+        self.upstream = upstream
+        self.status = status
+        self.headers = headers
+        # ("length", n) / ("chunked", None) / ("close", None)
+        self.framing = framing
+        self._reader = reader
+        self._writer = writer
+        self._keep_alive = keep_alive
+        self._released = False
+
+    @property
+    def content_length(self) -> Optional[int]:
+        kind, length = self.framing
+        return length if kind == "length" else None
+
+    async def body(self) -> AsyncIterator[bytes]:
+        """Тело ответа частями; соединение возвращается в пул, только если тело дочитано"""
+        timeout = self.upstream.timeout
+        kind, length = self.framing
+        reader = self._reader
+        try:
+            if kind == "length":
+                while length > 0:
+                    data = await asyncio.wait_for(reader.read(min(length, CHUNK_SIZE)), timeout)
+                    if not data:
+                        raise asyncio.IncompleteReadError(b"", length)
+                    length -= len(data)
+                    yield data
+            elif kind == "chunked":
+                while True:
+                    size_line = await asyncio.wait_for(reader.readline(), timeout)
+                    size = int(size_line.split(b";", 1)[0], 16)
+                    if size == 0:
+                        # Трейлеры (обычно их нет) - до пустой строки
+                        while (await asyncio.wait_for(reader.readline(), timeout)).strip():
+                            pass
+                        break
+                    while size > 0:
+                        data = await asyncio.wait_for(reader.readexactly(min(size, CHUNK_SIZE)), timeout)
+                        size -= len(data)
+                        yield data
+                    await asyncio.wait_for(reader.readexactly(2), timeout)
+            else:
+                while True:
+                    data = await asyncio.wait_for(reader.read(CHUNK_SIZE), timeout)
+                    if not data:
+                        break
+                    yield data
+        except BaseException:
+            self.release(reuse=False)
+            raise
+        self.release(reuse=self._keep_alive and kind != "close")
+
+    def release(self, reuse: bool = False) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.upstream.finish(self._reader, self._writer, reuse)
+
+
+class AsyncUpstream:
+    """Сервис: лимит одновременных запросов, таймауты и пул keep-alive соединений"""
+
+    def __init__(
+        self,
+        base_url: str,
+        limit: int = 1000,
+        timeout: float = 10,
+        pool_size: int = 32,
+        queue: int = 10_000,
+        queue_timeout: Optional[float] = None,
+        retry_after: float = 1.0,
+        shed_counter=None,
+    ):
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.host_header = parts.netloc
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.limit = limit
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # Ожидающих слот не больше queue, каждый - не дольше queue_timeout
+        self.queue = queue
+        self.queue_timeout = min(queue_timeout, timeout) if queue_timeout is not None else timeout
+        self.retry_after = retry_after
+        # Счётчик метрик (message_broker.metrics.Counter): inc((base_url,)) на каждый сброшенный запрос
+        self.shed_counter = shed_counter
+        self._slots = asyncio.Semaphore(limit)
+        self._idle: list = []
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.shed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "url": self.base_url,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queue": self.queue,
+            "idle_connections": len(self._idle),
+            "requests": self.requests,
+            "shed": self.shed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+    async def request(self, method: str, target: str, headers: Headers, body: bytes) -> UpstreamResponse:
+        """Отправить запрос; слот занят, пока тело ответа не прочитано (или не брошено)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        self.requests += 1
+        await self._acquire_slot()
+        self.in_flight += 1
+        try:
+            return await asyncio.wait_for(self._send(method, target, headers, body), deadline - loop.time())
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._release_slot()
+            raise UpstreamError(504, f"Сервис {self.base_url} не ответил за {self.timeout} с")
+        except (OSError, EOFError, ValueError, asyncio.LimitOverrunError) as e:
+            self.errors += 1
+            self._release_slot()
+            raise UpstreamError(502, f"Ошибка запроса к {self.base_url}: {e}")
+        except BaseException:
+            self._release_slot()
+            raise
+
+    async def _acquire_slot(self) -> None:
+        """Слот сразу, иначе - в очередь; очередь заполнена или таймаут - 503 (сброс нагрузки)"""
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        if self.waiting >= self.queue:
+            self.shed += 1
+            self._count_shed()
+            raise UpstreamError(503, f"Сервис {self.base_url} перегружен: очередь заполнена", self.retry_after)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            self._count_shed()
+            raise UpstreamError(
+                503, f"Сервис {self.base_url} перегружен: нет свободного слота за {self.queue_timeout} с", self.retry_after
+            )
+        finally:
+            self.waiting -= 1
+
+    def _count_shed(self) -> None:
+        if self.shed_counter is not None:
+            self.shed_counter.inc((self.base_url,))
+
+    def finish(self, reader, writer, reuse: bool) -> None:
+        """Тело ответа прочитано (reuse) или брошено: соединение - в пул или закрывается"""
+        if reuse and len(self._idle) < self.pool_size and not writer.is_closing():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def _send(self, method: str, target: str, headers: Headers, body: bytes) -> UpstreamResponse:
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self.host_header}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if body or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Connection: keep-alive")
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+        while True:
+            reader, writer, reused = await self._connection()
+            try:
+                writer.write(request)
+                await writer.drain()
+                head = await reader.readuntil(b"\r\n\r\n")
+                return self._parse_response(method, head, reader, writer)
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                # Соединение из пула могло быть закрыто сервисом - повтор на новом
+                if not reused:
+                    raise
+            except BaseException:
+                # В том числе отмена по таймауту
+                writer.close()
+                raise
+
+    async def _connection(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl, limit=MAX_HEAD_SIZE)
+        return reader, writer, False
+
+    def _parse_response(self, method: str, head: bytes, reader, writer) -> UpstreamResponse:
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        version, status = status_line.split(" ", 2)[:2]
+        status = int(status)
+        headers = []
+        fields = {}
+        for line in header_lines:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            value = value.strip()
+            headers.append((name, value))
+            fields[name.lower()] = value
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            framing = ("length", 0)
+        elif "chunked" in fields.get("transfer-encoding", "").lower():
+            framing = ("chunked", None)
+        elif "content-length" in fields:
+            framing = ("length", int(fields["content-length"]))
+        else:
+            framing = ("close", None)
+        connection = fields.get("connection", "").lower()
+        keep_alive = version == "HTTP/1.1" and connection != "close"
+        passed = [(name, value) for name, value in headers if is_passed_through(name) and name.lower() != "content-length"]
+        return UpstreamResponse(self, reader, writer, status, passed, framing, keep_alive)
+
+
+class AsyncGateway:
+    """Входящие HTTP/1.1-соединения: маршрутизация по url_map Flask-приложения и передача сервису"""
+
+    def __init__(
+        self,
+        url_map: Map,
+        upstreams: Dict[str, str],
+        limit: int,
+        timeout: float,
+        pool_size: int,
+        cache=None,
+        local: Optional[Dict[str, Callable[[bytes, Optional[str]], tuple]]] = None,
+        coalescer: Optional[AsyncSingleFlight] = None,
+        read_routes: Optional[Iterable[str]] = None,
+        limiter: Optional[RateLimiter] = None,
+        client_header: str = "",
+        aggregates: Optional[Dict[str, Callable[[dict, dict], List[Part]]]] = None,
+        aggregate_timeout: Optional[float] = None,
+        authorize: Optional[Callable[[str, dict, Optional[str]], Optional[tuple]]] = None,
+        **upstream_options,
+    ):
+        self.url_map = url_map
+        # GatewayCache или None; local - endpoint -> (тело, Content-Type) ->
+        # (код, JSON) или (код, текст, Content-Type)
+        self.cache = cache
+        self.local = local or {}
+        # Доступ к local: (endpoint, заголовки, адрес клиента) -> None или (код, JSON)
+        self.authorize = authorize
+        # Составные ответы: endpoint -> (аргументы пути, query) -> части; ожидание частей, с
+        self.aggregates = aggregates or {}
+        self.aggregate_timeout = aggregate_timeout or timeout
+        # GET-маршруты на чтение: кэш (по политикам) и объединение одинаковых запросов
+        self.coalescer = coalescer
+        self.read_routes = set(read_routes) if read_routes is not None else set(cache.policies if cache else ())
+        # Лимиты клиентов; client_header - заголовок с адресом клиента (иначе адрес соединения)
+        self.limiter = limiter
+        self.client_header = client_header.lower()
+        # queue, queue_timeout, retry_after, shed_counter - см. AsyncUpstream
+        self.upstream_options = upstream_options
+        self.prefixes = sorted(upstreams, key=len, reverse=True)
+        self.upstream_urls = upstreams
+        self.limit = limit
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.upstreams: Dict[str, AsyncUpstream] = {}
+        self.connections = 0
+
+    def upstream_for(self, path: str) -> Optional[AsyncUpstream]:
+        for prefix in self.prefixes:
+            if path.startswith(prefix):
+                upstream = self.upstreams.get(prefix)
+                if upstream is None:
+                    # Создаётся в цикле событий (asyncio.Semaphore)
+                    upstream = self.upstreams[prefix] = AsyncUpstream(
+                        self.upstream_urls[prefix], self.limit, self.timeout, self.pool_size, **self.upstream_options
+                    )
+                return upstream
+        return None
+
+    async def handle_connection(self, reader, writer) -> None:
+        self.connections += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), CLIENT_IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError, OSError):
+                    return
+                keep_alive = await self.handle_request(head, reader, writer)
+        except (OSError, asyncio.IncompleteReadError):
+            # Клиент отключился посреди ответа
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def handle_request(self, head: bytes, reader, writer) -> bool:
+        """Обработать один запрос; вернуть, можно ли читать следующий из соединения"""
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = request_line.split(" ")
+        except ValueError:
+            await self.send_json(writer, 400, {"error": "Некорректная строка запроса"}, keep_alive=False)
+            return False
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        # Keep-alive - только для HTTP/1.1
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        cors = {"Access-Control-Allow-Origin": "*"} if "origin" in headers else {}
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            await self.send_json(writer, 411, {"error": "Нужен Content-Length"}, keep_alive=False)
+            return False
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_SIZE:
+            await self.send_json(writer, 413, {"error": "Слишком большое тело запроса"}, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        path = unquote(target.split("?", 1)[0])
+        if method == "OPTIONS":
+            # Preflight CORS (как flask_cors: любые origin, методы и заголовки)
+            await self.send(writer, 200, [
+                ("Access-Control-Allow-Origin", "*"),
+                ("Access-Control-Allow-Methods", headers.get("access-control-request-method", "GET, POST, DELETE")),
+                ("Access-Control-Allow-Headers", headers.get("access-control-request-headers", "*")),
+                ("Content-Length", "0"),
+            ], keep_alive)
+            return keep_alive
+        try:
+            endpoint, view_args = self.url_map.bind(headers.get("host", "localhost")).match(path, method)
+        except RequestRedirect as e:
+            await self.send(writer, e.code, [("Location", e.new_url), ("Content-Length", "0"), *cors.items()], keep_alive)
+            return keep_alive
+        except HTTPException as e:
+            await self.send_json(writer, e.code, {"error": e.name}, keep_alive, cors)
+            return keep_alive
+
+        if endpoint == "health":
+            await self.send_json(writer, 200, self.health(), keep_alive, cors)
+            return keep_alive
+        if endpoint in self.local:
+            if self.authorize is not None:
+                peer = writer.get_extra_info("peername")
+                denied = self.authorize(endpoint, headers, peer[0] if peer else None)
+                if denied is not None:
+                    await self.send_json(writer, denied[0], denied[1], keep_alive, cors)
+                    return keep_alive
+            status, data, *content_type = self.local[endpoint](body, headers.get("content-type"))
+            if content_type:
+                await self.send_buffered(writer, status, [("Content-Type", content_type[0])], data.encode(), keep_alive, list(cors.items()))
+            else:
+                await self.send_json(writer, status, data, keep_alive, cors)
+            return keep_alive
+        if self.limiter is not None:
+            peer = writer.get_extra_info("peername")
+            client = client_id(peer[0] if peer else None, headers.get(self.client_header) if self.client_header else None)
+            wait = self.limiter.check(client, endpoint)
+            if wait:
+                extra = {**cors, "Retry-After": retry_after_header(wait)}
+                await self.send_json(writer, 429, {"error": "Слишком много запросов, повторите позже"}, keep_alive, extra)
+                return keep_alive
+        if endpoint in self.aggregates:
+            parts = self.aggregates[endpoint](view_args, dict(parse_qsl(target.partition("?")[2])))
+            status, data = await self.aggregate(parts, headers)
+            await self.send_json(writer, status, data, keep_alive, cors)
+            return keep_alive
+        upstream = self.upstream_for(path)
+        if upstream is None:
+            await self.send_json(writer, 404, {"error": "Not Found"}, keep_alive, cors)
+            return keep_alive
+
+        read = method == "GET" and endpoint in self.read_routes
+        lookup = None
+        if read and self.cache is not None:
+            query = target.partition("?")[2]
+            cached, lookup = self.cache.lookup(
+                method, endpoint, view_args, path, query, dict(parse_qsl(query)), lambda name: headers.get(name.lower())
+            )
+            if cached is not None:
+                extra = [("X-Cache", "HIT"), *cors.items()]
+                await self.send_buffered(writer, cached.status, cached.headers, cached.body, keep_alive, extra)
+                return keep_alive
+        request = (upstream, method, target, endpoint, view_args, headers, body)
+        if not read or self.coalescer is None:
+            await self.forward(writer, request, keep_alive, cors, lookup)
+            return keep_alive
+
+        key = flight_key(target, lambda name: headers.get(name.lower()))
+        leader, flight = self.coalescer.join(key, endpoint)
+        if not leader:
+            try:
+                shared = await self.coalescer.wait(flight, endpoint, self.timeout)
+            except TimeoutError as e:
+                await self.send_json(writer, 504, {"error": str(e)}, keep_alive, cors)
+                return keep_alive
+            if shared is not None:
+                extra = [("X-Coalesced", "1"), *cors.items()]
+                await self.send_buffered(writer, shared.status, shared.headers, shared.body, keep_alive, extra)
+            else:
+                await self.forward(writer, request, keep_alive, cors, lookup)
+            return keep_alive
+        try:
+            # Ведомые получают ответ, как только он прочитан, не дожидаясь отправки клиенту лидера
+            await self.forward(writer, request, keep_alive, cors, lookup, lambda shared: self.coalescer.done(key, flight, shared))
+        finally:
+            self.coalescer.done(key, flight, None)
+        return keep_alive
+
+    async def forward(
+        self,
+        writer,
+        request: tuple,
+        keep_alive: bool,
+        cors: dict,
+        lookup=None,
+        share: Optional[Callable[[SharedResponse], None]] = None,
+    ) -> None:
+        """
+        Запрос к сервису и его ответ клиенту. request - (upstream, метод, цель,
+        endpoint, аргументы пути, заголовки, тело); share - получает копию
+        ответа для ведомых, если ответ буферизуется целиком
+        """
+        upstream, method, target, endpoint, view_args, headers, body = request
+        forwarded = [(name, headers[name.lower()]) for name in FORWARDED_REQUEST_HEADERS if name.lower() in headers]
+        # Тело ответа не распаковывается: сжатие - только если его понимает клиент
+        forwarded.append(("Accept-Encoding", headers.get("accept-encoding", "identity")))
+        try:
+            response = await upstream.request(method, target, forwarded, body)
+        except UpstreamError as e:
+            print(f"[Gateway] Error proxying {method} {upstream.base_url}{target}: {e}")
+            error = json.dumps({"error": str(e)}, ensure_ascii=False).encode()
+            error_headers = [("Content-Type", "application/json")]
+            if e.retry_after is not None:
+                error_headers.append(("Retry-After", retry_after_header(e.retry_after)))
+            if share is not None:
+                share(SharedResponse(e.status, error_headers, error))
+            await self.send_buffered(writer, e.status, error_headers, error, keep_alive, list(cors.items()))
+            return
+
+        try:
+            length = response.content_length
+            if self.cache is not None and lookup is None:
+                self.cache.after_write(method, endpoint, view_args, body, response.status)
+            upstream_headers = (response.headers + [("Content-Length", str(length))]) if length is not None else []
+            cacheable = lookup is not None and self.cache.cacheable(response.status, upstream_headers)
+            shareable = share is not None and length is not None and length <= self.coalescer.max_bytes
+            extra = [("X-Cache", "MISS")] if lookup is not None else []
+            if cacheable or shareable:
+                # Тело небольшое (Content-Length в пределах записи кэша / ответа ведомым) - читается целиком
+                data = b"".join([chunk async for chunk in response.body()])
+                if cacheable:
+                    self.cache.store(lookup, response.status, response.headers, data)
+                if shareable:
+                    share(SharedResponse(response.status, response.headers, data))
+                await self.send_buffered(writer, response.status, response.headers, data, keep_alive, [*extra, *cors.items()])
+                return
+
+            response_headers = response.headers + extra + list(cors.items())
+            if length is not None:
+                response_headers.append(("Content-Length", str(length)))
+            elif keep_alive:
+                response_headers.append(("Transfer-Encoding", "chunked"))
+            await self.send(writer, response.status, response_headers, keep_alive)
+            # Без длины: клиенту HTTP/1.1 - chunked, иначе тело до закрытия соединения
+            chunked = length is None and keep_alive
+            async for data in response.body():
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        finally:
+            response.release()
+
+    async def aggregate(self, parts: List[Part], headers: dict) -> Tuple[int, dict]:
+        """Все части одновременно; составной ответ - (код, JSON)"""
+        forwarded = [(name, headers[name.lower()]) for name in ("Accept", "Authorization", "X-Request-Id") if name.lower() in headers]
+        # Ответы частей разбираются в gateway - без сжатия
+        forwarded.append(("Accept-Encoding", "identity"))
+        results = await asyncio.gather(*(self.fetch_part(part, forwarded) for part in parts))
+        return merge(parts, list(results))
+
+    async def fetch_part(self, part: Part, headers: Headers) -> PartResult:
+        """Часть составного ответа: из кэша или из сервиса не дольше aggregate_timeout"""
+        upstream = self.upstream_for(part.path)
+        if upstream is None:
+            return PartResult(502, error=f"Нет сервиса для {part.path}")
+        lookup = None
+        if self.cache is not None and part.endpoint is not None:
+            cached, lookup = self.cache.lookup(
+                "GET", part.endpoint, part.view_args, part.path, part.query, part.args, dict(headers).get
+            )
+            if cached is not None:
+                return part_result(part, cached.status, cached.body)
+        try:
+            status, response_headers, body = await asyncio.wait_for(
+                self._get(upstream, part.target, headers), self.aggregate_timeout
+            )
+        except UpstreamError as e:
+            return PartResult(e.status, error=str(e))
+        except asyncio.TimeoutError:
+            return PartResult(504, error=f"Нет ответа за {self.aggregate_timeout} с")
+        if lookup is not None and self.cache.cacheable(status, response_headers):
+            self.cache.store(lookup, status, response_headers, body)
+        return part_result(part, status, body)
+
+    async def _get(self, upstream: AsyncUpstream, target: str, headers: Headers) -> Tuple[int, Headers, bytes]:
+        response = await upstream.request("GET", target, headers, b"")
+        try:
+            body = b"".join([chunk async for chunk in response.body()])
+        finally:
+            response.release()
+        length = response.content_length
+        return response.status, response.headers + ([("Content-Length", str(length))] if length is not None else []), body
+
+    def health(self) -> dict:
+        return {
+            "status": "healthy",
+            "service": "api-gateway",
+            "mode": "asyncio",
+            "connections": self.connections,
+            "upstreams": {prefix: upstream.stats() for prefix, upstream in self.upstreams.items()},
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "coalescing": self.coalescer.stats() if self.coalescer is not None else None,
+        }
+
+    async def send(self, writer, status: int, headers: Headers, keep_alive: bool) -> None:
+        lines = [f"HTTP/1.1 {status} {_reason(status)}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if not keep_alive:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def send_buffered(
+        self, writer, status: int, headers: Headers, body: bytes, keep_alive: bool, extra: Headers = ()
+    ) -> None:
+        """Ответ с телом целиком (headers - без Content-Length)"""
+        await self.send(writer, status, [*headers, ("Content-Length", str(len(body))), *extra], keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+    async def send_json(self, writer, status: int, data: dict, keep_alive: bool, extra: Optional[dict] = None) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode()
+        await self.send_buffered(writer, status, [("Content-Type", "application/json")], body, keep_alive, list((extra or {}).items()))
+
+
+def _reason(status: int) -> str:
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ""
+
+
+def raise_open_files_limit() -> None:
+    """Каждый запрос - два сокета: мягкий лимит открытых файлов поднимается до жёсткого"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def serve(
+    url_map: Map,
+    upstreams: Dict[str, str],
+    host: str = "0.0.0.0",
+    port: int = 5000,
+    limit: int = 1000,
+    timeout: float = 10,
+    pool_size: int = 32,
+    cache=None,
+    local: Optional[Dict[str, Callable[[bytes, Optional[str]], tuple]]] = None,
+    coalescer: Optional[AsyncSingleFlight] = None,
+    read_routes: Optional[Iterable[str]] = None,
+    limiter: Optional[RateLimiter] = None,
+    client_header: str = "",
+    aggregates: Optional[Dict[str, Callable[[dict, dict], List[Part]]]] = None,
+    aggregate_timeout: Optional[float] = None,
+    authorize: Optional[Callable[[str, dict, Optional[str]], Optional[tuple]]] = None,
+    **upstream_options,
+) -> None:
+    """
+    Запустить asyncio-gateway; upstreams - префикс пути -> адрес сервиса,
+    cache - GatewayCache, local - маршруты, обслуживаемые самим gateway,
+    coalescer - объединение одинаковых GET на маршрутах read_routes,
+    limiter - лимиты клиентов, aggregates - составные ответы (ожидание частей -
+    aggregate_timeout), authorize - доступ к local, upstream_options - очередь к сервисам (AsyncUpstream)
+    """
+    raise_open_files_limit()
+    gateway = AsyncGateway(
+        url_map, upstreams, limit, timeout, pool_size, cache, local, coalescer, read_routes,
+        limiter, client_header, aggregates, aggregate_timeout, authorize, **upstream_options,
+    )
+    server = await asyncio.start_server(
+        gateway.handle_connection, host, port, limit=MAX_HEAD_SIZE, backlog=LISTEN_BACKLOG
+    )
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,291 @@
+"""
+Кэш ответов API Gateway
+
+ResponseCache - ответы сервисов (код, заголовки, тело) по ключу "путь?query"
+и заголовкам запроса, от которых зависит ответ (Accept, Authorization):
+- LRU: при превышении числа записей или объёма вытесняются давно не читавшиеся;
+- TTL: у каждой записи свой срок (из политики маршрута);
+- теги: запись помечается сущностями, из которых собран ответ
+  ("booking:<id>", "payment:<id>", ...), и invalidate(теги) удаляет ровно
+  зависящие от них записи - по событиям брокера и после записи через gateway.
+
+Ответ, запрошенный до инвалидации, а полученный после, в кэш не кладётся
+(счётчик инвалидаций - epoch), иначе он вернул бы устаревшие данные до TTL.
+
+GatewayCache связывает кэш с маршрутами: политики по endpoint-у Flask,
+теги для записи через gateway и для событий брокера. Используется обоими
+режимами gateway (main.py и async_gateway.py).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    from coalesce import VARY_HEADERS
+except ImportError:
+    from api_gateway.coalesce import VARY_HEADERS
+
+Headers = List[Tuple[str, str]]
+
+# Заголовки запроса в ключе кэша: ответ одного клиента (его Authorization, Accept)
+# не отдаётся другим. Accept-Encoding не нужен - кэшируются только несжатые ответы
+CACHE_VARY_HEADERS = tuple(name for name in VARY_HEADERS if name != "Accept-Encoding")
+
+
+class CachePolicy(NamedTuple):
+    """
+    Политика кэширования GET-маршрута: TTL и теги записи -
+    tags(аргументы пути, query, тело ответа)
+    """
+
+    ttl: float
+    tags: Callable[[dict, dict, bytes], List[str]]
+
+
+class CachedResponse(NamedTuple):
+    status: int
+    headers: Headers
+    body: bytes
+    expires_at: float
+    tags: Tuple[str, ...]
+    route: str
+    size: int
+
+
+class ResponseCache:
+    """LRU + TTL кэш ответов с инвалидацией по тегам; потокобезопасен"""
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 64 * 2**20, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._by_tag: Dict[str, set] = {}
+        self._bytes = 0
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.invalidated_entries = 0
+
+    @property
+    def epoch(self) -> int:
+        """Номер инвалидации: запомнить до запроса к сервису и передать в put()"""
+        return self._epoch
+
+    def get(self, key: str, route: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            counters = self._route_counters(route)
+            if entry is None:
+                counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            counters["hits"] += 1
+            return entry
+
+    def put(
+        self,
+        key: str,
+        route: str,
+        status: int,
+        headers: Headers,
+        body: bytes,
+        ttl: float,
+        tags: Iterable[str],
+        epoch: int,
+    ) -> bool:
+        """Сохранить ответ; False - была инвалидация после epoch или запись больше кэша"""
+        size = len(key) + len(body) + sum(len(name) + len(value) for name, value in headers)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if epoch != self._epoch:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            entry = CachedResponse(status, headers, body, self._clock() + ttl, tuple(tags), route, size)
+            self._entries[key] = entry
+            self._bytes += size
+            for tag in entry.tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """Удалить записи с любым из тегов; число удалённых"""
+        removed = 0
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            for tag in tags:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidated_entries += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._by_tag.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {
+                route: {**counters, "hit_ratio": _ratio(counters["hits"], counters["misses"])}
+                for route, counters in self._routes.items()
+            }
+            hits = sum(counters["hits"] for counters in self._routes.values())
+            misses = sum(counters["misses"] for counters in self._routes.values())
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": _ratio(hits, misses),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "invalidated_entries": self.invalidated_entries,
+                "routes": routes,
+            }
+
+    def _route_counters(self, route: str) -> Dict[str, int]:
+        counters = self._routes.get(route)
+        if counters is None:
+            counters = self._routes[route] = {"hits": 0, "misses": 0}
+        return counters
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+
+class CacheLookup(NamedTuple):
+    """Промах кэша: что нужно, чтобы сохранить полученный ответ"""
+
+    key: str
+    route: str
+    policy: CachePolicy
+    view_args: dict
+    args: dict
+    epoch: int
+
+
+class GatewayCache:
+    """
+    Кэш ответов, привязанный к маршрутам gateway.
+
+    policies - endpoint -> CachePolicy (кэшируются только GET с политикой);
+    write_tags(endpoint, view_args, body) - теги, устаревающие после успешного
+    не-GET запроса через gateway; event_tags(event_type, payload) - теги по
+    событию брокера.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        policies: Dict[str, CachePolicy],
+        write_tags: Callable[[str, dict, bytes], List[str]],
+        event_tags: Callable[[str, dict], List[str]],
+        max_entry_bytes: int = 2**20,
+    ):
+        self.cache = cache
+        self.policies = policies
+        self.write_tags = write_tags
+        self.event_tags = event_tags
+        self.max_entry_bytes = max_entry_bytes
+        self.events = 0
+
+    def lookup(
+        self,
+        method: str,
+        endpoint: str,
+        view_args: dict,
+        path: str,
+        query_string: str,
+        args: dict,
+        header: Callable[[str], Optional[str]],
+    ) -> Tuple[Optional[CachedResponse], Optional[CacheLookup]]:
+        """
+        (ответ из кэша, None) / (None, промах) / (None, None) - маршрут не кэшируется;
+        header(name) - значение заголовка запроса
+        """
+        policy = self.policies.get(endpoint) if method == "GET" else None
+        if policy is None:
+            return None, None
+        key = cache_key(path, query_string, header)
+        cached = self.cache.get(key, endpoint)
+        if cached is not None:
+            return cached, None
+        # epoch - до запроса к сервису
+        return None, CacheLookup(key, endpoint, policy, view_args, args, self.cache.epoch)
+
+    def cacheable(self, status: int, headers: Headers) -> bool:
+        """Кэшируются только 200 с известной длиной, без сжатия и без no-store"""
+        if status != 200:
+            return False
+        fields = {name.lower(): value for name, value in headers}
+        length = fields.get("content-length")
+        return (
+            length is not None
+            and int(length) <= self.max_entry_bytes
+            and "content-encoding" not in fields
+            and "no-store" not in fields.get("cache-control", "")
+        )
+
+    def store(self, lookup: CacheLookup, status: int, headers: Headers, body: bytes) -> bool:
+        """Сохранить ответ сервиса; Content-Length выставляется при отдаче из кэша"""
+        headers = [(name, value) for name, value in headers if name.lower() != "content-length"]
+        tags = lookup.policy.tags(lookup.view_args, lookup.args, body)
+        return self.cache.put(lookup.key, lookup.route, status, headers, body, lookup.policy.ttl, tags, lookup.epoch)
+
+    def after_write(self, method: str, endpoint: str, view_args: dict, body: bytes, status: int) -> int:
+        """Успешная запись через gateway - инвалидация, не дожидаясь события брокера"""
+        if method in ("GET", "HEAD", "OPTIONS") or status >= 400:
+            return 0
+        tags = self.write_tags(endpoint, view_args, body)
+        return self.cache.invalidate(tags) if tags else 0
+
+    def handle_event(self, message: dict) -> str:
+        """Сообщение брокера (как у /broker/consume сервисов) -> инвалидация"""
+        self.events += 1
+        tags = self.event_tags(message.get("event_type"), message.get("payload") or {})
+        if not tags:
+            return "ignored"
+        self.cache.invalidate(tags)
+        return "processed"
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "events": self.events}
+
+
+def cache_key(path: str, query_string: str, header: Callable[[str], Optional[str]]) -> str:
+    """Ключ записи: путь с query и значения CACHE_VARY_HEADERS (нет заголовка - пусто)"""
+    target = f"{path}?{query_string}" if query_string else path
+    return "\n".join((target, *(header(name) or "" for name in CACHE_VARY_HEADERS)))
+
+
+def _ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return round(hits / total, 4) if total else 0.0
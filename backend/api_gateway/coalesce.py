@@ -0,0 +1,148 @@
+"""
+Объединение одинаковых одновременных GET-запросов (single-flight)
+
+Первый запрос с данным ключом (лидер) идёт в сервис; такие же запросы,
+пришедшие, пока он выполняется (ведомые), ждут его ответ и получают копию -
+в сервис уходит один запрос вместо сотен, когда все клиенты одновременно
+открывают одну и ту же дату.
+
+Ответ передаётся ведомым, только если лидер буферизовал его целиком
+(известная длина до max_bytes); иначе (поток, обрыв соединения) каждый
+ведомый делает свой запрос. Ключ - путь с query и заголовки запроса, от
+которых зависит ответ (VARY_HEADERS).
+
+SingleFlight - для потоков (Flask-режим), AsyncSingleFlight - для цикла
+событий (asyncio-режим).
+"""
+import asyncio
+import threading
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+# Заголовки запроса, передаваемые сервису и влияющие на ответ
+VARY_HEADERS = ("Accept", "Accept-Encoding", "Authorization")
+
+# Роли запросов в счётчиках: лидер (запрос в сервис), ведомый (получил ответ
+# лидера), fallback (ответ лидера не буферизован - свой запрос), timeout
+LEADER = "leader"
+FOLLOWER = "follower"
+FALLBACK = "fallback"
+TIMEOUT = "timeout"
+ROLES = (LEADER, FOLLOWER, FALLBACK, TIMEOUT)
+
+
+class SharedResponse(NamedTuple):
+    """Ответ лидера для ведомых (заголовки - без Content-Length)"""
+
+    status: int
+    headers: list
+    body: bytes
+
+
+def flight_key(target: str, header: Callable[[str], Optional[str]]) -> tuple:
+    """Ключ запроса: путь с query и значения VARY_HEADERS (header(name) -> значение)"""
+    return (target, *(header(name) for name in VARY_HEADERS))
+
+
+class _Flights:
+    """Выполняющиеся запросы по ключу и счётчики по маршрутам"""
+
+    def __init__(self, max_bytes: int = 2**20, counter=None):
+        # Больший ответ передаётся клиенту лидера потоком, ведомые идут в сервис сами
+        self.max_bytes = max_bytes
+        # Счётчик метрик (message_broker.metrics.Counter): inc((маршрут, роль))
+        self.counter = counter
+        self._flights: dict = {}
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, int]] = {}
+
+    def _join(self, key: tuple, route: str, new_flight: Callable[[], object]) -> Tuple[bool, object]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = new_flight()
+                self._count_locked(route, LEADER)
+                return True, flight
+            return False, flight
+
+    def _finish(self, key: tuple, flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def count(self, route: str, role: str) -> None:
+        with self._lock:
+            self._count_locked(route, role)
+
+    def _count_locked(self, route: str, role: str) -> None:
+        counters = self._routes.get(route)
+        if counters is None:
+            counters = self._routes[route] = dict.fromkeys(ROLES, 0)
+        counters[role] += 1
+        if self.counter is not None:
+            self.counter.inc((route, role))
+
+    def stats(self) -> dict:
+        """По маршрутам и всего: запросы по ролям и доля обслуженных без своего запроса в сервис"""
+        with self._lock:
+            routes = {route: {**counters, "ratio": _ratio(counters)} for route, counters in self._routes.items()}
+            in_flight = len(self._flights)
+        totals = {role: sum(counters[role] for counters in routes.values()) for role in ROLES}
+        return {"in_flight": in_flight, "max_bytes": self.max_bytes, **totals, "ratio": _ratio(totals), "routes": routes}
+
+
+class _Flight:
+    __slots__ = ("finished", "result")
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result: Optional[SharedResponse] = None
+
+
+class SingleFlight(_Flights):
+    """Single-flight для потоков"""
+
+    def join(self, key: tuple, route: str) -> Tuple[bool, _Flight]:
+        """(True, flight) - запрос в сервис делает вызывающий и затем done(); иначе - wait()"""
+        return self._join(key, route, _Flight)
+
+    def wait(self, flight: _Flight, route: str, timeout: float) -> Optional[SharedResponse]:
+        """Ответ лидера; None - ответ не буферизован, нужен свой запрос; TimeoutError - лидер не успел"""
+        if not flight.finished.wait(timeout):
+            self.count(route, TIMEOUT)
+            raise TimeoutError(f"Нет ответа на такой же запрос за {timeout} с")
+        self.count(route, FOLLOWER if flight.result is not None else FALLBACK)
+        return flight.result
+
+    def done(self, key: tuple, flight: _Flight, result: Optional[SharedResponse]) -> None:
+        """Лидер получил ответ (или None - не буферизован): разбудить ведомых"""
+        self._finish(key, flight)
+        if not flight.finished.is_set():
+            flight.result = result
+            flight.finished.set()
+
+
+class AsyncSingleFlight(_Flights):
+    """Single-flight для цикла событий: ведомые ждут future лидера"""
+
+    def join(self, key: tuple, route: str) -> Tuple[bool, asyncio.Future]:
+        return self._join(key, route, asyncio.get_running_loop().create_future)
+
+    async def wait(self, flight: asyncio.Future, route: str, timeout: float) -> Optional[SharedResponse]:
+        try:
+            # shield: таймаут одного ведомого не отменяет ожидание остальных
+            result = await asyncio.wait_for(asyncio.shield(flight), timeout)
+        except asyncio.TimeoutError:
+            self.count(route, TIMEOUT)
+            raise TimeoutError(f"Нет ответа на такой же запрос за {timeout} с")
+        self.count(route, FOLLOWER if result is not None else FALLBACK)
+        return result
+
+    def done(self, key: tuple, flight: asyncio.Future, result: Optional[SharedResponse]) -> None:
+        self._finish(key, flight)
+        if not flight.done():
+            flight.set_result(result)
+
+
+def _ratio(counters: Dict[str, int]) -> float:
+    total = sum(counters[role] for role in ROLES)
+    return round(counters[FOLLOWER] / total, 4) if total else 0.0
@@ -4,104 +4,697 @@ API Gateway for Booking & Payment Services
 Запускается на порту 5000 и пробрасывает:
 - /api/bookings*  → Booking Service
 - /api/payments*  → Payment Service
+
+Ответы сервисов передаются как есть (код, заголовки, тело потоком) через
+пул соединений - см. proxy.py.
+
+GATEWAY_MODE=asyncio - те же маршруты в asyncio-режиме (async_gateway.py):
+один поток на тысячи одновременных запросов к медленным сервисам.
+
+GET-ответы броней и платежей кэшируются (cache.py, GATEWAY_CACHE=0 - без
+кэша). Записи инвалидируются по событиям брокера booking.* / payment.*
+(подписчик "gateway") и сразу после записи через gateway.
+
+Одинаковые одновременные GET-запросы на чтение объединяются (coalesce.py,
+GATEWAY_COALESCE=0 - без объединения): в сервис идёт один запрос, его ответ
+получают все. Счётчики - GET /metrics (Prometheus) и GET /gateway/coalescing.
+
+Нагрузка ограничивается (ratelimit.py, GATEWAY_RATE_LIMIT=0 - без лимитов
+клиентов): token bucket на клиента и на дорогие маршруты - 429, лимит
+одновременных запросов к сервису с ограниченной очередью - 503; оба с
+Retry-After. Состояние - GET /gateway/limits.
+
+GET /api/bookings/<id>/details - бронь, её платежи и последние уведомления
+одним ответом: части запрашиваются из сервисов одновременно (aggregate.py).
 """
 
+import json
 import os
-import requests
-from flask import Flask, request, jsonify
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import urllib3
+
+# Добавляем корень проекта в sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
+from message_broker.client import TOKEN_HEADER, is_broker_request, start_membership
+from message_broker.metrics import PROMETHEUS_CONTENT_TYPE, Registry
+from message_broker.transport import register_consumer
+from schemas.envelope import decode_message
+
+try:
+    from aggregate import Part, PartResult, fan_out, merge, part_result
+    from cache import CachePolicy, GatewayCache, ResponseCache
+    from coalesce import AsyncSingleFlight, SharedResponse, SingleFlight, flight_key
+    from proxy import UpstreamProxy
+    from ratelimit import AdmissionControl, RateLimiter, client_id, parse_limits, retry_after_header
+except ImportError:
+    from api_gateway.aggregate import Part, PartResult, fan_out, merge, part_result
+    from api_gateway.cache import CachePolicy, GatewayCache, ResponseCache
+    from api_gateway.coalesce import AsyncSingleFlight, SharedResponse, SingleFlight, flight_key
+    from api_gateway.proxy import UpstreamProxy
+    from api_gateway.ratelimit import AdmissionControl, RateLimiter, client_id, parse_limits, retry_after_header
+
 app = Flask(__name__)
 CORS(app)
 
 # Куда проксируем
 BOOKING_SERVICE_URL = os.getenv("BOOKING_SERVICE_URL", "http://localhost:5001")
 PAYMENT_SERVICE_URL = os.getenv("PAYMENT_SERVICE_URL", "http://localhost:5002")
+# Только для составных ответов (уведомления брони), напрямую не проксируется
+NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://localhost:5004")
 
 # Порт GATEWAY
 PORT = int(os.getenv("PORT", 5000))
 
+# Соединений в пуле на сервис и таймаут запроса к сервису, с
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", 32))
+GATEWAY_UPSTREAM_TIMEOUT = float(os.getenv("GATEWAY_UPSTREAM_TIMEOUT", 10))
+
+# Режим: threaded (Flask, поток на запрос) или asyncio
+GATEWAY_MODE = os.getenv("GATEWAY_MODE", "threaded").lower()
+# asyncio: одновременных запросов к одному сервису, остальные ждут слот
+GATEWAY_ASYNC_MAX_CONCURRENCY = int(os.getenv("GATEWAY_ASYNC_MAX_CONCURRENCY", 1000))
+
+# Кэш ответов: записей, байт всего и на одну запись; TTL по маршрутам, с
+GATEWAY_CACHE = os.getenv("GATEWAY_CACHE", "1") != "0"
+GATEWAY_CACHE_MAX_ENTRIES = int(os.getenv("GATEWAY_CACHE_MAX_ENTRIES", 10_000))
+GATEWAY_CACHE_MAX_BYTES = int(os.getenv("GATEWAY_CACHE_MAX_BYTES", 64 * 2**20))
+GATEWAY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("GATEWAY_CACHE_MAX_ENTRY_BYTES", 2**20))
+GATEWAY_CACHE_TTL_BOOKING = float(os.getenv("GATEWAY_CACHE_TTL_BOOKING", 60))
+GATEWAY_CACHE_TTL_AVAILABILITY = float(os.getenv("GATEWAY_CACHE_TTL_AVAILABILITY", 30))
+GATEWAY_CACHE_TTL_PAYMENT = float(os.getenv("GATEWAY_CACHE_TTL_PAYMENT", 30))
+
+# Объединение одинаковых одновременных GET; больший ответ ведомым не передаётся, байт
+GATEWAY_COALESCE = os.getenv("GATEWAY_COALESCE", "1") != "0"
+GATEWAY_COALESCE_MAX_BYTES = int(os.getenv("GATEWAY_COALESCE_MAX_BYTES", 2**20))
+
+# Лимиты клиента (token bucket): запросов/с и ёмкость на все маршруты вместе и
+# для отдельных маршрутов ("endpoint=запросов/с/ёмкость,..."); клиентов в памяти
+GATEWAY_RATE_LIMIT = os.getenv("GATEWAY_RATE_LIMIT", "1") != "0"
+GATEWAY_CLIENT_RATE = float(os.getenv("GATEWAY_CLIENT_RATE", 50))
+GATEWAY_CLIENT_BURST = float(os.getenv("GATEWAY_CLIENT_BURST", 100))
+GATEWAY_ROUTE_LIMITS = parse_limits(os.getenv(
+    "GATEWAY_ROUTE_LIMITS",
+    "gw_bookings_availability=5/10,gw_export_payments=0.2/2,gw_batch_get_payments=5/10",
+))
+GATEWAY_RATE_LIMIT_MAX_CLIENTS = int(os.getenv("GATEWAY_RATE_LIMIT_MAX_CLIENTS", 100_000))
+# Заголовок с адресом клиента (gateway за балансировщиком); пусто - адрес соединения
+GATEWAY_CLIENT_ID_HEADER = os.getenv("GATEWAY_CLIENT_ID_HEADER", "")
+
+# threaded: одновременных запросов к одному сервису и очередь ожидания слота
+# (asyncio: GATEWAY_ASYNC_MAX_CONCURRENCY / GATEWAY_ASYNC_QUEUE_SIZE); ожидание слота, с
+GATEWAY_MAX_CONCURRENCY = int(os.getenv("GATEWAY_MAX_CONCURRENCY", 64))
+GATEWAY_QUEUE_SIZE = int(os.getenv("GATEWAY_QUEUE_SIZE", 256))
+GATEWAY_ASYNC_QUEUE_SIZE = int(os.getenv("GATEWAY_ASYNC_QUEUE_SIZE", 10_000))
+GATEWAY_QUEUE_TIMEOUT = float(os.getenv("GATEWAY_QUEUE_TIMEOUT", GATEWAY_UPSTREAM_TIMEOUT))
+# Retry-After при сбросе нагрузки (503), с
+GATEWAY_RETRY_AFTER = float(os.getenv("GATEWAY_RETRY_AFTER", 1))
 
-def _proxy(method: str, base_url: str, path: str, **kwargs):
-    """Общий прокси-хелпер"""
-    url = f"{base_url}{path}"
+# Составные ответы: ожидание всех частей, с; потоков для частей (threaded);
+# уведомлений в /api/bookings/<id>/details по умолчанию
+GATEWAY_DETAILS_TIMEOUT = float(os.getenv("GATEWAY_DETAILS_TIMEOUT", 3))
+GATEWAY_FANOUT_WORKERS = int(os.getenv("GATEWAY_FANOUT_WORKERS", 32))
+GATEWAY_DETAILS_NOTIFICATIONS = int(os.getenv("GATEWAY_DETAILS_NOTIFICATIONS", 10))
+
+MESSAGE_BROKER_URL = os.getenv("MESSAGE_BROKER_URL", "http://localhost:5050/broker/publish")
+# Публичный адрес gateway: если задан, gateway сам подписывается в брокере
+SERVICE_PUBLIC_URL = os.getenv("SERVICE_PUBLIC_URL")
+# Общий секрет с брокером: /broker/consume принимается только с ним
+# (X-Broker-Token); не задан - только с локального адреса
+BROKER_CONSUME_TOKEN = os.getenv("BROKER_CONSUME_TOKEN") or None
+
+# События, по которым инвалидируется кэш
+SUBSCRIBED_EVENTS = [
+    "booking.created",
+    "booking.confirmed",
+    "booking.cancelled",
+    "payment.succeeded",
+    "payment.failed",
+]
+
+upstream = UpstreamProxy(pool_size=GATEWAY_POOL_SIZE, timeout=GATEWAY_UPSTREAM_TIMEOUT)
+
+
+# ---------- Кэш ответов ----------
+# Теги: booking:<id>, payment:<id>, booking_payments:<booking_id>,
+# availability:<hall_id> / availability:* (запрос без hall_id) и
+# availability (все ответы о доступности)
+
+def _json_body(body: bytes) -> dict:
     try:
-        resp = requests.request(method, url, timeout=10, **kwargs)
-        # Пытаемся парсить JSON, если не получается - возвращаем текст как ошибку
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _availability_tags(hall_id) -> list:
+    # Зал неизвестен - устаревают все ответы о доступности
+    return [f"availability:{hall_id}", "availability:*"] if hall_id else ["availability"]
+
+
+def _payment_list_tags(view_args: dict, args: dict, body: bytes) -> list:
+    # Список меняется и при новом платеже бронирования, и при смене статуса любого из платежей
+    payments = _json_body(body).get("payments") or []
+    tags = [f"payment:{p['payment_id']}" for p in payments if isinstance(p, dict) and "payment_id" in p]
+    return [f"booking_payments:{args.get('booking_id')}", *tags]
+
+
+CACHE_POLICIES = {
+    "gw_booking_item": CachePolicy(
+        GATEWAY_CACHE_TTL_BOOKING, lambda view_args, args, body: [f"booking:{view_args['booking_id']}"]
+    ),
+    "gw_bookings_availability": CachePolicy(
+        GATEWAY_CACHE_TTL_AVAILABILITY,
+        lambda view_args, args, body: ["availability", f"availability:{args.get('hall_id') or '*'}"],
+    ),
+    "gw_payments_collection": CachePolicy(GATEWAY_CACHE_TTL_PAYMENT, _payment_list_tags),
+    "gw_get_payment": CachePolicy(
+        GATEWAY_CACHE_TTL_PAYMENT, lambda view_args, args, body: [f"payment:{view_args['payment_id']}"]
+    ),
+    "gw_list_refunds": CachePolicy(
+        GATEWAY_CACHE_TTL_PAYMENT, lambda view_args, args, body: [f"payment:{view_args['payment_id']}"]
+    ),
+}
+
+
+def write_tags(endpoint: str, view_args: dict, body: bytes) -> list:
+    """Что устаревает после успешного не-GET запроса через gateway"""
+    if endpoint == "gw_booking_item":
+        # DELETE: зал отменённой брони в запросе неизвестен
+        return [f"booking:{view_args['booking_id']}", "availability"]
+    if endpoint == "gw_booking_confirm":
+        return [f"booking:{view_args['booking_id']}"]
+    if endpoint == "gw_bookings_collection":
+        return _availability_tags(_json_body(body).get("hall_id"))
+    if endpoint == "gw_payments_collection":
+        return [f"booking_payments:{_json_body(body).get('booking_id')}"]
+    if endpoint == "gw_refund_payment":
+        return [f"payment:{view_args['payment_id']}"]
+    # batch-get - чтение
+    return []
+
+
+def event_tags(event_type: str, payload: dict) -> list:
+    """Что устаревает по событию брокера"""
+    if event_type.startswith("booking."):
+        booking = payload.get("booking") or {}
+        booking_id = payload.get("booking_id") or booking.get("booking_id")
+        tags = [f"booking:{booking_id}"] if booking_id else []
+        return tags + _availability_tags(payload.get("hall_id") or booking.get("hall_id"))
+    if event_type.startswith("payment."):
+        payment = payload.get("payment") or {}
+        payment_id = payload.get("payment_id") or payment.get("payment_id")
+        booking_id = payload.get("booking_id") or payment.get("booking_id")
+        tags = [f"payment:{payment_id}"] if payment_id else []
+        return tags + ([f"booking_payments:{booking_id}"] if booking_id else [])
+    return []
+
+
+gateway_cache = GatewayCache(
+    ResponseCache(GATEWAY_CACHE_MAX_ENTRIES, GATEWAY_CACHE_MAX_BYTES),
+    CACHE_POLICIES,
+    write_tags,
+    event_tags,
+    GATEWAY_CACHE_MAX_ENTRY_BYTES,
+) if GATEWAY_CACHE else None
+
+# ---------- Объединение одинаковых запросов ----------
+
+# GET-маршруты на чтение с ответом ограниченного размера: кэш и single-flight
+READ_ROUTES = set(CACHE_POLICIES)
+
+# Метрики gateway (GET /metrics - формат Prometheus)
+metrics = Registry()
+coalesced_total = metrics.counter(
+    "gateway_coalesced_requests_total",
+    "GET-запросы на чтение: leader - в сервис, follower - ответ такого же запроса, fallback, timeout",
+    ("route", "role"),
+)
+coalescing_ratio = metrics.gauge(
+    "gateway_coalescing_ratio", "Доля GET-запросов, получивших ответ такого же выполняющегося запроса", ("route",)
+)
+
+# В asyncio-режиме заменяется на AsyncSingleFlight (run_asyncio)
+coalescer = SingleFlight(GATEWAY_COALESCE_MAX_BYTES, coalesced_total) if GATEWAY_COALESCE else None
+
+# ---------- Ограничение нагрузки ----------
+
+rate_limited_total = metrics.counter(
+    "gateway_rate_limited_requests_total", "Отклонено лимитами клиента (429)", ("route",)
+)
+shed_total = metrics.counter(
+    "gateway_shed_requests_total", "Сброшено при перегрузке сервиса: очередь заполнена или таймаут (503)", ("upstream",)
+)
+
+rate_limiter = RateLimiter(
+    GATEWAY_CLIENT_RATE,
+    GATEWAY_CLIENT_BURST,
+    GATEWAY_ROUTE_LIMITS,
+    GATEWAY_RATE_LIMIT_MAX_CLIENTS,
+    counter=rate_limited_total,
+) if GATEWAY_RATE_LIMIT else None
+
+# Адрес сервиса -> лимит одновременных запросов к нему (threaded)
+admissions: dict = {}
+
+
+def admission_for(base_url: str) -> AdmissionControl:
+    admission = admissions.get(base_url)
+    if admission is None:
+        admission = admissions.setdefault(base_url, AdmissionControl(
+            GATEWAY_MAX_CONCURRENCY, GATEWAY_QUEUE_SIZE, GATEWAY_QUEUE_TIMEOUT, shed_total, base_url
+        ))
+    return admission
+
+
+def _rejected(status: int, message: str, retry_after: float):
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers["Retry-After"] = retry_after_header(retry_after)
+    return response
+
+
+def upstreams() -> dict:
+    """Префикс пути -> сервис (маршруты ниже и asyncio-режим)"""
+    return {
+        "/api/bookings": BOOKING_SERVICE_URL,
+        "/api/payments": PAYMENT_SERVICE_URL,
+        "/api/notifications": NOTIFICATION_SERVICE_URL,
+    }
+
+
+def _forward(method: str, base_url: str, path: str):
+    """Запрос к сервису в пределах лимита одновременных запросов; слот занят до конца передачи ответа"""
+    admission = admission_for(base_url)
+    if not admission.acquire():
+        print(f"[Gateway] Load shed: {method} {base_url}{path}")
+        return _rejected(503, f"Сервис {base_url} перегружен, повторите позже", GATEWAY_RETRY_AFTER)
+    try:
+        return upstream.forward(method, base_url, path, on_close=admission.release)
+    except BaseException:
+        admission.release()
+        raise
+
+
+def _proxy(method: str, base_url: str, path: str):
+    """Общий прокси-хелпер: текущий запрос → сервис (или кэш), ответ → клиенту"""
+    if method == "GET" and request.endpoint in READ_ROUTES:
+        return _read(base_url, path)
+    response = _forward(method, base_url, path)
+    if gateway_cache is not None:
+        gateway_cache.after_write(
+            method, request.endpoint, request.view_args or {}, request.get_data(), response.status_code
+        )
+    return response
+
+
+def _read(base_url: str, path: str):
+    """GET на чтение: из кэша, из ответа такого же выполняющегося запроса или из сервиса"""
+    lookup = None
+    if gateway_cache is not None:
+        cached, lookup = gateway_cache.lookup(
+            "GET", request.endpoint, request.view_args or {}, path,
+            request.query_string.decode("latin-1"), request.args.to_dict(), request.headers.get,
+        )
+        if cached is not None:
+            return Response(cached.body, status=cached.status, headers=[*cached.headers, ("X-Cache", "HIT")])
+    if coalescer is None:
+        return _fetch(base_url, path, lookup, share=False)[0]
+
+    key = flight_key(request.full_path, request.headers.get)
+    leader, flight = coalescer.join(key, request.endpoint)
+    if not leader:
         try:
-            data = resp.json()
-        except (ValueError, requests.exceptions.JSONDecodeError):
-            data = {"error": resp.text[:200]}  # Ограничиваем длину текста
-        return (data, resp.status_code)
-    except Exception as e:
-        print(f"[Gateway] Error proxying {method} {url}: {e}")
-        return {"error": str(e)}, 502
+            shared = coalescer.wait(flight, request.endpoint, GATEWAY_UPSTREAM_TIMEOUT)
+        except TimeoutError as e:
+            error = jsonify({"error": str(e)})
+            error.status_code = 504
+            return error
+        if shared is not None:
+            return Response(shared.body, status=shared.status, headers=[*shared.headers, ("X-Coalesced", "1")])
+        return _fetch(base_url, path, lookup, share=False)[0]
+
+    shared = None
+    try:
+        response, shared = _fetch(base_url, path, lookup, share=True)
+    finally:
+        coalescer.done(key, flight, shared)
+    return response
+
+
+def _fetch(base_url: str, path: str, lookup, share: bool) -> tuple:
+    """Ответ сервиса и (share) его копия для ведомых, если он буферизуется целиком"""
+    response = _forward("GET", base_url, path)
+    headers = list(response.headers.items())
+    cacheable = lookup is not None and gateway_cache.cacheable(response.status_code, headers)
+    length = response.content_length
+    shareable = share and length is not None and length <= coalescer.max_bytes
+    shared = None
+    if cacheable or shareable:
+        # Тело небольшое (Content-Length в пределах записи кэша / ответа ведомым) - читается целиком
+        response.direct_passthrough = False
+        body = response.get_data()
+        if cacheable:
+            gateway_cache.store(lookup, response.status_code, headers, body)
+        if shareable:
+            shared = SharedResponse(
+                response.status_code, [(name, value) for name, value in headers if name.lower() != "content-length"], body
+            )
+    if lookup is not None:
+        response.headers["X-Cache"] = "MISS"
+    return response, shared
+
+
+# ---------- Составные ответы ----------
+
+# Потоки для частей составных ответов (запрос клиента ждёт все части в своём потоке)
+fanout_pool = ThreadPoolExecutor(GATEWAY_FANOUT_WORKERS, thread_name_prefix="gateway-fanout")
+
+
+def booking_details_parts(view_args: dict, args: dict) -> list:
+    """Части /api/bookings/<id>/details: бронь (обязательна), её платежи и последние уведомления"""
+    booking_id = view_args["booking_id"]
+    limit = args.get("notifications_limit") or GATEWAY_DETAILS_NOTIFICATIONS
+    return [
+        Part("booking", f"/api/bookings/{booking_id}", endpoint="gw_booking_item", view_args=view_args, required=True),
+        Part(
+            "payments", "/api/payments", urlencode({"booking_id": booking_id}),
+            endpoint="gw_payments_collection", field="payments",
+        ),
+        Part(
+            "notifications", "/api/notifications", urlencode({"booking_id": booking_id, "limit": limit}),
+            field="notifications",
+        ),
+    ]
+
+
+def _service_url(path: str) -> str:
+    return next(url for prefix, url in upstreams().items() if path.startswith(prefix))
+
+
+def _fetch_part(part: Part, headers: dict) -> PartResult:
+    """Часть составного ответа: из кэша или из сервиса в пределах его лимита одновременных запросов"""
+    lookup = None
+    if gateway_cache is not None and part.endpoint is not None:
+        cached, lookup = gateway_cache.lookup(
+            "GET", part.endpoint, part.view_args, part.path, part.query, part.args, headers.get
+        )
+        if cached is not None:
+            return part_result(part, cached.status, cached.body)
+    base_url = _service_url(part.path)
+    admission = admission_for(base_url)
+    if not admission.acquire():
+        return PartResult(503, error=f"Сервис {base_url} перегружен")
+    try:
+        status, response_headers, body = upstream.fetch(f"{base_url}{part.target}", headers, GATEWAY_DETAILS_TIMEOUT)
+    except urllib3.exceptions.HTTPError as e:
+        print(f"[Gateway] Error fetching {part.name} {base_url}{part.target}: {e}")
+        return PartResult(502, error=str(e))
+    finally:
+        admission.release()
+    if lookup is not None and gateway_cache.cacheable(status, response_headers):
+        gateway_cache.store(lookup, status, response_headers, body)
+    return part_result(part, status, body)
+
+
+def _aggregate(parts: list):
+    # Заголовки запроса клиента - до передачи частей в другие потоки
+    headers = {name: request.headers[name] for name in ("Accept", "Authorization", "X-Request-Id") if name in request.headers}
+    # Ответы частей разбираются в gateway - без сжатия
+    headers["Accept-Encoding"] = "identity"
+    results = fan_out(fanout_pool, lambda part: _fetch_part(part, headers), parts, GATEWAY_DETAILS_TIMEOUT)
+    status, data = merge(parts, results)
+    return jsonify(data), status
 
 
 # ---------- BOOKING ----------
 
 @app.route("/api/bookings", methods=["GET", "POST"])
 def gw_bookings_collection():
-    if request.method == "GET":
-        data, code = _proxy("GET", BOOKING_SERVICE_URL, "/api/bookings")
-        return jsonify(data), code
-    else:
-        data, code = _proxy("POST", BOOKING_SERVICE_URL, "/api/bookings", json=request.json)
-        return jsonify(data), code
+    return _proxy(request.method, BOOKING_SERVICE_URL, "/api/bookings")
 
 
 @app.route("/api/bookings/availability", methods=["GET"])
 def gw_bookings_availability():
-    data, code = _proxy("GET", BOOKING_SERVICE_URL, "/api/bookings/availability", params=request.args)
-    if code >= 400:
-        print(f"[Gateway] Availability error: code={code}, data={data}")
-    return jsonify(data), code
+    response = _proxy("GET", BOOKING_SERVICE_URL, "/api/bookings/availability")
+    if response.status_code >= 400:
+        print(f"[Gateway] Availability error: code={response.status_code}")
+    return response
 
 
 @app.route("/api/bookings/<booking_id>", methods=["GET", "DELETE"])
 def gw_booking_item(booking_id: str):
-    if request.method == "GET":
-        data, code = _proxy("GET", BOOKING_SERVICE_URL, f"/api/bookings/{booking_id}")
-    else:
-        data, code = _proxy("DELETE", BOOKING_SERVICE_URL, f"/api/bookings/{booking_id}")
-    return jsonify(data), code
+    return _proxy(request.method, BOOKING_SERVICE_URL, f"/api/bookings/{booking_id}")
 
 
 @app.route("/api/bookings/<booking_id>/confirm", methods=["POST"])
 def gw_booking_confirm(booking_id: str):
-    data, code = _proxy("POST", BOOKING_SERVICE_URL, f"/api/bookings/{booking_id}/confirm")
-    return jsonify(data), code
+    return _proxy("POST", BOOKING_SERVICE_URL, f"/api/bookings/{booking_id}/confirm")
+
+
+@app.route("/api/bookings/<booking_id>/details", methods=["GET"])
+def gw_booking_details(booking_id: str):
+    # Бронь, платежи и уведомления - параллельно, одним ответом
+    return _aggregate(booking_details_parts(request.view_args, request.args.to_dict()))
 
 
 # ---------- PAYMENTS ----------
 
-@app.route("/api/payments", methods=["POST"])
-def gw_create_payment():
-    data, code = _proxy("POST", PAYMENT_SERVICE_URL, "/api/payments", json=request.json)
-    return jsonify(data), code
+@app.route("/api/payments", methods=["GET", "POST"])
+def gw_payments_collection():
+    return _proxy(request.method, PAYMENT_SERVICE_URL, "/api/payments")
+
+
+@app.route("/api/payments/batch-get", methods=["POST"])
+def gw_batch_get_payments():
+    return _proxy("POST", PAYMENT_SERVICE_URL, "/api/payments/batch-get")
+
+
+@app.route("/api/payments/export", methods=["GET"])
+def gw_export_payments():
+    # CSV / NDJSON передаётся потоком, не накапливаясь в gateway
+    return _proxy("GET", PAYMENT_SERVICE_URL, "/api/payments/export")
 
 
 @app.route("/api/payments/<payment_id>", methods=["GET"])
 def gw_get_payment(payment_id: str):
-    data, code = _proxy("GET", PAYMENT_SERVICE_URL, f"/api/payments/{payment_id}")
-    return jsonify(data), code
+    return _proxy("GET", PAYMENT_SERVICE_URL, f"/api/payments/{payment_id}")
 
 
 @app.route("/api/payments/<payment_id>/refund", methods=["POST"])
 def gw_refund_payment(payment_id: str):
-    data, code = _proxy("POST", PAYMENT_SERVICE_URL, f"/api/payments/{payment_id}/refund", json=request.json)
-    return jsonify(data), code
+    return _proxy("POST", PAYMENT_SERVICE_URL, f"/api/payments/{payment_id}/refund")
+
+
+@app.route("/api/payments/<payment_id>/refunds", methods=["GET"])
+def gw_list_refunds(payment_id: str):
+    return _proxy("GET", PAYMENT_SERVICE_URL, f"/api/payments/{payment_id}/refunds")
+
+
+# Маршруты, которые проксируются в сервисы (лимиты клиентов)
+PROXIED_ROUTES = {rule.endpoint for rule in app.url_map.iter_rules() if rule.rule.startswith("/api/")}
+
+
+@app.before_request
+def limit_client_rate():
+    """Лимиты клиента - до кэша и сервиса: превышение - 429 с Retry-After"""
+    if rate_limiter is None or request.endpoint not in PROXIED_ROUTES:
+        return None
+    header = request.headers.get(GATEWAY_CLIENT_ID_HEADER) if GATEWAY_CLIENT_ID_HEADER else None
+    wait = rate_limiter.check(client_id(request.remote_addr, header), request.endpoint)
+    if wait:
+        return _rejected(429, "Слишком много запросов, повторите позже", wait)
+    return None
+
+
+# ---------- Broker ----------
+
+def handle_broker_message(message: dict) -> str:
+    if gateway_cache is None:
+        return "ignored"
+    return gateway_cache.handle_event(message)
+
+
+def consume(body: bytes, content_type: str) -> tuple:
+    """Сообщение брокера -> инвалидация кэша; (код, ответ) - общий для обоих режимов"""
+    try:
+        message = decode_message(body, content_type)
+    except ValueError as e:
+        print(f"❌ Не удалось разобрать сообщение брокера: {e}")
+        return 200, {"status": "processed_with_error"}
+    return 200, {"status": handle_broker_message(message)}
+
+
+def cache_stats(body: bytes = b"", content_type: str = None) -> tuple:
+    """Попадания по маршрутам, память и инвалидации кэша ответов"""
+    if gateway_cache is None:
+        return 200, {"enabled": False}
+    return 200, {"enabled": True, **gateway_cache.stats()}
+
+
+def authorize(endpoint: str, headers: dict, remote_addr: str = None):
+    """
+    Доступ к маршрутам gateway без сервиса (общий для обоих режимов; headers -
+    имена в нижнем регистре): /broker/consume - только брокеру, иначе (403, ответ)
+    """
+    if endpoint != "consume_message":
+        return None
+    if is_broker_request(headers.get(TOKEN_HEADER.lower()), BROKER_CONSUME_TOKEN, remote_addr):
+        return None
+    print(f"⚠️ /broker/consume: запрос не от брокера ({remote_addr})")
+    return 403, {"error": "Доступно только брокеру сообщений"}
+
+
+@app.before_request
+def authorize_broker():
+    headers = {name.lower(): value for name, value in request.headers.items()}
+    denied = authorize(request.endpoint, headers, request.remote_addr)
+    if denied is not None:
+        status, data = denied
+        return jsonify(data), status
+    return None
+
+
+@app.route("/broker/consume", methods=["POST"])
+def consume_message():
+    status, data = consume(request.get_data(), request.content_type)
+    return jsonify(data), status
+
+
+# Во встроенном режиме брокер вызывает обработчик напрямую
+register_consumer("gateway", lambda message: bool(handle_broker_message(message)), SUBSCRIBED_EVENTS)
+
+
+def coalescing_stats(body: bytes = b"", content_type: str = None) -> tuple:
+    """Объединённые запросы по маршрутам: leader / follower / fallback / timeout и доля follower"""
+    if coalescer is None:
+        return 200, {"enabled": False}
+    return 200, {"enabled": True, **coalescer.stats()}
+
+
+def prometheus_text(body: bytes = b"", content_type: str = None) -> tuple:
+    """Метрики gateway в текстовом формате Prometheus: (код, текст, Content-Type)"""
+    if coalescer is not None:
+        for route, counters in coalescer.stats()["routes"].items():
+            coalescing_ratio.set((route,), counters["ratio"])
+    return 200, metrics.render(), PROMETHEUS_CONTENT_TYPE
+
+
+def limits_stats(body: bytes = b"", content_type: str = None) -> tuple:
+    """Лимиты клиентов (разрешено / отклонено по маршрутам) и очереди к сервисам (threaded)"""
+    return 200, {
+        "rate_limit": rate_limiter.stats() if rate_limiter is not None else None,
+        "upstreams": {base_url: admission.stats() for base_url, admission in list(admissions.items())},
+    }
+
+
+@app.route("/gateway/cache", methods=["GET"])
+def gateway_cache_stats():
+    status, data = cache_stats()
+    return jsonify(data), status
+
+
+@app.route("/gateway/coalescing", methods=["GET"])
+def gateway_coalescing_stats():
+    status, data = coalescing_stats()
+    return jsonify(data), status
+
+
+@app.route("/gateway/limits", methods=["GET"])
+def gateway_limits_stats():
+    status, data = limits_stats()
+    return jsonify(data), status
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    status, text, content_type = prometheus_text()
+    return Response(text, status=status, mimetype=None, content_type=content_type)
+
+
+def local_endpoints() -> dict:
+    """
+    Маршруты, которые gateway обслуживает сам (asyncio-режим):
+    endpoint -> (тело, Content-Type) -> (код, JSON) или (код, текст, Content-Type)
+    """
+    return {
+        "consume_message": consume,
+        "gateway_cache_stats": cache_stats,
+        "gateway_coalescing_stats": coalescing_stats,
+        "gateway_limits_stats": limits_stats,
+        "prometheus_metrics": prometheus_text,
+    }
+
+
+def aggregate_endpoints() -> dict:
+    """Составные ответы (asyncio-режим): endpoint -> (аргументы пути, query) -> части"""
+    return {"gw_booking_details": booking_details_parts}
 
 
 # ---------- Health ----------
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "healthy", "service": "api-gateway"}), 200
+    cache = gateway_cache.stats() if gateway_cache is not None else None
+    coalescing = coalescer.stats() if coalescer is not None else None
+    return jsonify({"status": "healthy", "service": "api-gateway", "cache": cache, "coalescing": coalescing}), 200
+
+
+def run_asyncio() -> None:
+    global coalescer
+    import asyncio
+
+    try:
+        from async_gateway import serve
+    except ImportError:
+        from api_gateway.async_gateway import serve
+
+    if coalescer is not None:
+        coalescer = AsyncSingleFlight(GATEWAY_COALESCE_MAX_BYTES, coalesced_total)
+    asyncio.run(serve(
+        app.url_map,
+        upstreams(),
+        port=PORT,
+        limit=GATEWAY_ASYNC_MAX_CONCURRENCY,
+        timeout=GATEWAY_UPSTREAM_TIMEOUT,
+        pool_size=GATEWAY_POOL_SIZE,
+        cache=gateway_cache,
+        local=local_endpoints(),
+        aggregates=aggregate_endpoints(),
+        aggregate_timeout=GATEWAY_DETAILS_TIMEOUT,
+        authorize=authorize,
+        coalescer=coalescer,
+        read_routes=READ_ROUTES,
+        limiter=rate_limiter,
+        client_header=GATEWAY_CLIENT_ID_HEADER,
+        queue=GATEWAY_ASYNC_QUEUE_SIZE,
+        queue_timeout=GATEWAY_QUEUE_TIMEOUT,
+        retry_after=GATEWAY_RETRY_AFTER,
+        shed_counter=shed_total,
+    ))
 
 
 if __name__ == "__main__":
-    print(f"🚀 Starting API Gateway on port {PORT}")
+    print(f"🚀 Starting API Gateway on port {PORT} ({GATEWAY_MODE})")
     print(f"➡️  Booking Service: {BOOKING_SERVICE_URL}")
     print(f"💳 Payment Service: {PAYMENT_SERVICE_URL}")
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    if SERVICE_PUBLIC_URL:
+        if not BROKER_CONSUME_TOKEN:
+            print("⚠️ BROKER_CONSUME_TOKEN не задан: /broker/consume принимается только с локального адреса")
+        start_membership(
+            MESSAGE_BROKER_URL.rsplit("/", 1)[0],
+            "gateway",
+            f"{SERVICE_PUBLIC_URL}/broker/consume",
+            SUBSCRIBED_EVENTS,
+        )
+    if GATEWAY_MODE == "asyncio":
+        run_asyncio()
+    else:
+        app.run(host="0.0.0.0", port=PORT, debug=True)
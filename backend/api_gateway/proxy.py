@@ -0,0 +1,123 @@
+"""
+Ядро прокси API Gateway: сквозная передача ответа сервиса
+
+- соединения с сервисами берутся из пула urllib3 (на нём построен requests;
+  без слоя requests - сотни микросекунд CPU на запрос меньше), а не
+  открываются на каждый запрос;
+- тело запроса и ответа передаётся как есть, без разбора JSON и повторного
+  jsonify: ответ сервиса читается потоком (preload_content=False) и отдаётся клиенту
+  частями, в том числе не-JSON (CSV-выгрузки) и большие ответы;
+- заголовки ответа сервиса передаются клиенту, кроме hop-by-hop и CORS
+  (CORS-заголовки ставит сам gateway).
+"""
+from typing import Callable, Optional
+
+import urllib3
+from flask import Response, jsonify, request
+from werkzeug.wsgi import ClosingIterator
+
+CHUNK_SIZE = 64 * 1024
+
+# Заголовки одного соединения (RFC 7230, 6.1) - не передаются дальше
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+# Заголовки запроса клиента, которые передаются сервису
+FORWARDED_REQUEST_HEADERS = ("Content-Type", "Accept", "Authorization", "Idempotency-Key", "X-Request-Id")
+# Заголовки ответа, которые выставляет сам gateway (Werkzeug / flask_cors)
+GATEWAY_RESPONSE_HEADERS = {"server", "date"}
+
+
+class UpstreamProxy:
+    """Пул соединений к сервисам и сквозная передача запросов"""
+
+    def __init__(self, pool_size: int = 32, timeout: float = 10):
+        self.timeout = urllib3.Timeout(total=timeout)
+        # Сервисов немного: пул соединений на каждый, до pool_size соединений в пуле
+        self.pool = urllib3.PoolManager(num_pools=8, maxsize=pool_size)
+
+    def forward(self, method: str, base_url: str, path: str, on_close: Optional[Callable[[], None]] = None) -> Response:
+        """
+        Передать текущий запрос Flask сервису base_url и вернуть его ответ потоком;
+        on_close - после передачи ответа клиенту (или обрыва)
+        """
+        url = f"{base_url}{path}"
+        if request.query_string:
+            url = f"{url}?{request.query_string.decode('latin-1')}"
+        headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+        # Тело ответа не распаковывается: сжатие - только если его понимает клиент
+        headers["Accept-Encoding"] = request.headers.get("Accept-Encoding", "identity")
+        try:
+            upstream = self.pool.urlopen(
+                method,
+                url,
+                body=request.get_data() or None,
+                headers=headers,
+                timeout=self.timeout,
+                preload_content=False,
+                redirect=False,
+                retries=False,
+            )
+        except urllib3.exceptions.HTTPError as e:
+            print(f"[Gateway] Error proxying {method} {url}: {e}")
+            error = jsonify({"error": str(e)})
+            error.status_code = 502
+            if on_close is not None:
+                error.call_on_close(on_close)
+            return error
+
+        # direct_passthrough: сервер WSGI закрывает сам итератор (call_on_close ответа не вызывается)
+        callbacks = [lambda: release(upstream)] + ([on_close] if on_close is not None else [])
+        return Response(
+            ClosingIterator(upstream.stream(CHUNK_SIZE, decode_content=False), callbacks),
+            status=upstream.status,
+            headers=response_headers(upstream.headers),
+            direct_passthrough=True,
+        )
+
+    def fetch(self, url: str, headers: dict, timeout: Optional[float] = None) -> tuple:
+        """
+        GET с телом целиком (части составных ответов): (код, заголовки, тело);
+        сервис недоступен - urllib3.exceptions.HTTPError
+        """
+        upstream = self.pool.request(
+            "GET",
+            url,
+            headers=headers,
+            timeout=urllib3.Timeout(total=timeout) if timeout is not None else self.timeout,
+            redirect=False,
+            retries=False,
+        )
+        return upstream.status, response_headers(upstream.headers), upstream.data
+
+
+def release(upstream: urllib3.HTTPResponse) -> None:
+    """
+    Дочитанное тело уже вернуло соединение в пул. Если клиент отключился
+    раньше, соединение закрывается: в нём остаток ответа
+    """
+    if not upstream.closed:
+        upstream.close()
+        upstream.release_conn()
+
+
+def response_headers(upstream_headers) -> list:
+    """Заголовки ответа сервиса, которые передаются клиенту"""
+    return [(name, value) for name, value in upstream_headers.items() if is_passed_through(name)]
+
+
+def is_passed_through(header: str) -> bool:
+    """Передаётся ли клиенту заголовок ответа сервиса (общая политика для обоих режимов gateway)"""
+    header = header.lower()
+    return (
+        header not in HOP_BY_HOP_HEADERS
+        and header not in GATEWAY_RESPONSE_HEADERS
+        and not header.startswith("access-control-")
+    )
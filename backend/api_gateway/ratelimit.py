@@ -0,0 +1,208 @@
+"""
+Ограничение нагрузки в API Gateway
+
+- RateLimiter - корзины токенов (token bucket) на клиента: общая на все
+  маршруты и отдельные для дорогих маршрутов (доступность, выгрузка).
+  Корзина - два числа (токены, время пересчёта); токены начисляются лениво
+  при проверке, поэтому проверка - O(1) без фоновых потоков. Клиентов в
+  памяти не больше max_keys на корзину: давно не обращавшийся вытесняется
+  (LRU) - его корзина за это время всё равно наполнилась бы.
+  Превышение - 429 с Retry-After (когда появится токен).
+- AdmissionControl - лимит одновременных запросов к сервису (Flask-режим)
+  с ограниченной очередью ожидания: очередь заполнена или слот не
+  освободился за timeout - 503 с Retry-After (сброс нагрузки), а не
+  неограниченное число потоков, ждущих перегруженный сервис.
+  В asyncio-режиме то же делает AsyncUpstream (async_gateway.py).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def parse_limits(raw: str) -> Dict[str, Tuple[float, float]]:
+    """Разбор строки вида "gw_bookings_availability=5/10,gw_export_payments=0.2/2" (запросов/с / ёмкость)"""
+    result = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            rate, _, burst = value.partition("/")
+            result[key.strip()] = (float(rate), float(burst or rate))
+    return result
+
+
+def client_id(remote_addr: Optional[str], header_value: Optional[str]) -> str:
+    """
+    Ключ клиента: адрес соединения или (gateway за балансировщиком) первый
+    адрес из заголовка вида X-Forwarded-For
+    """
+    if header_value:
+        return header_value.split(",", 1)[0].strip()
+    return remote_addr or "unknown"
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After - целые секунды, не меньше 1"""
+    return str(max(1, math.ceil(seconds)))
+
+
+class TokenBuckets:
+    """Корзины токенов по ключу: rate токенов/с, ёмкость burst, не больше max_keys корзин"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self._clock = clock
+        # ключ -> [токены, время пересчёта]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def take(self, key: str) -> float:
+        """Взять токен: 0 - разрешено, иначе через сколько секунд появится токен"""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.evictions += 1
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """
+    Лимиты клиента: client_rate / client_burst - на все маршруты вместе
+    (0 - без общего лимита), routes - endpoint -> (запросов/с, ёмкость)
+    для отдельных маршрутов
+    """
+
+    def __init__(
+        self,
+        client_rate: float,
+        client_burst: float,
+        routes: Dict[str, Tuple[float, float]],
+        max_keys: int = 100_000,
+        clock=time.monotonic,
+        counter=None,
+    ):
+        self.clients = TokenBuckets(client_rate, client_burst, max_keys, clock) if client_rate > 0 else None
+        self.routes = {
+            route: TokenBuckets(rate, burst, max_keys, clock) for route, (rate, burst) in routes.items() if rate > 0
+        }
+        # Счётчик метрик (message_broker.metrics.Counter): inc((маршрут,)) на каждый отказ
+        self.counter = counter
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def check(self, client: str, route: str) -> float:
+        """0 - запрос разрешён, иначе через сколько секунд повторить (429)"""
+        wait = 0.0
+        buckets = self.routes.get(route)
+        if buckets is not None:
+            wait = buckets.take(client)
+        if not wait and self.clients is not None:
+            wait = self.clients.take(client)
+        with self._lock:
+            counters = self._counters.get(route)
+            if counters is None:
+                counters = self._counters[route] = {"allowed": 0, "limited": 0}
+            counters["limited" if wait else "allowed"] += 1
+        if wait and self.counter is not None:
+            self.counter.inc((route,))
+        return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {route: dict(counters) for route, counters in self._counters.items()}
+        limits = {route: {"rate": b.rate, "burst": b.burst, "clients": len(b)} for route, b in self.routes.items()}
+        clients = self.clients
+        return {
+            "client": {"rate": clients.rate, "burst": clients.burst, "clients": len(clients)} if clients else None,
+            "route_limits": limits,
+            "evictions": sum(b.evictions for b in self.routes.values()) + (clients.evictions if clients else 0),
+            "routes": routes,
+        }
+
+
+class AdmissionControl:
+    """Лимит одновременных запросов к сервису с ограниченной очередью (для потоков)"""
+
+    def __init__(self, limit: int, queue: int, timeout: float, counter=None, name: str = ""):
+        self.limit = limit
+        # Сколько запросов может ждать слот и сколько ждать, с
+        self.queue = queue
+        self.timeout = timeout
+        # Счётчик метрик: inc((name,)) на каждый сброшенный запрос
+        self.counter = counter
+        self.name = name
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    def acquire(self) -> bool:
+        """Занять слот; False - запрос сброшен (очередь заполнена или слот не освободился за timeout)"""
+        with self._cond:
+            if self.in_flight < self.limit and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.shed += 1
+                self._count()
+                return False
+            self.waiting += 1
+            self.queued += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        self._count()
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _count(self) -> None:
+        if self.counter is not None:
+            self.counter.inc((self.name,))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "queue": self.queue,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "shed": self.shed,
+                "timeouts": self.timeouts,
+            }
@@ -0,0 +1,113 @@
+"""
+Бенчмарк транспорта брокера: HTTP против встроенного (in-process)
+
+HTTP: сервис -> POST /broker/publish -> брокер -> POST /broker/consume подписчика.
+In-process: publish_message() -> очередь брокера -> вызов обработчика.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_broker_transport.py [кол-во сообщений]
+"""
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+from message_broker import main as broker
+from message_broker.transport import HttpTransport, InProcessTransport
+from schemas.envelope import decode_message, to_message
+
+BROKER_PORT = 5950
+CONSUMER_PORT = 5951
+
+
+class Collector:
+    """Подписчик, который фиксирует задержку от публикации до обработки"""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.latencies = []
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def handle(self, message: dict) -> bool:
+        latency = time.perf_counter() - message["payload"]["sent_at"]
+        with self._lock:
+            self.latencies.append(latency)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+        return True
+
+
+def serve(app, port):
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(transport, event_type: str, collector: Collector) -> dict:
+    start = time.perf_counter()
+    for i in range(collector.expected):
+        transport.publish({"event_type": event_type, "seq": i, "sent_at": time.perf_counter()})
+    publish_elapsed = time.perf_counter() - start
+    collector.done.wait(timeout=120)
+    total_elapsed = time.perf_counter() - start
+
+    latencies = sorted(collector.latencies)
+    return {
+        "delivered": len(latencies),
+        "publish_us": publish_elapsed / collector.expected * 1e6,
+        "throughput": len(latencies) / total_elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    # HTTP-путь: брокер и подписчик слушают локальные порты
+    http_collector = Collector(count)
+    consumer_app = Flask("bench_consumer")
+
+    @consumer_app.route("/broker/consume", methods=["POST"])
+    def consume():
+        http_collector.handle(decode_message(request.get_data(), request.content_type))
+        return jsonify({"status": "processed"}), 200
+
+    serve(broker.app, BROKER_PORT)
+    serve(consumer_app, CONSUMER_PORT)
+    broker.subscribers["bench.http"] = ["bench-http"]
+    broker.get_group("bench-http", create=True).join(
+        f"http://127.0.0.1:{CONSUMER_PORT}/broker/consume", static=True
+    )
+
+    # In-process: тот же брокер, обработчик вызывается напрямую
+    local_collector = Collector(count)
+    broker.register_local_consumer(
+        "bench-local", lambda message: local_collector.handle(to_message(message)), ["bench.local"]
+    )
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        http = run(HttpTransport(f"http://127.0.0.1:{BROKER_PORT}/broker/publish"), "bench.http", http_collector)
+        local = run(InProcessTransport(), "bench.local", local_collector)
+
+    print(f"Сообщений: {count}")
+    print(f"{'транспорт':<10} {'доставлено':>10} {'publish, мкс':>13} {'сообщ/с':>10} {'p50, мс':>9} {'p95, мс':>9}")
+    for name, r in (("http", http), ("inprocess", local)):
+        print(
+            f"{name:<10} {r['delivered']:>10} {r['publish_us']:>13.1f} {r['throughput']:>10.0f} "
+            f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Бенчмарк формата сообщений брокера: прежний JSON против компактного конверта
+
+Прежний путь: сервис сериализует событие (serialize_for_json + dumps/loads),
+брокер заворачивает его в сообщение с полным дублированием payload и снова
+кодирует в JSON при доставке.
+Новый путь: конверт {v, id, t, s, ts, d} кодируется один раз (JSON или msgpack).
+
+Запуск (из каталога backend):
+    python benchmarks/bench_envelope.py [кол-во итераций]
+"""
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import envelope as envelopes
+
+
+def sample_event(rows: int = 1) -> dict:
+    payment = {
+        "payment_id": str(uuid.uuid4()),
+        "booking_id": str(uuid.uuid4()),
+        "amount": Decimal("15000.00"),
+        "currency": "RUB",
+        "status": "succeeded",
+        "gateway": "yookassa",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+        "external_payment_id": "2d0f6f35-000f-5000-9000-1a6c0ed0f8a0",
+        "metadata": {"hall": "Лофт", "notes": "Фотосессия " * rows},
+    }
+    return {"event_type": "payment.succeeded", "payment": payment, "booking_id": payment["booking_id"]}
+
+
+def legacy_serialize_for_json(obj):
+    if isinstance(obj, dict):
+        return {k: legacy_serialize_for_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [legacy_serialize_for_json(v) for v in obj]
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return obj
+
+
+def legacy_round_trip(event: dict) -> bytes:
+    # Сервис: приведение типов и проверочный dumps/loads
+    data = json.loads(json.dumps(legacy_serialize_for_json(event)))
+    body = json.dumps(data).encode()
+    # Брокер: разбор и сообщение с payload, дублирующим поля события
+    received = json.loads(body)
+    message = {
+        "message_id": str(uuid.uuid4()),
+        "event_type": received["event_type"],
+        "source_service": received.get("source_service", "unknown"),
+        "payload": received,
+        "timestamp": datetime.now().isoformat(),
+    }
+    wire = json.dumps(message).encode()
+    # Подписчик
+    json.loads(wire)
+    return wire
+
+
+def envelope_round_trip(event: dict, content_type: str, threshold: int) -> bytes:
+    envelope = envelopes.from_event(event, "payment")
+    body = envelopes.encode(envelope, content_type, threshold)
+    received = envelopes.decode(body, content_type)
+    # Брокер доставляет закодированное тело, перекодирования нет
+    wire = envelopes.encode(received, content_type, threshold)
+    envelopes.decode_message(wire, content_type)
+    return wire
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    variants = [
+        ("legacy json", lambda e: legacy_round_trip(e)),
+        ("envelope json", lambda e: envelope_round_trip(e, envelopes.CONTENT_TYPE_JSON, 1 << 30)),
+        ("envelope json+z", lambda e: envelope_round_trip(e, envelopes.CONTENT_TYPE_JSON, envelopes.COMPRESS_THRESHOLD)),
+    ]
+    if envelopes.binary_supported():
+        variants.append(
+            ("envelope msgpack", lambda e: envelope_round_trip(e, envelopes.CONTENT_TYPE_MSGPACK, envelopes.COMPRESS_THRESHOLD))
+        )
+    else:
+        print("msgpack не установлен - двоичная кодировка пропущена")
+
+    print(f"Итераций: {number}")
+    print(f"{'payload':<8} {'формат':<18} {'байт на проводе':>16} {'мкс/сообщение':>14}")
+    for label, rows in (("малый", 1), ("крупный", 800)):
+        event = sample_event(rows)
+        for name, fn in variants:
+            size = len(fn(event))
+            elapsed = timeit.timeit(lambda: fn(event), number=number)
+            print(f"{label:<8} {name:<18} {size:>16} {elapsed / number * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Нагрузочный тест API Gateway: threaded (Flask) против asyncio при медленном сервисе
+
+Заглушка Payment Service (asyncio, отдельный процесс) отвечает через
+[задержка] секунд. Gateway запускается в отдельном процессе в одном из
+режимов, генератор нагрузки открывает [клиентов] одновременных соединений и
+отправляет по одному GET /api/payments/<id>.
+
+Для каждого режима: сколько запросов выполнено успешно, задержка p50 / p99,
+общее время, пик потоков и памяти (RSS) процесса gateway и его CPU.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_gateway_async.py [клиентов через запятую] [задержка, с]
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+UPSTREAM_PORT = 5965
+GATEWAY_PORT = 5966
+BODY = b'{"payment_id": "p1", "status": "pending"}'
+
+
+def run_upstream(delay: float) -> None:
+    """Медленный сервис: keep-alive, ответ через delay секунд"""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                await asyncio.sleep(delay)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                    % (len(BODY), BODY)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, OSError):
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", UPSTREAM_PORT, backlog=4096)
+        await server.serve_forever()
+
+    _raise_open_files_limit()
+    asyncio.run(main())
+
+
+def run_gateway(mode: str) -> None:
+    os.environ["PAYMENT_SERVICE_URL"] = f"http://127.0.0.1:{UPSTREAM_PORT}"
+    # Замер - ожидание медленного сервиса, а не ответы из кэша или общий ответ одинаковых запросов
+    os.environ["GATEWAY_CACHE"] = "0"
+    os.environ["GATEWAY_COALESCE"] = "0"
+    # Все клиенты - с одного адреса и сверх очереди threaded-режима: без лимитов клиентов и сброса
+    os.environ["GATEWAY_RATE_LIMIT"] = "0"
+    os.environ["GATEWAY_MAX_CONCURRENCY"] = os.environ["GATEWAY_QUEUE_SIZE"] = "100000"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    logging.getLogger("urllib3").setLevel(logging.ERROR)
+    _raise_open_files_limit()
+    from api_gateway import main as gateway
+
+    if mode == "asyncio":
+        from api_gateway.async_gateway import serve
+
+        asyncio.run(serve(gateway.app.url_map, gateway.upstreams(), "127.0.0.1", GATEWAY_PORT, timeout=30))
+    else:
+        from werkzeug.serving import make_server
+
+        gateway.upstream.timeout = 30
+        make_server("127.0.0.1", GATEWAY_PORT, gateway.app, threaded=True).serve_forever()
+
+
+async def one_request(timeout: float):
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", GATEWAY_PORT), timeout)
+        writer.write(b"GET /api/payments/p1 HTTP/1.1\r\nHost: gateway\r\nConnection: close\r\n\r\n")
+        response = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        status = int(response.split(b" ", 2)[1]) if response else 0
+    except (OSError, asyncio.TimeoutError):
+        status = 0
+    return status, time.perf_counter() - started
+
+
+async def load(clients: int, timeout: float) -> list:
+    return await asyncio.gather(*(one_request(timeout) for _ in range(clients)))
+
+
+class ProcessSampler:
+    """Пик потоков и RSS процесса (/proc), CPU процесса за замер"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_threads = 0
+        self.peak_rss_mb = 0.0
+        self._running = True
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    async def run(self):
+        while self._running:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        self.peak_threads = max(self.peak_threads, int(line.split()[1]))
+                    elif line.startswith("VmRSS:"):
+                        self.peak_rss_mb = max(self.peak_rss_mb, int(line.split()[1]) / 1024)
+            await asyncio.sleep(0.05)
+
+    def stop(self):
+        self._running = False
+
+
+async def measure(pid: int, clients: int, delay: float) -> dict:
+    sampler = ProcessSampler(pid)
+    sampling = asyncio.create_task(sampler.run())
+    cpu = sampler.cpu_seconds()
+    started = time.perf_counter()
+    results = await load(clients, timeout=delay + 30)
+    seconds = time.perf_counter() - started
+    cpu = sampler.cpu_seconds() - cpu
+    sampler.stop()
+    await sampling
+    latencies = sorted(latency for status, latency in results if status == 200)
+    return {
+        "ok": len(latencies),
+        "failed": clients - len(latencies),
+        "p50": latencies[len(latencies) // 2] if latencies else 0,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] if latencies else 0,
+        "seconds": seconds,
+        "threads": sampler.peak_threads,
+        "rss_mb": sampler.peak_rss_mb,
+        "cpu": cpu,
+    }
+
+
+def _raise_open_files_limit() -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    levels = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else "100,1000,3000").split(",")]
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    _raise_open_files_limit()
+    upstream = multiprocessing.Process(target=run_upstream, args=(delay,), daemon=True)
+    upstream.start()
+
+    print(f"Задержка сервиса: {delay} с, ядер: {os.cpu_count()}")
+    print(
+        f"{'режим':<9} {'клиентов':>8} {'успешно':>8} {'ошибок':>7} {'p50, с':>7} {'p99, с':>7} "
+        f"{'всего, с':>9} {'потоков':>8} {'RSS, МБ':>8} {'CPU, с':>7}"
+    )
+    for mode in ("threaded", "asyncio"):
+        gateway = multiprocessing.Process(target=run_gateway, args=(mode,), daemon=True)
+        gateway.start()
+        time.sleep(2)  # импорт и запуск
+        for clients in levels:
+            r = asyncio.run(measure(gateway.pid, clients, delay))
+            print(
+                f"{mode:<9} {clients:>8} {r['ok']:>8} {r['failed']:>7} {r['p50']:>7.2f} {r['p99']:>7.2f} "
+                f"{r['seconds']:>9.2f} {r['threads']:>8} {r['rss_mb']:>8.1f} {r['cpu']:>7.2f}"
+            )
+        gateway.terminate()
+        gateway.join()
+    upstream.terminate()
+
+
+if __name__ == "__main__":
+    main()
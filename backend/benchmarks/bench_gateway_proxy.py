@@ -0,0 +1,151 @@
+"""
+Бенчмарк прокси API Gateway: сколько добавляет один переход через gateway
+
+Ответы Payment Service (один платёж и список платежей бронирования)
+отдаёт заглушка в отдельном процессе - HTTP/1.1 с keep-alive, чтобы в замер
+не входили ни CPU сервиса, ни закрытие соединения dev-сервером werkzeug
+(он отвечает "Connection: close"). Запросы идут тремя путями:
+- "напрямую": пул соединений клиента → заглушка (базовая линия);
+- "gateway (было)": прежний _proxy - новое соединение на запрос,
+  resp.json() и повторный jsonify;
+- "gateway": UpstreamProxy - пул соединений и сквозная передача тела.
+
+Gateway вызывается через test_client (входящее соединение клиента не
+меряется): разница с базовой линией - цена перехода через gateway,
+по времени и по CPU процесса gateway.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_gateway_proxy.py [запросов] [платежей в списке]
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from flask import Flask, jsonify, request
+
+from api_gateway import main as gateway
+from payment_service import main as payment
+
+UPSTREAM_PORT = 5964
+
+legacy_app = Flask("legacy_gateway")
+
+
+def legacy_proxy(method: str, base_url: str, path: str, **kwargs):
+    """Прежний _proxy"""
+    url = f"{base_url}{path}"
+    try:
+        resp = requests.request(method, url, timeout=10, **kwargs)
+        try:
+            data = resp.json()
+        except (ValueError, requests.exceptions.JSONDecodeError):
+            data = {"error": resp.text[:200]}
+        return (data, resp.status_code)
+    except Exception as e:
+        return {"error": str(e)}, 502
+
+
+@legacy_app.route("/api/payments", methods=["GET"])
+def legacy_list_payments():
+    data, code = legacy_proxy("GET", gateway.PAYMENT_SERVICE_URL, "/api/payments", params=request.args)
+    return jsonify(data), code
+
+
+@legacy_app.route("/api/payments/<payment_id>", methods=["GET"])
+def legacy_get_payment(payment_id: str):
+    data, code = legacy_proxy("GET", gateway.PAYMENT_SERVICE_URL, f"/api/payments/{payment_id}")
+    return jsonify(data), code
+
+
+def serve_canned(bodies: dict) -> None:
+    """Заглушка сервиса: готовые ответы по пути запроса, keep-alive"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Заголовки и тело - одной записью в сокет (без задержки Nagle / delayed ACK)
+        wbufsize = 64 * 1024
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            body = bodies[self.path]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", UPSTREAM_PORT), Handler).serve_forever()
+
+
+def measure(fetch, count: int) -> dict:
+    fetch()  # прогрев: соединение в пуле
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(count):
+        size = fetch()
+    return {
+        "us": (time.perf_counter() - wall) / count * 1e6,
+        "cpu_us": (time.process_time() - cpu) / count * 1e6,
+        "size": size,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    listed = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    client = payment.app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        payment_ids = [
+            client.post("/api/payments", json={"booking_id": "booking-gw", "amount": Decimal("3000.00")}).get_json()["payment_id"]
+            for _ in range(listed)
+        ]
+    paths = {
+        "GET /api/payments/<id>": f"/api/payments/{payment_ids[0]}",
+        f"GET /api/payments?booking_id (платежей: {listed})": "/api/payments?booking_id=booking-gw",
+    }
+    bodies = {path: client.get(path).data for path in paths.values()}
+    upstream = multiprocessing.Process(target=serve_canned, args=(bodies,), daemon=True)
+    upstream.start()
+    gateway.PAYMENT_SERVICE_URL = f"http://127.0.0.1:{UPSTREAM_PORT}"
+    # Замер - переход через gateway, а не ответы из кэша
+    gateway.gateway_cache = None
+    gateway.coalescer = None
+    gateway.rate_limiter = None
+    time.sleep(0.5)
+
+    direct = requests.Session()
+    direct.trust_env = False
+    legacy = legacy_app.test_client()
+    pooled = gateway.app.test_client()
+
+    for title, path in paths.items():
+        results = {
+            "напрямую": measure(lambda: len(direct.get(gateway.PAYMENT_SERVICE_URL + path).content), count),
+            "gateway (было)": measure(lambda: len(legacy.get(path).data), count),
+            "gateway": measure(lambda: len(pooled.get(path).data), count),
+        }
+        base = results["напрямую"]
+        print(f"\n{title}, запросов: {count}")
+        print(f"{'путь':<16} {'мкс/запрос':>11} {'+ за переход':>13} {'+ CPU, мкс':>11} {'байт':>8}")
+        for name, r in results.items():
+            print(
+                f"{name:<16} {r['us']:>11.0f} {r['us'] - base['us']:>13.0f} "
+                f"{r['cpu_us'] - base['cpu_us']:>11.0f} {r['size']:>8}"
+            )
+    upstream.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Сквозной нагрузочный тест Payment Service против mock-сервера шлюзов
+
+Payment Service (PAYMENT_ENV=test) и payment_service/mock_gateway_server.py
+поднимаются в этом процессе на отдельных портах; шлюзы направлены на mock
+через *_API_URL. Создаётся N платежей параллельно, затем тест ждёт, пока
+все webhook-и mock-а будут обработаны очередью приёма.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_payment_e2e.py [платежей] [потоков] [шлюз] [задержка mock, мс] [доля ошибок]
+"""
+import contextlib
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MOCK_PORT = 5961
+PAYMENT_PORT = 5962
+MOCK_BASE = f"http://127.0.0.1:{MOCK_PORT}"
+
+# До импорта сервисов: конфигурация читается при импорте
+os.environ.setdefault("PAYMENT_ENV", "test")
+os.environ.setdefault("BROKER_TRANSPORT", "inprocess")
+os.environ.setdefault("BOOKING_SERVICE_URL", "http://127.0.0.1:9")  # подтверждение брони сразу падает
+os.environ["YOOKASSA_API_URL"] = f"{MOCK_BASE}/yookassa/v3/payments"
+os.environ["SBERPAY_API_URL"] = f"{MOCK_BASE}/sberpay/payment/rest/register.do"
+os.environ["TINKOFF_API_URL"] = f"{MOCK_BASE}/tinkoff/v2/Init"
+
+import requests
+from werkzeug.serving import make_server
+
+from payment_service import main as payment
+from payment_service import mock_gateway_server as mock
+
+
+def serve(app, port):
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    gateway = sys.argv[3] if len(sys.argv) > 3 else "yookassa"
+    mock.config["latency_ms"] = float(sys.argv[4]) if len(sys.argv) > 4 else 50
+    mock.config["error_rate"] = float(sys.argv[5]) if len(sys.argv) > 5 else 0
+    mock.config["webhook_delay_ms"] = 200
+    mock.config["duplicate_rate"] = 0.1
+    mock.config["webhook_url"] = f"http://127.0.0.1:{PAYMENT_PORT}/api/payments/webhook"
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    serve(mock.app, MOCK_PORT)
+    serve(payment.app, PAYMENT_PORT)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=threads)
+    session.mount("http://", adapter)
+    url = f"http://127.0.0.1:{PAYMENT_PORT}/api/payments"
+
+    latencies = []
+    codes = {}
+    lock = threading.Lock()
+
+    def create(i):
+        start = time.perf_counter()
+        response = session.post(
+            url, json={"booking_id": f"bench-{i}", "amount": 3000, "payment_method": gateway}, timeout=60
+        )
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            codes[response.status_code] = codes.get(response.status_code, 0) + 1
+
+    print(f"Платежей: {count}, потоков: {threads}, шлюз: {gateway}, "
+          f"задержка mock: {mock.config['latency_ms']:.0f} мс, ошибки mock: {mock.config['error_rate']:.0%}")
+    # Логи сервисов на каждый платёж заглушаем на время прогона
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(create, range(count)))
+        total = time.perf_counter() - start
+
+        # Ждём webhook-и: по одному на созданный платёж (повторы mock-а отсекаются до очереди)
+        expected = codes.get(201, 0)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            done = payment.webhook_queue.processed + payment.webhook_queue.failed
+            if done >= expected and payment.webhook_queue.depth() == 0:
+                break
+            time.sleep(0.1)
+
+    latencies.sort()
+    print(f"Создание: {count / total:.0f} платежей/с, "
+          f"p50 {statistics.median(latencies) * 1000:.1f} мс, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс, коды: {codes}")
+
+    webhook_stats = payment.webhook_queue.stats()
+    idempotency = payment.processed_webhooks.stats()
+    print(f"Webhook-и: принято {webhook_stats['received']}, обработано {webhook_stats['processed']}, "
+          f"ошибок {webhook_stats['failed']}, повторов отсечено {idempotency['duplicates']}")
+    print(f"Приём -> обработка: {webhook_stats['ingest_to_processed']}")
+    print(f"Mock: {mock.stats}")
+    print(f"Шлюзы: {payment.gateway_registry.stats()}")
+
+
+if __name__ == "__main__":
+    main()
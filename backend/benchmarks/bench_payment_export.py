@@ -0,0 +1,75 @@
+"""
+Бенчмарк потоковой выгрузки платежей (GET /api/payments/export)
+
+Выгрузка за период из индекса по времени PaymentStore: строк в секунду и
+пик памяти (tracemalloc) на саму выгрузку - он не должен расти с числом
+строк. Для сравнения - пик памяти при сборке той же выгрузки в один список.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_payment_export.py [платежей] [формат: csv|ndjson]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_service import export
+from payment_service.refunds import RefundLedger
+from payment_service.store import PaymentStore
+
+GATEWAYS = ("yookassa", "sberpay", "tinkoff")
+
+
+def fill(total: int) -> PaymentStore:
+    store = PaymentStore()
+    start = datetime(2026, 1, 1)
+    for i in range(total):
+        store.add({
+            "payment_id": f"p{i}",
+            "booking_id": f"b{i}",
+            "amount": Decimal("3000.00"),
+            "payment_method": GATEWAYS[i % len(GATEWAYS)],
+            "status": "succeeded",
+            "external_payment_id": f"ext-{i}",
+            "created_at": start + timedelta(seconds=i),
+        })
+    return store
+
+
+def measure(name: str, run) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = run()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:<18} {seconds:>7.2f} с {size / 2**20:>9.1f} МБ выгрузки, пик памяти {peak / 2**20:>8.1f} МБ")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    fmt = sys.argv[2] if len(sys.argv) > 2 else "csv"
+    store = fill(total)
+    ledger = RefundLedger()
+    print(f"Платежей: {total}, формат: {fmt}")
+
+    def streamed():
+        return sum(len(chunk) for chunk in export.stream(export.export_rows(store, ledger), fmt))
+
+    def buffered():
+        return len("".join(list(export.stream(list(export.export_rows(store, ledger)), fmt))))
+
+    measure("потоком", streamed)
+    measure("целиком в памяти", buffered)
+
+    started = time.perf_counter()
+    rows = sum(1 for _ in export.export_rows(store, ledger))
+    print(f"Строк в секунду (без сериализации): {rows / (time.perf_counter() - started):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Бенчмарк клиента платёжного шлюза против локального mock-сервера ЮKassa
+
+- "разовый": как раньше - новый клиент и requests.post (новое TCP-соединение,
+  base64-токен) на каждый платёж;
+- "реестр": общий клиент из GatewayRegistry - keep-alive пул и готовые заголовки.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_payment_gateway.py [кол-во платежей] [потоков]
+"""
+import base64
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from payment_service.gateways import Environment, GatewayRegistry
+
+MOCK_PORT = 5960
+MOCK_URL = f"http://127.0.0.1:{MOCK_PORT}/v3/payments"
+
+
+def start_mock_server():
+    app = Flask("mock_yookassa")
+
+    @app.route("/v3/payments", methods=["POST"])
+    def create():
+        payment_id = str(uuid.uuid4())
+        data = request.get_json()
+        return jsonify({
+            "id": payment_id,
+            "status": "pending",
+            "amount": data["amount"],
+            "confirmation": {"type": "redirect", "confirmation_url": f"http://127.0.0.1/pay/{payment_id}"},
+        })
+
+    server = make_server("127.0.0.1", MOCK_PORT, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def one_off_create(amount: Decimal, booking_id: str) -> dict:
+    """Прежний путь: токен и соединение на каждый вызов"""
+    shop_id, secret_key = "shop", "secret"
+    token = base64.b64encode(f"{shop_id}:{secret_key}".encode()).decode()
+    response = requests.post(
+        MOCK_URL,
+        json={"amount": {"value": str(amount), "currency": "RUB"}, "metadata": {"booking_id": booking_id}},
+        headers={
+            "Authorization": f"Basic {token}",
+            "Content-Type": "application/json",
+            "Idempotence-Key": str(uuid.uuid4()),
+        },
+        auth=(shop_id, secret_key),
+        timeout=10,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def measure(create, count: int, threads: int) -> dict:
+    latencies = []
+    lock = threading.Lock()
+
+    def call(i):
+        start = time.perf_counter()
+        create(Decimal("3000.00"), f"booking-{i}")
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(call, range(count)))
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput": count / total,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    start_mock_server()
+
+    registry = GatewayRegistry(pool_size=threads, max_concurrency=threads)
+    client = registry.get("yookassa", Environment.TEST)
+    client.base_url = MOCK_URL
+
+    def pooled_create(amount, booking_id):
+        return registry.get("yookassa", Environment.TEST).create_payment(amount, booking_id)
+
+    print(f"Платежей: {count}, потоков: {threads}")
+    print(f"{'клиент':<10} {'платежей/с':>11} {'p50, мс':>9} {'p95, мс':>9}")
+    for name, create in (("разовый", one_off_create), ("реестр", pooled_create)):
+        measure(create, min(50, count), threads)  # прогрев
+        r = measure(create, count, threads)
+        print(f"{name:<10} {r['throughput']:>11.0f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+    print(f"Ошибок клиента реестра: {client.stats()['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Бенчмарк сверки зависших платежей
+
+1. Выбор кандидатов: индекс pending по возрасту (PaymentStore.pending_older_than)
+   против полного прохода по таблице, где большинство платежей уже завершены.
+2. Пропускная способность PaymentReconciler против mock-сервера шлюзов
+   (payment_service/mock_gateway_server.py, все webhook-и "потеряны")
+   при разном числе одновременных запросов статуса.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_payment_reconcile.py [платежей в таблице] [зависших] [задержка mock, мс]
+"""
+import contextlib
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+
+from payment_service import mock_gateway_server as mock
+from payment_service.gateways import Environment, GatewayRegistry
+from payment_service.reconciler import PaymentReconciler
+from payment_service.store import PaymentStore
+
+MOCK_PORT = 5963
+OLD = (datetime.now() - timedelta(hours=1)).isoformat()
+
+
+def bench_selection(total: int, stale: int) -> None:
+    store = PaymentStore()
+    for i in range(total):
+        status = "pending" if i >= total - stale else "succeeded"
+        store.add({"payment_id": str(uuid.uuid4()), "status": status, "created_at": OLD})
+    cutoff = datetime.now() - timedelta(minutes=15)
+
+    def full_scan():
+        return [
+            p for p in store
+            if p.status == "pending" and p.created_at < cutoff
+        ]
+
+    print(f"Платежей в таблице: {total}, зависших: {stale}")
+    for name, select in (("полный проход", full_scan), ("индекс", lambda: store.pending_older_than(cutoff))):
+        start = time.perf_counter()
+        found = select()
+        print(f"  {name:<14} {(time.perf_counter() - start) * 1000:>9.2f} мс, найдено {len(found)}")
+
+
+def bench_reconcile(stale: int, latency_ms: float) -> None:
+    mock.config.update(latency_ms=latency_ms, latency_sigma=0.3, webhook_delay_ms=0, webhook_loss_rate=1.0)
+    server = make_server("127.0.0.1", MOCK_PORT, mock.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    registry = GatewayRegistry(pool_size=32, max_concurrency=32)
+    client = registry.get("yookassa", Environment.TEST)
+    client.base_url = f"http://127.0.0.1:{MOCK_PORT}/yookassa/v3/payments"
+
+    print(f"\nСверка {stale} платежей, задержка mock {latency_ms:.0f} мс")
+    print(f"{'параллельно':>11} {'платежей/с':>11} {'обновлено':>10} {'ошибок':>7}")
+    for concurrency in (1, 4, 8, 16, 32):
+        store = PaymentStore()
+        for _ in range(stale):
+            created = client.create_payment(Decimal("3000.00"), "booking")
+            store.add({
+                "payment_id": str(uuid.uuid4()),
+                "external_payment_id": created["external_payment_id"],
+                "payment_method": "yookassa",
+                "status": "pending",
+                "created_at": OLD,
+            })
+        time.sleep(0.1)  # mock завершает платежи (webhook-и теряются)
+
+        reconciler = PaymentReconciler(
+            store,
+            lambda p: client.get_payment_status(p.external_payment_id),
+            lambda p, data: store.update(p.payment_id, status=data["status"]),
+            min_age=60,
+            concurrency=concurrency,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = reconciler.run_once()
+        print(f"{concurrency:>11} {summary['per_second']:>11.0f} {summary['resolved']:>10} {summary['errors']:>7}")
+    server.shutdown()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    stale = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    bench_selection(total, stale)
+    bench_reconcile(stale, latency_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Бенчмарк GET /api/payments/<id>: CPU на запрос
+
+- "dict (было)": прежний обработчик - копия dict из хранилища, fromisoformat
+  для дат, float -> str -> Decimal, pydantic PaymentResponse и jsonify;
+- "PaymentRecord": типизированная запись с кэшированным JSON.
+
+Оба обработчика вызываются через test_client приложения Payment Service,
+поэтому в замер входит и маршрутизация Flask.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_payment_record.py [запросов]
+"""
+import os
+import sys
+import time
+import uuid
+import warnings
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify
+
+from payment_service import main as payment
+from schemas.payment import PaymentResponse
+
+# Прежний формат хранения: даты строками, сумма float
+legacy_db = {}
+
+
+def legacy_get_payment(payment_id: str):
+    """Прежний GET /api/payments/<id>"""
+    stored = legacy_db.get(payment_id)
+    if not stored:
+        return jsonify({"error": "Платёж не найден"}), 404
+    data = stored.copy()
+    if isinstance(data.get("created_at"), str):
+        data["created_at"] = datetime.fromisoformat(data["created_at"])
+    if data.get("updated_at") and isinstance(data["updated_at"], str):
+        data["updated_at"] = datetime.fromisoformat(data["updated_at"])
+    if isinstance(data.get("amount"), (str, float)):
+        data["amount"] = Decimal(str(data["amount"]))
+    return jsonify(PaymentResponse(**data).dict()), 200
+
+
+payment.app.add_url_rule("/bench/legacy/<payment_id>", "bench_legacy", legacy_get_payment)
+
+
+def measure(client, url: str, count: int) -> dict:
+    client.get(url)  # прогрев (и заполнение кэша записи)
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(count):
+        response = client.get(url)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    assert response.status_code == 200
+    return {"cpu_us": cpu / count * 1e6, "rps": count / wall, "body": response.get_json()}
+
+
+def main():
+    warnings.filterwarnings("ignore", category=DeprecationWarning)  # .dict() pydantic v2 в прежнем обработчике
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    now = datetime.now()
+    payment_id = str(uuid.uuid4())
+    fields = {
+        "payment_id": payment_id,
+        "booking_id": "booking-bench",
+        "payment_method": "yookassa",
+        "status": "succeeded",
+        "external_payment_id": f"ext-{payment_id}",
+        "payment_url": "https://example.com/pay",
+    }
+    legacy_db[payment_id] = {
+        **fields, "amount": 3000.0, "created_at": now.isoformat(), "updated_at": now.isoformat(),
+    }
+    payment.payments_db.add({**fields, "amount": Decimal("3000.0"), "created_at": now, "updated_at": now})
+
+    client = payment.app.test_client()
+    legacy = measure(client, f"/bench/legacy/{payment_id}", count)
+    typed = measure(client, f"/api/payments/{payment_id}", count)
+    assert legacy["body"] == typed["body"], "Ответы совпадают"
+
+    print(f"Запросов: {count}")
+    print(f"{'обработчик':<16} {'CPU, мкс/запрос':>16} {'запросов/с':>11}")
+    for name, r in (("dict (было)", legacy), ("PaymentRecord", typed)):
+        print(f"{name:<16} {r['cpu_us']:>16.1f} {r['rps']:>11.0f}")
+    print(f"Экономия CPU: {(1 - typed['cpu_us'] / legacy['cpu_us']) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Бенчмарк обработки webhook-а при большом числе платежей
+
+Сравнивает поиск платежа по external_payment_id:
+- перебором всех платежей (прежняя реализация process_webhook);
+- по индексу PaymentStore.
+
+Запуск (из каталога backend):
+    python benchmarks/bench_payment_webhook.py [кол-во платежей]
+"""
+import os
+import random
+import sys
+import time
+import uuid
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_service import main as payment
+from schemas.payment import PaymentMethod
+
+
+def fill(count: int) -> list:
+    external_ids = []
+    created_at = "2025-01-20T12:00:00"
+    for i in range(count):
+        external_id = f"sberpay-{uuid.uuid4()}"
+        payment.payments_db.add({
+            "payment_id": str(uuid.uuid4()),
+            "booking_id": f"booking-{i // 2}",
+            "amount": "3000.00",
+            "payment_method": "sberpay",
+            "status": "pending",
+            "created_at": created_at,
+            "updated_at": None,
+            "external_payment_id": external_id,
+            "payment_url": None,
+        })
+        external_ids.append(external_id)
+    return external_ids
+
+
+def scan(external_id: str):
+    """Прежний поиск: перебор всех платежей"""
+    for p in payment.payments_db:
+        if p.external_payment_id == external_id:
+            return p
+    return None
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"Платежей: {count}")
+
+    start = time.perf_counter()
+    external_ids = fill(count)
+    print(f"Заполнение: {time.perf_counter() - start:.1f} с")
+
+    rounds = 2000
+    sample = random.choices(external_ids, k=rounds)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        for external_id in sample:
+            # status=1 - "pending": webhook не публикует событий и не ходит в Booking Service
+            payment.process_webhook(PaymentMethod.SBERPAY, {"orderId": external_id, "status": 1})
+        indexed = (time.perf_counter() - start) / rounds
+
+    scan_rounds = 20
+    start = time.perf_counter()
+    for external_id in sample[:scan_rounds]:
+        scan(external_id)
+    scanned = (time.perf_counter() - start) / scan_rounds
+
+    print(f"{'поиск':<26} {'мкс/webhook':>12}")
+    print(f"{'перебор (было)':<26} {scanned * 1e6:>12.1f}")
+    print(f"{'индекс (process_webhook)':<26} {indexed * 1e6:>12.1f}")
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        payment.payments_db.list_by_booking(f"booking-{i}")
+    print(f"list_by_booking: {(time.perf_counter() - start) / rounds * 1e6:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,8 @@ import uuid
 from typing import Dict, List, Optional
 import requests
 
+from message_broker.transport import get_transport
+
 try:
     from schemas.booking import (
         BookingCreateRequest,
@@ -67,6 +69,9 @@ BOOKING_DB_URL = os.getenv("BOOKING_DB_URL", "http://localhost:5432")
 MESSAGE_BROKER_URL = os.getenv("MESSAGE_BROKER_URL", "http://localhost:5050/broker")
 PORT = int(os.getenv("PORT", 5001))
 
+# HTTP или встроенный брокер (BROKER_TRANSPORT)
+broker_transport = get_transport(f"{MESSAGE_BROKER_URL}/publish", "booking")
+
 bookings_db: Dict[str, dict] = {}
 
 halls_db: Dict[str, dict] = {
@@ -89,11 +94,10 @@ halls_db: Dict[str, dict] = {
 
 def publish_event(event: dict) -> None:
     try:
-        resp = requests.post(f"{MESSAGE_BROKER_URL}/publish", json=event, timeout=5)
-        if resp.status_code == 200:
-            print(f"✅ Event отправлен: {event.get('event_type')}")
-        else:
-            print(f"⚠️ Broker ответил: {resp.status_code}")
+        broker_transport.publish(event)
+        print(f"✅ Event отправлен: {event.get('event_type')}")
+    except requests.HTTPError as e:
+        print(f"⚠️ Broker ответил: {e.response.status_code}")
     except Exception as e:
         print(f"❌ Ошибка брокера: {e}")
 
@@ -287,7 +291,7 @@ def cancel_booking(booking_id: str):
     booking["updated_at"] = datetime.now().isoformat()
 
     publish_event(
-        {"event_type": "booking.cancelled", "payload": {"booking_id": booking_id}}
+        {"event_type": "booking.cancelled", "payload": {"booking_id": booking_id, "hall_id": booking["hall_id"]}}
     )
 
     return jsonify(booking), 200
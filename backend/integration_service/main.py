@@ -18,16 +18,36 @@ import uuid
 from typing import Dict, Any
 
 from schemas.integration import IntegrationMessage, EventLog, SyncRequest
+from message_broker.client import start_membership
+from message_broker.dedup import LruSeenSet
+from message_broker.transport import register_consumer
+from schemas.envelope import decode_message
 
 app = Flask(__name__)
 CORS(app)
 
-MESSAGE_BROKER_URL = os.getenv("MESSAGE_BROKER_URL", "http://localhost:5000/broker")
+MESSAGE_BROKER_URL = os.getenv("MESSAGE_BROKER_URL", "http://localhost:5050/broker")
 PORT = int(os.getenv("PORT", 5003))
+# Публичный адрес реплики: если задан, реплика сама вступает в группу "integration"
+SERVICE_PUBLIC_URL = os.getenv("SERVICE_PUBLIC_URL")
+
+SUBSCRIBED_EVENTS = [
+    "booking.created",
+    "booking.confirmed",
+    "booking.cancelled",
+    "payment.succeeded",
+    "payment.failed",
+]
 
 events_db: list[dict] = []
 event_logs: Dict[str, dict] = {}
 
+# Уже обработанные message_id: передоставка брокером не создаёт вторую запись
+processed_messages = LruSeenSet(
+    window=float(os.getenv("DEDUP_WINDOW", 3600)),
+    max_entries=int(os.getenv("DEDUP_MAX_ENTRIES", 500_000)),
+)
+
 
 def process_event(event_type: str, payload: Dict[str, Any], source_service: str) -> dict:
     event_id = str(uuid.uuid4())
@@ -129,20 +149,34 @@ def sync():
         return jsonify({"error": str(e)}), 500
 
 
+def handle_broker_message(data: dict) -> dict:
+    """Обработка сообщения брокера (по HTTP или встроенным транспортом)"""
+    message = IntegrationMessage(**data)
+    if not processed_messages.add(message.message_id):
+        print(f"[Integration] Дубль сообщения {message.message_id} пропущен")
+        return {"status": "duplicate", "event_id": None}
+    try:
+        return process_event(message.event_type, message.payload, message.source_service)
+    except Exception:
+        # Брокер повторит доставку - её нельзя считать дублем
+        processed_messages.discard(message.message_id)
+        raise
+
+
 @app.route("/broker/consume", methods=["POST"])
 def consume_message():
     """Endpoint, который дергает Message Broker"""
     try:
-        data = request.json or {}
-        message = IntegrationMessage(**data)
-        event_log = process_event(
-            message.event_type, message.payload, message.source_service
-        )
-        return jsonify({"status": "processed", "event_id": event_log["event_id"]}), 200
+        event_log = handle_broker_message(decode_message(request.get_data(), request.content_type))
+        return jsonify({"status": event_log["status"], "event_id": event_log["event_id"]}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+# Во встроенном режиме брокер вызывает обработчик напрямую
+register_consumer("integration", lambda message: bool(handle_broker_message(message)), SUBSCRIBED_EVENTS)
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "healthy", "service": "integration"}), 200
@@ -150,4 +184,11 @@ def health():
 
 if __name__ == "__main__":
     print(f"🚀 Starting Integration Service on port {PORT}")
+    if SERVICE_PUBLIC_URL:
+        start_membership(
+            MESSAGE_BROKER_URL,
+            "integration",
+            f"{SERVICE_PUBLIC_URL}/broker/consume",
+            SUBSCRIBED_EVENTS,
+        )
     app.run(host="0.0.0.0", port=PORT, debug=True)
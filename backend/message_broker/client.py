@@ -0,0 +1,74 @@
+"""
+Клиентская часть членства в группе потребителей
+
+Реплика сервиса-подписчика регистрирует свой callback-адрес в брокере
+и периодически присылает heartbeat. Если брокер забыл реплику
+(перезапуск, пропущенные heartbeat-ы), она подписывается заново.
+"""
+import hmac
+import ipaddress
+import threading
+import time
+from typing import List, Optional
+
+import requests
+
+# Заголовок с общим секретом брокера (BROKER_CONSUME_TOKEN) в доставках по HTTP
+TOKEN_HEADER = "X-Broker-Token"
+
+
+def is_broker_request(token: Optional[str], expected: Optional[str], remote_addr: Optional[str]) -> bool:
+    """
+    Запрос на /broker/consume - от брокера: совпал общий секрет expected;
+    секрет не задан - только с локального адреса (брокер на той же машине)
+    """
+    if expected:
+        return token is not None and hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
+    try:
+        return ipaddress.ip_address(remote_addr or "").is_loopback
+    except ValueError:
+        return False
+
+
+def start_membership(
+    broker_url: str,
+    subscriber: str,
+    callback_url: str,
+    event_types: List[str],
+    weight: int = 1,
+    interval: float = 5.0,
+) -> threading.Thread:
+    """
+    Запуск фонового потока подписки и heartbeat-ов.
+
+    broker_url - базовый URL брокера, например http://localhost:5050/broker
+    """
+    subscription = {
+        "subscriber": subscriber,
+        "callback_url": callback_url,
+        "event_types": event_types,
+        "weight": weight,
+    }
+    member = {"subscriber": subscriber, "callback_url": callback_url}
+
+    def loop():
+        subscribed = False
+        while True:
+            try:
+                if not subscribed:
+                    resp = requests.post(f"{broker_url}/subscribe", json=subscription, timeout=5)
+                    subscribed = resp.status_code == 200
+                    if subscribed:
+                        print(f"[{subscriber}] Зарегистрирован в брокере: {callback_url}")
+                else:
+                    resp = requests.post(f"{broker_url}/heartbeat", json=member, timeout=5)
+                    if resp.status_code == 404:
+                        subscribed = False
+                        continue
+            except Exception as e:
+                print(f"[{subscriber}] Брокер недоступен: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True, name=f"{subscriber}-membership")
+    thread.start()
+    return thread
@@ -0,0 +1,55 @@
+"""
+Конфигурация Message Broker: приоритеты событий и веса полос доставки
+"""
+import os
+from typing import Dict
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    """Разбор строки вида "payment.succeeded=high,booking.created=low" """
+    result = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            result[key.strip()] = value.strip()
+    return result
+
+
+# Транспорт между сервисами и брокером:
+# - "http": брокер - отдельный процесс, события ходят по HTTP;
+# - "inprocess": все сервисы в одном процессе (single_node.py),
+#   брокер встроен, обработчики подписчиков вызываются напрямую
+TRANSPORT = os.getenv("BROKER_TRANSPORT", "http").lower()
+
+# Дедупликация публикаций по ключу идемпотентности (или message_id):
+# "lru" - точное множество, "bloom" - фильтры Блума фиксированного размера.
+# Ключ помнится DEDUP_WINDOW секунд, но не более DEDUP_CAPACITY ключей
+DEDUP_BACKEND = os.getenv("BROKER_DEDUP_BACKEND", "lru").lower()
+DEDUP_WINDOW = float(os.getenv("BROKER_DEDUP_WINDOW", 3600))
+DEDUP_CAPACITY = int(os.getenv("BROKER_DEDUP_CAPACITY", 1_000_000))
+
+# Полосы в порядке убывания приоритета и их веса:
+# за один раунд планирования полоса получает до weight доставок,
+# поэтому низкоприоритетные события замедляются, но не голодают
+LANE_WEIGHTS = {
+    "high": 8,
+    "normal": 3,
+    "low": 1,
+}
+
+DEFAULT_LANE = "normal"
+
+# Приоритет (полоса) для каждого типа события
+EVENT_PRIORITIES = {
+    "payment.succeeded": "high",
+    "payment.failed": "high",
+    "booking.confirmed": "normal",
+    "booking.cancelled": "normal",
+    "booking.created": "low",
+}
+
+# Переопределение через окружение
+LANE_WEIGHTS.update(
+    {k: int(v) for k, v in _parse_mapping(os.getenv("BROKER_LANE_WEIGHTS", "")).items()}
+)
+EVENT_PRIORITIES.update(_parse_mapping(os.getenv("BROKER_EVENT_PRIORITIES", "")))
@@ -0,0 +1,225 @@
+"""
+Группы потребителей (competing consumers) для Message Broker
+
+Под одним именем подписчика (например, "notification") может быть
+зарегистрировано несколько callback-адресов - реплик сервиса.
+Каждое сообщение доставляется ОДНОЙ здоровой реплике группы.
+Членство отслеживается по heartbeat-ам.
+"""
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    from schemas.envelope import CONTENT_TYPE_JSON
+except ImportError:
+    # Загружен не через main.py (как message_broker.consumer_groups или из каталога брокера):
+    # каталог backend со schemas ещё не в sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from schemas.envelope import CONTENT_TYPE_JSON
+
+LEAST_OUTSTANDING = "least_outstanding"
+WEIGHTED_ROUND_ROBIN = "weighted_round_robin"
+STRATEGIES = (LEAST_OUTSTANDING, WEIGHTED_ROUND_ROBIN)
+
+
+class GroupMember:
+    """Участник группы - одна реплика подписчика"""
+
+    def __init__(
+        self,
+        callback_url: str,
+        weight: int = 1,
+        static: bool = False,
+        handler: Optional[Callable[[dict], bool]] = None,
+        content_type: str = CONTENT_TYPE_JSON,
+    ):
+        self.callback_url = callback_url
+        # Кодировка сообщений при доставке по HTTP
+        self.content_type = content_type
+        # Обработчик в том же процессе (встроенный транспорт) вместо HTTP-вызова
+        self.handler = handler
+        self.weight = max(1, int(weight))
+        # Статические участники (из конфигурации) не требуют heartbeat-ов
+        self.static = static
+        self.outstanding = 0
+        self.current_weight = 0  # для smooth weighted round-robin
+        self.last_heartbeat = time.monotonic()
+        self.consecutive_failures = 0
+        self.suspended_until = 0.0
+        self.delivered = 0
+        self.failed = 0
+
+    def is_alive(self, now: float, heartbeat_ttl: float) -> bool:
+        return self.static or now - self.last_heartbeat <= heartbeat_ttl
+
+    def is_healthy(self, now: float, heartbeat_ttl: float) -> bool:
+        return self.is_alive(now, heartbeat_ttl) and now >= self.suspended_until
+
+    def to_dict(self, now: float, heartbeat_ttl: float) -> dict:
+        return {
+            "callback_url": self.callback_url,
+            "weight": self.weight,
+            "static": self.static,
+            "local": self.handler is not None,
+            "content_type": self.content_type,
+            "healthy": self.is_healthy(now, heartbeat_ttl),
+            "outstanding": self.outstanding,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "last_heartbeat_ago": round(now - self.last_heartbeat, 3),
+        }
+
+
+class ConsumerGroup:
+    """
+    Группа конкурирующих потребителей.
+
+    Балансировка между здоровыми участниками:
+    - least_outstanding: участник с наименьшим числом доставок "в полёте"
+      (с учётом веса), при равенстве - по кругу;
+    - weighted_round_robin: smooth weighted round-robin (как в nginx).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        strategy: str = LEAST_OUTSTANDING,
+        heartbeat_ttl: float = 15.0,
+        evict_after: float = 60.0,
+        max_failures: int = 3,
+        suspend_for: float = 5.0,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия балансировки: {strategy}")
+        self.name = name
+        self.strategy = strategy
+        self.heartbeat_ttl = heartbeat_ttl
+        self.evict_after = evict_after
+        self.max_failures = max_failures
+        self.suspend_for = suspend_for
+        self.members: Dict[str, GroupMember] = {}
+        self._rr_index = 0
+        self._lock = threading.Lock()
+
+    def join(
+        self,
+        callback_url: str,
+        weight: int = 1,
+        static: bool = False,
+        handler: Optional[Callable[[dict], bool]] = None,
+        content_type: str = CONTENT_TYPE_JSON,
+    ) -> GroupMember:
+        """Добавить участника (или обновить вес и heartbeat существующего)"""
+        with self._lock:
+            member = self.members.get(callback_url)
+            if member is None:
+                member = GroupMember(callback_url, weight, static, handler, content_type)
+                self.members[callback_url] = member
+            else:
+                member.weight = max(1, int(weight))
+                member.content_type = content_type
+                member.static = member.static or static
+                member.handler = handler or member.handler
+                member.last_heartbeat = time.monotonic()
+            return member
+
+    def heartbeat(self, callback_url: str) -> bool:
+        with self._lock:
+            member = self.members.get(callback_url)
+            if member is None:
+                return False
+            member.last_heartbeat = time.monotonic()
+            return True
+
+    def leave(self, callback_url: str) -> bool:
+        with self._lock:
+            return self.members.pop(callback_url, None) is not None
+
+    def acquire(self, exclude: Iterable[str] = (), prefer: Optional[str] = None) -> Optional[GroupMember]:
+        """
+        Выбрать участника для доставки и учесть её как outstanding.
+        prefer - участник, которому сообщение уже отправлено и который мог его
+        обработать: выбирается он, пока жив (его дедупликация по message_id
+        отбросит повтор; другой участник обработал бы сообщение второй раз)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            member = self.members.get(prefer) if prefer is not None else None
+            if member is not None and member.is_alive(now, self.heartbeat_ttl):
+                member.outstanding += 1
+                return member
+            candidates = [
+                m
+                for url, m in self.members.items()
+                if url not in exclude and m.is_healthy(now, self.heartbeat_ttl)
+            ]
+            if not candidates:
+                return None
+
+            if self.strategy == WEIGHTED_ROUND_ROBIN:
+                member = self._pick_weighted_round_robin(candidates)
+            else:
+                member = self._pick_least_outstanding(candidates)
+
+            member.outstanding += 1
+            return member
+
+    def release(self, member: GroupMember, success: bool) -> None:
+        """Завершение доставки: снимаем outstanding и учитываем результат"""
+        with self._lock:
+            member.outstanding = max(0, member.outstanding - 1)
+            if success:
+                member.delivered += 1
+                member.consecutive_failures = 0
+                return
+            member.failed += 1
+            member.consecutive_failures += 1
+            if member.consecutive_failures >= self.max_failures:
+                # Временно выводим участника из ротации
+                member.suspended_until = time.monotonic() + self.suspend_for
+                member.consecutive_failures = 0
+
+    def healthy_count(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for m in self.members.values() if m.is_healthy(now, self.heartbeat_ttl))
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "members": [m.to_dict(now, self.heartbeat_ttl) for m in self.members.values()],
+            }
+
+    def _pick_least_outstanding(self, candidates: List[GroupMember]) -> GroupMember:
+        # Начинаем обход со сдвигом, чтобы при равенстве нагрузка шла по кругу
+        self._rr_index = (self._rr_index + 1) % len(candidates)
+        ordered = candidates[self._rr_index:] + candidates[: self._rr_index]
+        return min(ordered, key=lambda m: m.outstanding / m.weight)
+
+    @staticmethod
+    def _pick_weighted_round_robin(candidates: List[GroupMember]) -> GroupMember:
+        total = 0
+        best = None
+        for m in candidates:
+            m.current_weight += m.weight
+            total += m.weight
+            if best is None or m.current_weight > best.current_weight:
+                best = m
+        best.current_weight -= total
+        return best
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [
+            url
+            for url, m in self.members.items()
+            if not m.static and now - m.last_heartbeat > self.evict_after and m.outstanding == 0
+        ]
+        for url in expired:
+            del self.members[url]
+            print(f"[Broker] Участник {url} группы {self.name} удалён (нет heartbeat)")
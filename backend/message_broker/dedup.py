@@ -0,0 +1,211 @@
+"""
+Дедупликация сообщений по message_id / ключу идемпотентности
+
+При повторных отправках и передоставках одно и то же событие может прийти
+несколько раз. Множества "уже виденных" ключей ограничены по памяти:
+
+- LruSeenSet - точное множество с окном по времени и потолком записей
+  (OrderedDict: ~150 байт на ключ-UUID, 1 млн ключей - ~150 МБ);
+- BloomSeenSet - два чередующихся фильтра Блума фиксированного размера
+  (1 млн ключей при вероятности ложного срабатывания 1e-6 - ~3.6 МБ на фильтр).
+  Ложное срабатывание означает, что новое сообщение будет принято за дубль,
+  поэтому фильтр годится там, где это допустимо (защита брокера от повторных
+  публикаций), а не для потребителей с побочными эффектами.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+LRU = "lru"
+BLOOM = "bloom"
+BACKENDS = (LRU, BLOOM)
+
+
+class LruSeenSet:
+    """
+    Точное множество ключей за последние window секунд.
+    При превышении max_entries вытесняются самые старые ключи.
+    """
+
+    def __init__(self, window: float = 3600.0, max_entries: int = 1_000_000):
+        self.window = window
+        self.max_entries = max_entries
+        # key -> (время добавления, значение); порядок - по времени добавления
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Значение, сохранённое для ключа (True, если его не передали)"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def add(self, key: str, value: Any = True) -> bool:
+        """Запомнить ключ. False - ключ уже был (дубль), запись не меняется"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self.lookups += 1
+            if key in self._entries:
+                self.hits += 1
+                return False
+            self._entries[key] = (now, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+            return True
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": LRU,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "window_seconds": self.window,
+            "lookups": self.lookups,
+            "duplicates": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+            "evicted": self.evicted,
+        }
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._entries:
+            key, (added_at, _) = next(iter(self._entries.items()))
+            if added_at > cutoff:
+                break
+            del self._entries[key]
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray с двойным хешированием"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: str) -> bool:
+        """Добавить ключ. False - ключ (вероятно) уже был"""
+        added = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+
+class BloomSeenSet:
+    """
+    Два поколения фильтров Блума: новые ключи пишутся в текущий, проверяются оба.
+    Поколение сменяется каждые window секунд или при заполнении до capacity,
+    поэтому ключ помнится не меньше window (или capacity добавлений),
+    а память постоянна: два фильтра на capacity ключей.
+    """
+
+    def __init__(self, window: float = 3600.0, capacity: int = 1_000_000, error_rate: float = 1e-6):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.rotations = 0
+
+    def __len__(self) -> int:
+        return self._current.count + (self._previous.count if self._previous else 0)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._maybe_rotate(time.monotonic())
+            return self._seen(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return True if key in self else default
+
+    def add(self, key: str, value: Any = True) -> bool:
+        """Запомнить ключ. False - ключ уже был (или ложное срабатывание фильтра)"""
+        with self._lock:
+            self._maybe_rotate(time.monotonic())
+            self.lookups += 1
+            if self._seen(key):
+                self.hits += 1
+                return False
+            self._current.add(key)
+            return True
+
+    def discard(self, key: str) -> None:
+        # Из фильтра Блума удалить нельзя: ключ забудется при смене поколения
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "backend": BLOOM,
+            "size": len(self),
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "window_seconds": self.window,
+            "memory_bytes": len(self._current.bits) * 2,
+            "lookups": self.lookups,
+            "duplicates": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+            "rotations": self.rotations,
+        }
+
+    def _seen(self, key: str) -> bool:
+        return key in self._current or (self._previous is not None and key in self._previous)
+
+    def _maybe_rotate(self, now: float) -> None:
+        if now - self._rotated_at < self.window and self._current.count < self.capacity:
+            return
+        self._previous = self._current
+        self._current = BloomFilter(self.capacity, self.error_rate)
+        self._rotated_at = now
+        self.rotations += 1
+
+
+def make_seen_set(backend: str = LRU, window: float = 3600.0, capacity: int = 1_000_000):
+    """Множество виденных ключей по имени бэкенда (lru | bloom)"""
+    if backend == BLOOM:
+        return BloomSeenSet(window, capacity)
+    if backend == LRU:
+        return LruSeenSet(window, capacity)
+    raise ValueError(f"Неизвестный бэкенд дедупликации: {backend}")
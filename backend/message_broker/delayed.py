@@ -0,0 +1,125 @@
+"""
+Отложенная доставка сообщений брокера
+
+Сообщения с deliver_at / delay_ms хранятся в двоичной куче по времени
+доставки (O(log n) на вставку и извлечение, миллионы записей в памяти).
+Когда срок наступает, сообщение ставится в обычную очередь.
+
+Если включена персистентность (BROKER_PERSISTENCE_DIR), каждое отложенное
+сообщение записывается в журнал (JSON Lines) и переживает перезапуск брокера.
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+JOURNAL_FILE = "scheduled.jsonl"
+
+
+class DelayedQueue:
+    """Куча отложенных сообщений с фоновым потоком срабатывания"""
+
+    def __init__(
+        self,
+        on_due: Callable[[dict], None],
+        persistence_dir: Optional[str] = None,
+        compact_threshold: int = 10000,
+    ):
+        self.on_due = on_due
+        self._heap: List[Tuple[float, int, dict]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._journal = None
+        self._journal_path = None
+        # Сколько записей "done" накопилось в журнале с последнего сжатия
+        self._done_since_compact = 0
+        self.compact_threshold = compact_threshold
+        self.fired = 0
+
+        if persistence_dir:
+            os.makedirs(persistence_dir, exist_ok=True)
+            self._journal_path = os.path.join(persistence_dir, JOURNAL_FILE)
+            self._restore()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self._run, daemon=True, name="broker-delayed")
+        thread.start()
+        return thread
+
+    def schedule(self, message: dict, deliver_at: float) -> None:
+        """Запланировать доставку на deliver_at (unix-время в секундах)"""
+        with self._cond:
+            self._write({"op": "add", "due": deliver_at, "message": message})
+            heapq.heappush(self._heap, (deliver_at, next(self._seq), message))
+            # Будим поток, только если новое сообщение стало ближайшим
+            if self._heap[0][2] is message:
+                self._cond.notify()
+
+    def next_due(self) -> Optional[float]:
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, message = heapq.heappop(self._heap)
+
+            try:
+                self.on_due(message)
+            finally:
+                with self._cond:
+                    self.fired += 1
+                    self._write({"op": "done", "id": message["id"]})
+                    self._done_since_compact += 1
+                    if self._journal_path and self._done_since_compact >= self.compact_threshold:
+                        self._compact()
+
+    def _write(self, record: dict) -> None:
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+
+    def _restore(self) -> None:
+        """Восстановление невыполненных сообщений из журнала"""
+        pending = {}
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная последняя строка после аварийной остановки
+                        continue
+                    if record.get("op") == "add":
+                        pending[record["message"]["id"]] = (record["due"], record["message"])
+                    elif record.get("op") == "done":
+                        pending.pop(record.get("id"), None)
+
+        for due, message in pending.values():
+            self._heap.append((due, next(self._seq), message))
+        heapq.heapify(self._heap)
+        self._compact()
+        if self._heap:
+            print(f"[Broker] Восстановлено отложенных сообщений: {len(self._heap)}")
+
+    def _compact(self) -> None:
+        """Переписать журнал, оставив только ожидающие сообщения"""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self._journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for due, _, message in self._heap:
+                f.write(json.dumps({"op": "add", "due": due, "message": message}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+        self._done_since_compact = 0
@@ -0,0 +1,143 @@
+"""
+Приоритетные полосы диспетчера брокера
+
+Каждый тип события попадает в полосу по EVENT_PRIORITIES. Диспетчер выбирает
+следующее сообщение по взвешенному справедливому планированию (deficit round-robin):
+за раунд полоса получает до weight сообщений, полосы обходятся от высокого
+приоритета к низкому. Внутри полосы типы событий обслуживаются по кругу.
+
+Порядок по брони (ordering_key): пока в очередях ждёт сообщение брони, следующие
+сообщения той же брони встают за ним в ту же очередь, независимо от своего типа
+и полосы. Иначе booking.cancelled (normal) обгонял бы ждущий booking.created
+(low) той же брони, и подписчики видели бы жизненный цикл не по порядку.
+"""
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Tuple
+
+try:
+    from metrics import Histogram
+    from ordering import ordering_key
+except ImportError:
+    from message_broker.metrics import Histogram
+    from message_broker.ordering import ordering_key
+
+
+class Lane:
+    """Полоса доставки"""
+
+    def __init__(self, name: str, weight: int):
+        self.name = name
+        self.weight = max(1, int(weight))
+        self.credit = self.weight
+        # Типы событий, у которых есть ожидающие сообщения (очередь обхода по кругу)
+        self.active: Deque[str] = deque()
+        self.pending = 0
+        self.dispatched = 0
+        # Время ожидания в очереди и полная задержка доставки
+        self.queue_wait = Histogram()
+        self.delivery_latency = Histogram()
+
+    def stats(self) -> dict:
+        return {
+            "weight": self.weight,
+            "pending": self.pending,
+            "dispatched": self.dispatched,
+            "queue_wait": self.queue_wait.summary(),
+            "delivery_latency": self.delivery_latency.summary(),
+        }
+
+
+class LaneScheduler:
+    """Очереди сообщений по типам событий, сгруппированные в приоритетные полосы"""
+
+    def __init__(self, lane_weights: Dict[str, int], event_priorities: Dict[str, str], default_lane: str):
+        # Порядок словаря задаёт приоритет: первая полоса - самая важная
+        self.lanes: Dict[str, Lane] = {name: Lane(name, w) for name, w in lane_weights.items()}
+        self.event_priorities = event_priorities
+        self.default_lane = default_lane if default_lane in self.lanes else next(iter(self.lanes))
+        # event_type -> deque[(enqueued_at, message)]; в очереди типа могут ждать
+        # сообщения других типов той же брони (см. _key_queues)
+        self.queues: Dict[str, Deque[Tuple[float, dict]]] = {}
+        # Ключ упорядочивания с ждущими сообщениями -> [очередь, число сообщений]
+        self._key_queues: Dict[str, list] = {}
+        # Ждущие сообщения по их собственному типу события
+        self._type_sizes: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def lane_for(self, event_type: str) -> Lane:
+        name = self.event_priorities.get(event_type, self.default_lane)
+        return self.lanes.get(name) or self.lanes[self.default_lane]
+
+    def push(self, message: dict) -> int:
+        """Поставить сообщение в очередь, вернуть размер очереди типа события"""
+        key = ordering_key(message)
+        with self._cond:
+            self._type_sizes[message["t"]] = self._type_sizes.get(message["t"], 0) + 1
+            waiting = self._key_queues.get(key)
+            if waiting is None:
+                waiting = self._key_queues[key] = [message["t"], 0]
+            waiting[1] += 1
+            # За ждущим сообщением той же брони - в его очередь (и полосу)
+            queue_name = waiting[0]
+            lane = self.lane_for(queue_name)
+            queue = self.queues.get(queue_name)
+            if queue is None:
+                queue = self.queues[queue_name] = deque()
+            if not queue:
+                lane.active.append(queue_name)
+            queue.append((time.monotonic(), message))
+            lane.pending += 1
+            self._cond.notify()
+            return len(queue)
+
+    def pop(self, timeout: Optional[float] = None) -> Optional[Tuple[Lane, float, dict]]:
+        """Следующее сообщение по взвешенному планированию (ждёт до timeout)"""
+        with self._cond:
+            item = self._next_locked()
+            if item is None and self._cond.wait(timeout):
+                item = self._next_locked()
+            return item
+
+    def _next_locked(self) -> Optional[Tuple[Lane, float, dict]]:
+        for _ in range(2):
+            for lane in self.lanes.values():
+                if lane.credit > 0 and lane.active:
+                    lane.credit -= 1
+                    return self._pop_from(lane)
+            # У всех непустых полос закончился кредит - начинаем новый раунд
+            for lane in self.lanes.values():
+                lane.credit = lane.weight
+        return None
+
+    def _pop_from(self, lane: Lane) -> Tuple[Lane, float, dict]:
+        event_type = lane.active.popleft()
+        queue = self.queues[event_type]
+        enqueued_at, message = queue.popleft()
+        if queue:
+            lane.active.append(event_type)
+        self._type_sizes[message["t"]] -= 1
+        key = ordering_key(message)
+        waiting = self._key_queues[key]
+        waiting[1] -= 1
+        if not waiting[1]:
+            del self._key_queues[key]
+        lane.pending -= 1
+        lane.dispatched += 1
+        lane.queue_wait.observe(time.monotonic() - enqueued_at)
+        return lane, enqueued_at, message
+
+    def sizes(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._type_sizes)
+
+    def peek(self, event_type: str, limit: int) -> List[dict]:
+        with self._cond:
+            messages = (m for queue in self.queues.values() for _, m in queue if m["t"] == event_type)
+            return list(islice(messages, limit))
+
+    def lane_stats(self) -> Dict[str, dict]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
@@ -2,15 +2,44 @@
 Message Broker - Простой брокер сообщений для событийно-ориентированной архитектуры
 В реальной системе здесь будет RabbitMQ или Kafka
 """
-from flask import Flask, request, jsonify
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from datetime import datetime
-from collections import defaultdict
-import uuid
 import threading
 import requests
 import time
-import os
+
+from schemas import envelope as envelopes
+
+try:
+    from consumer_groups import ConsumerGroup
+    from lanes import LaneScheduler
+    from delayed import DelayedQueue
+    from metrics import Registry, Meter, PROMETHEUS_CONTENT_TYPE
+    from dedup import make_seen_set
+    from client import TOKEN_HEADER
+    from ordering import OrderedDispatcher, ordering_key
+    from config import (
+        LANE_WEIGHTS, EVENT_PRIORITIES, DEFAULT_LANE, TRANSPORT,
+        DEDUP_BACKEND, DEDUP_WINDOW, DEDUP_CAPACITY,
+    )
+except ImportError:
+    from message_broker.consumer_groups import ConsumerGroup
+    from message_broker.lanes import LaneScheduler
+    from message_broker.delayed import DelayedQueue
+    from message_broker.metrics import Registry, Meter, PROMETHEUS_CONTENT_TYPE
+    from message_broker.dedup import make_seen_set
+    from message_broker.client import TOKEN_HEADER
+    from message_broker.ordering import OrderedDispatcher, ordering_key
+    from message_broker.config import (
+        LANE_WEIGHTS, EVENT_PRIORITIES, DEFAULT_LANE, TRANSPORT,
+        DEDUP_BACKEND, DEDUP_WINDOW, DEDUP_CAPACITY,
+    )
 
 app = Flask(__name__)
 CORS(app)
@@ -18,157 +47,574 @@ CORS(app)
 # Конфигурация
 INTEGRATION_SERVICE_URL = os.getenv("INTEGRATION_SERVICE_URL", "http://localhost:5003")
 NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://localhost:5004")
+PAYMENT_SERVICE_URL = os.getenv("PAYMENT_SERVICE_URL", "http://localhost:5002")
+API_GATEWAY_URL = os.getenv("API_GATEWAY_URL", "http://localhost:5000")
 PORT = int(os.getenv("PORT", 5050))
 
-# Хранилище сообщений (очереди для разных типов событий)
-queues: dict = defaultdict(list)
+# Группы потребителей
+GROUP_STRATEGY = os.getenv("BROKER_GROUP_STRATEGY", "least_outstanding")
+HEARTBEAT_TTL = float(os.getenv("BROKER_HEARTBEAT_TTL", 15))
+MEMBER_EVICT_AFTER = float(os.getenv("BROKER_MEMBER_EVICT_AFTER", 60))
+# Потоки-доставщики (шарды): события одной брони подписчику - по очереди, в одном шарде
+DELIVERY_WORKERS = int(os.getenv("BROKER_DELIVERY_WORKERS", 8))
+# Сколько разных участников группы пробуем, прежде чем считать доставку проваленной
+DELIVERY_ATTEMPTS = int(os.getenv("BROKER_DELIVERY_ATTEMPTS", 2))
+# Сколько доставок одновременно "в полёте". Остальные сообщения ждут в полосах,
+# поэтому при перегрузке приоритет решает, что уйдёт следующим
+MAX_IN_FLIGHT = int(os.getenv("BROKER_MAX_IN_FLIGHT", DELIVERY_WORKERS * 2))
+# Общий секрет для доставок по HTTP (заголовок X-Broker-Token): по нему
+# gateway принимает /broker/consume только от брокера
+BROKER_CONSUME_TOKEN = os.getenv("BROKER_CONSUME_TOKEN") or None
+# Каталог для персистентности брокера (отложенные сообщения); пусто - только в памяти
+PERSISTENCE_DIR = os.getenv("BROKER_PERSISTENCE_DIR") or None
+
+# Хранилище сообщений (очереди для разных типов событий в приоритетных полосах)
+scheduler = LaneScheduler(LANE_WEIGHTS, EVENT_PRIORITIES, DEFAULT_LANE)
+
+# Отложенные сообщения: по наступлении срока попадают в обычную очередь
+delayed = DelayedQueue(lambda message: enqueue(message), persistence_dir=PERSISTENCE_DIR)
+
+# Уже принятые публикации (ключ идемпотентности производителя или message_id)
+published_keys = make_seen_set(DEDUP_BACKEND, DEDUP_WINDOW, DEDUP_CAPACITY)
+
+# Метрики брокера (GET /metrics - формат Prometheus, GET /broker/stats - JSON)
+metrics = Registry()
+published_total = metrics.counter(
+    "broker_messages_published_total", "Опубликовано сообщений", ("event_type",)
+)
+delivered_total = metrics.counter(
+    "broker_messages_delivered_total", "Успешных доставок", ("event_type", "subscriber")
+)
+failed_total = metrics.counter(
+    "broker_delivery_failures_total", "Проваленных доставок", ("event_type", "subscriber")
+)
+in_flight = metrics.gauge(
+    "broker_deliveries_in_flight", "Доставок в процессе", ("event_type", "subscriber")
+)
+consumer_lag = metrics.gauge(
+    "broker_consumer_lag", "Сообщений в очереди или в доставке для подписчика", ("event_type", "subscriber")
+)
+delivery_latency = metrics.histogram(
+    "broker_delivery_latency_seconds", "Задержка от постановки в очередь до доставки", ("event_type", "subscriber")
+)
+duplicates_total = metrics.counter(
+    "broker_duplicate_publishes_total", "Отброшенных повторных публикаций", ("event_type",)
+)
+queue_depth = metrics.gauge("broker_queue_depth", "Сообщений в очереди", ("event_type",))
+scheduled_messages = metrics.gauge("broker_scheduled_messages", "Отложенных сообщений")
+lane_queue_wait = metrics.histogram("broker_lane_queue_wait_seconds", "Ожидание в очереди полосы", ("lane",))
+lane_delivery_latency = metrics.histogram(
+    "broker_lane_delivery_latency_seconds", "Задержка доставки по полосам", ("lane",)
+)
+for _lane in scheduler.lanes.values():
+    # Гистограммы полос уже ведёт планировщик - выводим их же
+    lane_queue_wait.histograms[(_lane.name,)] = _lane.queue_wait
+    lane_delivery_latency.histograms[(_lane.name,)] = _lane.delivery_latency
+
+# Скорости (1-минутное скользящее среднее) для /broker/stats
+publish_meters: dict = {}
+deliver_meters: dict = {}
+
+
+def collect_gauges() -> dict:
+    """
+    Обновить вычисляемые метрики перед выдачей.
+    Лаг подписчика = сообщения типа в очереди + его доставки в полёте,
+    поэтому он не расходится при изменении подписок.
+    """
+    sizes = scheduler.sizes()
+    for event_type, size in sizes.items():
+        queue_depth.set((event_type,), size)
+        for subscriber in subscribers.get(event_type, ()):
+            key = (event_type, subscriber)
+            consumer_lag.set(key, size + in_flight.get(key))
+    scheduled_messages.set((), len(delayed))
+    return sizes
+
+
+def _meter(meters: dict, key: str) -> Meter:
+    meter = meters.get(key)
+    if meter is None:
+        meter = meters.setdefault(key, Meter())
+    return meter
 
 # Подписчики на события
 subscribers = {
-    "booking.created": ["integration", "notification"],
-    "booking.confirmed": ["integration", "notification"],
-    "booking.cancelled": ["integration", "notification"],
-    "payment.succeeded": ["integration", "notification"],
-    "payment.failed": ["integration"],
+    "booking.created": ["integration", "notification", "payment", "gateway"],
+    "booking.confirmed": ["integration", "notification", "payment", "gateway"],
+    "booking.cancelled": ["integration", "notification", "payment", "gateway"],
+    "payment.succeeded": ["integration", "notification", "gateway"],
+    "payment.failed": ["integration", "gateway"],
 }
 
-# URL сервисов-подписчиков
+# URL сервисов-подписчиков (статические участники групп)
 subscriber_urls = {
     "integration": f"{INTEGRATION_SERVICE_URL}/broker/consume",
     "notification": f"{NOTIFICATION_SERVICE_URL}/broker/consume",
+    # Read-модель броней Payment Service
+    "payment": f"{PAYMENT_SERVICE_URL}/broker/consume",
+    # Инвалидация кэша ответов API Gateway
+    "gateway": f"{API_GATEWAY_URL}/broker/consume",
 }
 
+# Группы потребителей: имя подписчика -> реплики с callback-адресами
+consumer_groups: dict = {}
+consumer_groups_lock = threading.Lock()
+
+in_flight_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+
+def get_group(subscriber: str, create: bool = False):
+    """Группа потребителей по имени подписчика"""
+    with consumer_groups_lock:
+        group = consumer_groups.get(subscriber)
+        if group is None and create:
+            group = ConsumerGroup(
+                subscriber,
+                strategy=GROUP_STRATEGY,
+                heartbeat_ttl=HEARTBEAT_TTL,
+                evict_after=MEMBER_EVICT_AFTER,
+            )
+            consumer_groups[subscriber] = group
+        return group
+
+
+# Во встроенном режиме сервисы регистрируют обработчики сами (register_local_consumer)
+if TRANSPORT != "inprocess":
+    for _name, _url in subscriber_urls.items():
+        get_group(_name, create=True).join(_url, static=True)
+
+
+def register_local_consumer(subscriber: str, handler, event_types=None) -> None:
+    """
+    Регистрация обработчика подписчика из того же процесса.
+    Сообщение передаётся обработчику как dict, без HTTP и JSON.
+    """
+    for et in event_types or []:
+        if et not in subscribers:
+            subscribers[et] = []
+        if subscriber not in subscribers[et]:
+            subscribers[et].append(subscriber)
+    get_group(subscriber, create=True).join(f"local://{subscriber}", static=True, handler=handler)
+
+
+class WireCache:
+    """
+    Закодированное сообщение по Content-Type: кодируем один раз на сообщение,
+    а не на каждого подписчика
+    """
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.bodies = {}
+
+    def body(self, content_type: str) -> bytes:
+        body = self.bodies.get(content_type)
+        if body is None:
+            body = self.bodies[content_type] = envelopes.encode(self.message, content_type)
+        return body
 
-def deliver_message(subscriber: str, message: dict):
-    """Доставка сообщения подписчику"""
-    url = subscriber_urls.get(subscriber)
-    if not url:
+
+def delivery_headers(content_type: str) -> dict:
+    headers = {"Content-Type": content_type}
+    if BROKER_CONSUME_TOKEN:
+        headers[TOKEN_HEADER] = BROKER_CONSUME_TOKEN
+    return headers
+
+
+def deliver_message(subscriber: str, message: dict, wire: WireCache = None):
+    """Доставка сообщения одному из здоровых участников группы подписчика"""
+    group = get_group(subscriber)
+    if group is None:
         print(f"[Broker] Подписчик {subscriber} не найден")
         return False
-    
+
+    wire = wire or WireCache(message)
+    tried = set()
+    # Участник, не ответивший вовремя: сообщение могло быть обработано, повтор - ему же
+    sticky = None
+    for _ in range(DELIVERY_ATTEMPTS):
+        member = group.acquire(exclude=tried, prefer=sticky)
+        if member is None:
+            break
+        tried.add(member.callback_url)
+        sticky = None
+
+        success = False
+        try:
+            if member.handler is not None:
+                success = bool(member.handler(message))
+            else:
+                response = requests.post(
+                    member.callback_url,
+                    data=wire.body(member.content_type),
+                    headers=delivery_headers(member.content_type),
+                    timeout=5,
+                )
+                success = response.status_code == 200
+        except requests.exceptions.ReadTimeout as e:
+            # Запрос доставлен, ответа нет. Дедупликация потребителя - в процессе реплики,
+            # поэтому повтор другой реплике выполнил бы обработку второй раз
+            print(f"[Broker] Нет ответа {subscriber} ({member.callback_url}), повтор той же реплике: {e}")
+            sticky = member.callback_url
+        except Exception as e:
+            print(f"[Broker] Ошибка доставки сообщения {subscriber} ({member.callback_url}): {e}")
+        finally:
+            group.release(member, success)
+
+        if success:
+            return True
+
+    if not tried:
+        print(f"[Broker] У подписчика {subscriber} нет здоровых участников")
+    return False
+
+
+def enqueue(message: dict) -> int:
+    """Постановка сообщения в очередь полосы (сразу или по наступлении срока)"""
+    return scheduler.push(message)
+
+
+def deliver_and_log(
+    subscriber: str, message: dict, lane=None, enqueued_at: float = None, wire: WireCache = None
+) -> None:
+    event_type = message["t"]
+    key = (event_type, subscriber)
     try:
-        response = requests.post(url, json=message, timeout=5)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"[Broker] Ошибка доставки сообщения {subscriber}: {e}")
-        return False
+        success = deliver_message(subscriber, message, wire)
+        if lane is not None:
+            latency = time.monotonic() - enqueued_at
+            lane.delivery_latency.observe(latency)
+            delivery_latency.observe(key, latency)
+        (delivered_total if success else failed_total).inc(key)
+        if success:
+            _meter(deliver_meters, subscriber).mark()
+        if not success:
+            # 🔑 Просто логируем ошибку и НЕ возвращаем в очередь
+            print(f"[Broker] Сообщение {message['id']} для {subscriber} провалено")
+        else:
+            print(f"[Broker] Сообщение {message['id']} доставлено {subscriber}")
+    finally:
+        in_flight.dec(key)
+        in_flight_slots.release()
+
+
+delivery_shards = OrderedDispatcher(deliver_and_log, DELIVERY_WORKERS)
 
 
 def process_queue():
     while True:
-        for event_type, queue in list(queues.items()):
-            if not queue:
-                continue
+        # Ждём свободный слот до выбора сообщения: пока доставки заняты,
+        # сообщения остаются в полосах и приоритет применяется к ним
+        in_flight_slots.acquire()
+        item = scheduler.pop(timeout=1.0)
+        if item is None:
+            in_flight_slots.release()
+            continue
+
+        lane, enqueued_at, message = item  # достали из очереди ОДИН РАЗ
 
-            message = queue.pop(0)  # достали из очереди ОДИН РАЗ
+        # Каждой группе - параллельно, внутри группы - одному участнику;
+        # события одной брони подписчику - по очереди (один шард)
+        subscribers_list = list(subscribers.get(message["t"], []))
+        if not subscribers_list:
+            in_flight_slots.release()
+            continue
+        wire = WireCache(message)
+        key = ordering_key(message)
+        for i, subscriber in enumerate(subscribers_list):
+            if i > 0:
+                in_flight_slots.acquire()
+            in_flight.inc((message["t"], subscriber))
+            delivery_shards.submit(subscriber, key, subscriber, message, lane, enqueued_at, wire)
 
-            subscribers_list = subscribers.get(event_type, [])
-            for subscriber in subscribers_list:
-                success = deliver_message(subscriber, message)
 
-                if not success:
-                    # 🔑 Просто логируем ошибку и НЕ возвращаем в очередь
-                    print(f"[Broker] Сообщение {message['message_id']} для {subscriber} провалено")
-                else:
-                    print(f"[Broker] Сообщение {message['message_id']} доставлено {subscriber}")
+def parse_deliver_at(data: dict):
+    """
+    Время отложенной доставки (unix-время) из deliver_at или delay_ms.
+    deliver_at - ISO 8601 или unix-время в секундах. None - доставить сразу.
+    """
+    deliver_at = data.get("deliver_at")
+    delay_ms = data.get("delay_ms")
+    if deliver_at is not None and delay_ms is not None:
+        raise ValueError("Укажите только одно из полей: deliver_at или delay_ms")
 
-        time.sleep(0.5)
+    if delay_ms is not None:
+        delay_ms = float(delay_ms)
+        if delay_ms < 0:
+            raise ValueError("delay_ms не может быть отрицательным")
+        return time.time() + delay_ms / 1000 if delay_ms > 0 else None
 
+    if deliver_at is not None:
+        if isinstance(deliver_at, (int, float)):
+            due = float(deliver_at)
+        else:
+            due = datetime.fromisoformat(str(deliver_at).replace("Z", "+00:00")).timestamp()
+        return due if due > time.time() else None
 
+    return None
 
-# Запускаем обработчик очереди в отдельном потоке
+
+# Запускаем обработчик очереди и таймер отложенных сообщений в отдельных потоках
 threading.Thread(target=process_queue, daemon=True).start()
+delayed.start()
 
 
-@app.route("/broker/publish", methods=["POST"])
-def publish():
-    """Публикация сообщения в брокер"""
+def publish_message(message: dict) -> dict:
+    """
+    Публикация конверта (schemas/envelope.py): общая часть для HTTP
+    и встроенного (in-process) транспорта. Ошибки валидации - ValueError.
+    """
+    event_type = message.get("t")
+    if not event_type:
+        raise ValueError("event_type is required")
+    
     try:
-        data = request.json
-        
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        event_type = data.get("event_type")
-        if not event_type:
-            return jsonify({"error": "event_type is required"}), 400
-        
-        message = {
-            "message_id": str(uuid.uuid4()),
-            "event_type": event_type,
-            "source_service": data.get("source_service", "unknown"),
-            "payload": data,
-            "timestamp": datetime.now().isoformat()
+        deliver_at = parse_deliver_at(message)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Неверное время доставки: {e}")
+    
+    # Повторная публикация (ретрай производителя) не ставится в очередь второй раз
+    dedup_key = f"{message.get('s', 'unknown')}:{message.get('idempotency_key') or message['id']}"
+    if not published_keys.add(dedup_key):
+        duplicates_total.inc((event_type,))
+        print(f"[Broker] Повторная публикация отброшена: {event_type} ({dedup_key})")
+        return {"status": "duplicate", "message_id": message["id"]}
+    
+    # Параметры публикации не хранятся и не доставляются подписчикам
+    for option in envelopes.PUBLISH_OPTIONS:
+        message.pop(option, None)
+    
+    # Публикация учитывается один раз - при приёме, в том числе отложенная
+    # (срабатывание отложенного сообщения - delayed.fired)
+    published_total.inc((event_type,))
+    _meter(publish_meters, event_type).mark()
+    
+    if deliver_at is not None:
+        delayed.schedule(message, deliver_at)
+        print(f"[Broker] Сообщение отложено: {event_type} до {datetime.fromtimestamp(deliver_at).isoformat()}")
+        return {
+            "status": "scheduled",
+            "message_id": message["id"],
+            "deliver_at": datetime.fromtimestamp(deliver_at).isoformat(),
+            "scheduled_size": len(delayed)
         }
-        
-        # Добавляем в очередь
-        queues[event_type].append(message)
-        
-        print(f"[Broker] Сообщение опубликовано: {event_type} (очередь: {len(queues[event_type])})")
-        
-        return jsonify({
-            "status": "published",
-            "message_id": message["message_id"],
-            "queue_size": len(queues[event_type])
-        }), 200
     
+    # Добавляем в очередь
+    queue_size = enqueue(message)
+    
+    print(f"[Broker] Сообщение опубликовано: {event_type} (очередь: {queue_size})")
+    
+    return {
+        "status": "published",
+        "message_id": message["id"],
+        "queue_size": queue_size
+    }
+
+
+@app.route("/broker/publish", methods=["POST"])
+def publish():
+    """
+    Публикация сообщения в брокер.
+    Тело - компактный конверт (JSON или MessagePack по Content-Type)
+    либо событие в прежнем формате application/json.
+    """
+    try:
+        message = envelopes.decode(request.get_data(), request.content_type)
+        if request.headers.get("Idempotency-Key"):
+            message["idempotency_key"] = request.headers["Idempotency-Key"]
+        return jsonify(publish_message(message)), 200
+    except envelopes.UnsupportedContentType as e:
+        return jsonify({"error": str(e)}), 415
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/broker/queues", methods=["GET"])
 def get_queues():
-    """Получение информации об очередях"""
+    """Получение информации об очередях (?limit= - сколько сообщений показать)"""
+    limit = int(request.args.get("limit", 10))
     queue_info = {
         event_type: {
-            "size": len(queue),
-            "messages": queue[:10]  # Первые 10 сообщений для просмотра
+            "size": size,
+            "lane": scheduler.lane_for(event_type).name,
+            "messages": scheduler.peek(event_type, limit)  # Первые сообщения для просмотра
         }
-        for event_type, queue in queues.items()
+        for event_type, size in scheduler.sizes().items()
     }
     
     return jsonify(queue_info), 200
 
 
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Метрики брокера в текстовом формате Prometheus"""
+    collect_gauges()
+    return Response(metrics.render(), mimetype=None, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route("/broker/stats", methods=["GET"])
+def get_stats():
+    """Пропускная способность, лаг и задержки доставки по типам событий и подписчикам"""
+    sizes = collect_gauges()
+
+    event_types = set(sizes) | {key[0] for key in list(published_total.values)}
+    by_event_type = {
+        event_type: {
+            "published": published_total.get((event_type,)),
+            "publish_rate": round(_meter(publish_meters, event_type).rate(), 3),
+            "queue_depth": sizes.get(event_type, 0),
+        }
+        for event_type in sorted(event_types)
+    }
+
+    by_subscriber = {}
+    for key in sorted(set(delivery_latency.histograms) | set(in_flight.values)):
+        event_type, subscriber = key
+        entry = by_subscriber.setdefault(subscriber, {
+            "deliver_rate": round(_meter(deliver_meters, subscriber).rate(), 3),
+            "event_types": {},
+        })
+        entry["event_types"][event_type] = {
+            "delivered": delivered_total.get(key),
+            "failed": failed_total.get(key),
+            "in_flight": in_flight.get(key),
+            "lag": consumer_lag.get(key),
+            "latency": delivery_latency.get(key).summary(),
+        }
+
+    return jsonify({
+        "event_types": by_event_type,
+        "subscribers": by_subscriber,
+        "dedup": published_keys.stats(),
+    }), 200
+
+
+@app.route("/broker/scheduled", methods=["GET"])
+def get_scheduled():
+    """Информация об отложенных сообщениях"""
+    next_due = delayed.next_due()
+    return jsonify({
+        "size": len(delayed),
+        "next_due": datetime.fromtimestamp(next_due).isoformat() if next_due else None,
+        "fired": delayed.fired,
+        "persistent": PERSISTENCE_DIR is not None,
+    }), 200
+
+
+@app.route("/broker/lanes", methods=["GET"])
+def get_lanes():
+    """Приоритетные полосы: веса, очереди и задержки (p50/p95/p99)"""
+    return jsonify({
+        "event_priorities": EVENT_PRIORITIES,
+        "lanes": scheduler.lane_stats(),
+    }), 200
+
+
 @app.route("/broker/subscribe", methods=["POST"])
 def subscribe():
-    """Подписка на события (для динамической подписки)"""
+    """
+    Подписка на события (для динамической подписки).
+
+    callback_url добавляется в группу потребителей subscriber, а не заменяет
+    существующий: несколько реплик делят между собой поток сообщений.
+    Динамические участники должны присылать heartbeat (/broker/heartbeat).
+    """
     try:
-        data = request.json
+        data = request.json or {}
         event_type = data.get("event_type")
+        event_types = data.get("event_types") or ([event_type] if event_type else [])
         subscriber = data.get("subscriber")
         callback_url = data.get("callback_url")
         
-        if not all([event_type, subscriber, callback_url]):
+        if not all([event_types, subscriber, callback_url]):
             return jsonify({"error": "event_type, subscriber, callback_url are required"}), 400
         
-        if event_type not in subscribers:
-            subscribers[event_type] = []
-        
-        if subscriber not in subscribers[event_type]:
-            subscribers[event_type].append(subscriber)
+        for et in event_types:
+            if et not in subscribers:
+                subscribers[et] = []
+            
+            if subscriber not in subscribers[et]:
+                subscribers[et].append(subscriber)
         
-        subscriber_urls[subscriber] = callback_url
+        group = get_group(subscriber, create=True)
+        # Кодировка доставки: компактный JSON или MessagePack, если реплика его принимает
+        content_type = envelopes.negotiate(data.get("accept"))
+        group.join(callback_url, weight=data.get("weight", 1), content_type=content_type)
         
-        return jsonify({"status": "subscribed"}), 200
+        return jsonify({
+            "status": "subscribed",
+            "subscriber": subscriber,
+            "members": len(group.members),
+            "heartbeat_ttl": HEARTBEAT_TTL,
+            "content_type": content_type,
+        }), 200
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/broker/heartbeat", methods=["POST"])
+def heartbeat():
+    """Heartbeat участника группы потребителей"""
+    data = request.json or {}
+    subscriber = data.get("subscriber")
+    callback_url = data.get("callback_url")
+    if not subscriber or not callback_url:
+        return jsonify({"error": "subscriber, callback_url are required"}), 400
+
+    group = get_group(subscriber)
+    if group is None or not group.heartbeat(callback_url):
+        # Участник уже исключён - клиент должен подписаться заново
+        return jsonify({"error": "Участник не найден, требуется повторная подписка"}), 404
+
+    return jsonify({"status": "ok", "heartbeat_ttl": HEARTBEAT_TTL}), 200
+
+
+@app.route("/broker/unsubscribe", methods=["POST"])
+def unsubscribe():
+    """Выход реплики из группы потребителей (например, при остановке)"""
+    data = request.json or {}
+    subscriber = data.get("subscriber")
+    callback_url = data.get("callback_url")
+    if not subscriber or not callback_url:
+        return jsonify({"error": "subscriber, callback_url are required"}), 400
+
+    group = get_group(subscriber)
+    if group is None or not group.leave(callback_url):
+        return jsonify({"error": "Участник не найден"}), 404
+
+    return jsonify({"status": "unsubscribed"}), 200
+
+
+@app.route("/broker/groups", methods=["GET"])
+def get_groups():
+    """Состав групп потребителей"""
+    with consumer_groups_lock:
+        groups = dict(consumer_groups)
+    return jsonify({name: group.to_dict() for name, group in groups.items()}), 200
+
+
 @app.route("/health", methods=["GET"])
 def health():
     """Health check"""
-    total_messages = sum(len(q) for q in queues.values())
+    sizes = scheduler.sizes()
+    total_messages = sum(sizes.values())
     return jsonify({
         "status": "healthy",
         "service": "message_broker",
-        "queues": {k: len(v) for k, v in queues.items()},
-        "total_messages": total_messages
+        "queues": sizes,
+        "lanes": {name: lane.pending for name, lane in scheduler.lanes.items()},
+        "total_messages": total_messages,
+        "scheduled_messages": len(delayed),
+        "consumer_groups": {name: group.healthy_count() for name, group in list(consumer_groups.items())},
     }), 200
 
 
 if __name__ == "__main__":
     print(f"Starting Message Broker on port {PORT}")
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    # Без перезагрузчика: иначе журнал восстановят два процесса и отложенные сообщения обработаются дважды
+    app.run(host="0.0.0.0", port=PORT, debug=True, use_reloader=False)
 
@@ -0,0 +1,247 @@
+"""
+Лёгкие метрики брокера: счётчики, гистограммы задержек с фиксированными
+бакетами и вывод в текстовом формате Prometheus
+
+Наблюдение - это поиск бакета или инкремент значения в словаре под блокировкой,
+поэтому метрики можно держать включёнными в продакшене.
+"""
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Границы бакетов в секундах (как принято в Prometheus)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами и оценкой квантилей"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets: List[float] = list(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # последний - +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри бакета"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            observed_max = self.max
+        if total == 0:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for i, c in enumerate(counts):
+            if c and cumulative + c >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else observed_max
+                upper = min(upper, observed_max)
+                return lower + (upper - lower) * ((rank - cumulative) / c)
+            cumulative += c
+        return observed_max
+
+    def summary(self) -> dict:
+        """Сводка в миллисекундах для JSON-эндпоинтов"""
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            "count": self.count,
+            "avg_ms": ms(self.sum / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.50)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+            "max_ms": ms(self.max) if self.count else None,
+        }
+
+    def snapshot(self):
+        """Кумулятивные значения бакетов, сумма и количество (для Prometheus)"""
+        with self._lock:
+            counts = list(self.counts)
+            total, value_sum = self.count, self.sum
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, value_sum, total
+
+
+class Meter:
+    """
+    Скорость событий в секунду: экспоненциальное скользящее среднее за минуту.
+    mark() - только инкремент; пересчёт ленивый, раз в TICK секунд.
+    """
+
+    TICK = 5.0
+    ALPHA = 1 - math.exp(-TICK / 60.0)
+
+    def __init__(self):
+        self._uncounted = 0
+        self._rate = None
+        self._last_tick = time.monotonic()
+        self._lock = threading.Lock()
+
+    def mark(self, n: int = 1) -> None:
+        with self._lock:
+            self._uncounted += n
+            self._tick_locked()
+
+    def rate(self) -> float:
+        with self._lock:
+            self._tick_locked()
+            return self._rate or 0.0
+
+    def _tick_locked(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_tick
+        if elapsed < self.TICK:
+            return
+        ticks = int(elapsed // self.TICK)
+        instant = self._uncounted / (ticks * self.TICK)
+        self._uncounted = 0
+        self._last_tick += ticks * self.TICK
+        if self._rate is None:
+            self._rate = instant
+        else:
+            # Первый тик несёт накопленные события, остальные пропущенные - нулевые
+            self._rate += self.ALPHA * (instant * ticks - self._rate)
+            self._rate *= (1 - self.ALPHA) ** (ticks - 1)
+
+
+class _Labeled:
+    """Метрика с метками: значение на каждый набор значений меток"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _labels(self, key: Tuple[str, ...]) -> str:
+        if not key:
+            return ""
+        pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key))
+        return "{" + pairs + "}"
+
+
+class Counter(_Labeled):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, key: Tuple[str, ...] = (), amount: float = 1) -> None:
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, key: Tuple[str, ...] = ()) -> float:
+        return self.values.get(key, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self.values.items())
+        return [f"{self.name}{self._labels(k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, key: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self.inc(key, -amount)
+
+    def set(self, key: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            self.values[key] = value
+
+
+class LabeledHistogram(_Labeled):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.histograms: Dict[Tuple[str, ...], Histogram] = {}
+
+    def get(self, key: Tuple[str, ...] = ()) -> Histogram:
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, key: Tuple[str, ...], value: float) -> None:
+        self.get(key).observe(value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self.histograms.items())
+        lines = []
+        for key, histogram in items:
+            cumulative, value_sum, total = histogram.snapshot()
+            base = list(zip(self.labelnames, key))
+            for bound, count in zip(histogram.buckets + [math.inf], cumulative):
+                le = "+Inf" if bound == math.inf else repr(bound)
+                pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in base + [("le", le)])
+                lines.append(f"{self.name}_bucket{{{pairs}}} {count}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_number(value_sum)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {total}")
+        return lines
+
+
+class Registry:
+    """Набор метрик сервиса с выводом в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics: List[_Labeled] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> LabeledHistogram:
+        return self.register(LabeledHistogram(name, help_text, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
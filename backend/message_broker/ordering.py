@@ -0,0 +1,58 @@
+"""
+Упорядоченная доставка: события одной брони - подписчику по очереди
+
+Доставки распределяются по шардам: шард - очередь и один поток-доставщик.
+Шард выбирается по (подписчик, ключ упорядочивания), поэтому события одной
+брони доставляются подписчику в том порядке, в котором их выдал диспетчер
+(а он выдаёт события брони в порядке публикации, см. lanes.py); доставки
+разным подписчикам и разным броням идут параллельно (как webhook-и в
+Payment Service). Медленная доставка задерживает только свой шард.
+
+Ключ упорядочивания - booking_id события; у событий без брони - id сообщения
+(порядок не нужен, шард - любой).
+"""
+import hashlib
+import queue
+import threading
+from typing import Callable, List, Optional
+
+
+def ordering_key(message: dict) -> str:
+    """Ключ упорядочивания сообщения: booking_id из данных события, иначе id сообщения"""
+    data = message.get("d")
+    if isinstance(data, dict):
+        if data.get("booking_id"):
+            return str(data["booking_id"])
+        for field in ("booking", "payment"):
+            nested = data.get(field)
+            if isinstance(nested, dict) and nested.get("booking_id"):
+                return str(nested["booking_id"])
+    return str(message.get("id", ""))
+
+
+class OrderedDispatcher:
+    """Шарды доставки: deliver(*args) вызывается в потоке шарда по ключу"""
+
+    def __init__(self, deliver: Callable[..., None], workers: int = 8, name: str = "broker-delivery"):
+        self._deliver = deliver
+        self._shards: List[queue.Queue] = [queue.Queue() for _ in range(max(1, int(workers)))]
+        for i, shard in enumerate(self._shards):
+            threading.Thread(target=self._run, args=(shard,), name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, subscriber: str, key: Optional[str], *args) -> None:
+        self._shard_for(f"{subscriber}:{key or ''}").put(args)
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._shards)
+
+    def _shard_for(self, key: str) -> queue.Queue:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return self._shards[int.from_bytes(digest, "little") % len(self._shards)]
+
+    def _run(self, shard: queue.Queue) -> None:
+        while True:
+            args = shard.get()
+            try:
+                self._deliver(*args)
+            except Exception as e:
+                print(f"[Broker] Ошибка в потоке доставки: {e}")
@@ -0,0 +1,103 @@
+"""
+Транспорт между сервисами и Message Broker
+
+Выбирается переменной окружения BROKER_TRANSPORT:
+- "http" (по умолчанию): публикация - POST в /broker/publish,
+  доставка - POST брокера в /broker/consume подписчика
+  (компактный конверт schemas/envelope.py, BROKER_WIRE_FORMAT=json|msgpack);
+- "inprocess": для однопроцессных установок (single_node.py). Брокер встроен
+  в процесс, публикация ставит сообщение в его очереди напрямую, а брокер
+  вызывает обработчики подписчиков как функции - без HTTP и JSON.
+"""
+import os
+from typing import Callable, List, Optional
+
+import requests
+
+from schemas import envelope as envelopes
+
+try:
+    from config import TRANSPORT
+except ImportError:
+    from message_broker.config import TRANSPORT
+
+WIRE_FORMAT = os.getenv("BROKER_WIRE_FORMAT", "json").lower()
+
+
+class HttpTransport:
+    """Публикация в отдельный процесс брокера по HTTP (keep-alive сессия)"""
+
+    name = "http"
+
+    def __init__(self, publish_url: str, source_service: str = "unknown", timeout: float = 5):
+        self.publish_url = publish_url
+        self.source_service = source_service
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.content_type = (
+            envelopes.CONTENT_TYPE_MSGPACK
+            if WIRE_FORMAT == "msgpack" and envelopes.binary_supported()
+            else envelopes.CONTENT_TYPE_JSON
+        )
+
+    def publish(self, event: dict) -> dict:
+        """
+        event - событие сервиса ({"event_type": ..., ...}); может содержать
+        datetime / Decimal - они сериализуются прямо при кодировании конверта
+        """
+        body = envelopes.encode(envelopes.from_event(event, self.source_service), self.content_type)
+        resp = self.session.post(
+            self.publish_url,
+            data=body,
+            headers={"Content-Type": self.content_type},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+
+class InProcessTransport:
+    """Встроенный брокер: те же publish/subscribe, но вызовами функций"""
+
+    name = "inprocess"
+
+    def __init__(self, source_service: str = "unknown"):
+        self.source_service = source_service
+
+    def publish(self, event: dict) -> dict:
+        # to_jsonable копирует данные: подписчики получают снимок события,
+        # а не ссылку на изменяемые объекты сервиса, и те же типы, что по HTTP
+        message = envelopes.from_event(envelopes.to_jsonable(event), self.source_service)
+        return _embedded_broker().publish_message(message)
+
+
+def get_transport(publish_url: str, source_service: str = "unknown"):
+    """Транспорт для публикации событий сервисом"""
+    if TRANSPORT == "inprocess":
+        return InProcessTransport(source_service)
+    return HttpTransport(publish_url, source_service)
+
+
+def register_consumer(
+    subscriber: str,
+    handler: Callable[[dict], bool],
+    event_types: Optional[List[str]] = None,
+) -> None:
+    """
+    Подписать обработчик сервиса на встроенный брокер.
+
+    handler получает сообщение брокера (тот же dict, что и /broker/consume
+    после envelope.decode_message) и возвращает True при успешной обработке.
+    В режиме "http" ничего не делает: там брокер вызывает /broker/consume сервиса.
+    """
+    if TRANSPORT != "inprocess":
+        return
+    _embedded_broker().register_local_consumer(
+        subscriber, lambda message: handler(envelopes.to_message(message)), event_types
+    )
+
+
+def _embedded_broker():
+    # Импорт по требованию: в режиме "http" брокер в процесс сервиса не загружается
+    from message_broker import main as broker
+    return broker
@@ -1,10 +1,19 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
 import uuid
-import os
 import requests
 
+from message_broker.client import start_membership
+from message_broker.dedup import LruSeenSet
+from message_broker.transport import register_consumer
+from schemas.envelope import decode_message
+
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
@@ -14,14 +23,34 @@ CORS(app)
 MESSAGE_BROKER_URL = os.getenv("MESSAGE_BROKER_URL", "http://localhost:5050/broker")
 BOOKING_SERVICE_URL = os.getenv("BOOKING_SERVICE_URL", "http://localhost:5001")
 PORT = int(os.getenv("PORT", 5004))
+# Публичный адрес реплики: если задан, реплика сама вступает в группу
+# "notification" брокера и шлёт heartbeat-ы (горизонтальное масштабирование)
+SERVICE_PUBLIC_URL = os.getenv("SERVICE_PUBLIC_URL")
+
+SUBSCRIBED_EVENTS = ["booking.created", "booking.confirmed", "booking.cancelled", "payment.succeeded"]
 
 TITLE = "📸 PhotoStudio Notifier"
 
 
 # In-memory база уведомлений
 notifications_db = []
+# Уведомления по брони (в порядке отправки): последние уведомления брони без обхода всей базы
+notifications_by_booking = {}
+
+# Уже обработанные message_id: передоставка не отправит второе SMS / письмо
+processed_messages = LruSeenSet(
+    window=float(os.getenv("DEDUP_WINDOW", 3600)),
+    max_entries=int(os.getenv("DEDUP_MAX_ENTRIES", 500_000)),
+)
 
-def send_email(to: str, subject: str, body: str):
+def record_notification(notification: dict, booking_id: str = None):
+    """Сохранить уведомление (и в индексе по брони, если оно о брони)"""
+    notification["booking_id"] = booking_id
+    notifications_db.append(notification)
+    if booking_id:
+        notifications_by_booking.setdefault(booking_id, []).append(notification)
+
+def send_email(to: str, subject: str, body: str, booking_id: str = None):
     """Отправка email (заглушка)"""
     notification = {
         "notification_id": str(uuid.uuid4()),
@@ -32,10 +61,10 @@ def send_email(to: str, subject: str, body: str):
         "status": "sent",
         "sent_at": datetime.now().isoformat()
     }
-    notifications_db.append(notification)
+    record_notification(notification, booking_id)
     print(f"📧 Notification Email to {to}: {subject}")
 
-def send_sms(to: str, message: str):
+def send_sms(to: str, message: str, booking_id: str = None):
     """Отправка SMS через Telegram Bot"""
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         # Fallback на заглушку
@@ -47,7 +76,7 @@ def send_sms(to: str, message: str):
             "status": "sent",
             "sent_at": datetime.now().isoformat()
         }
-        notifications_db.append(notification)
+        record_notification(notification, booking_id)
         print(f"[Telegram MOCK] SMS to={to}: {message}")
         return
 
@@ -71,7 +100,7 @@ def send_sms(to: str, message: str):
             "status": "sent",
             "sent_at": datetime.now().isoformat()
         }
-        notifications_db.append(notification)
+        record_notification(notification, booking_id)
         print(f"✅ Telegram SMS sent to {to}: {message}")
         
     except Exception as e:
@@ -85,7 +114,7 @@ def send_sms(to: str, message: str):
             "status": "failed",
             "sent_at": datetime.now().isoformat()
         }
-        notifications_db.append(notification)
+        record_notification(notification, booking_id)
 
 def get_booking_from_service(booking_id: str) -> dict:
     """Получить бронирование из Booking Service"""
@@ -111,11 +140,12 @@ def handle_booking_created(payload: dict):
     customer_phone = booking.get("customer_phone") if booking else None
     customer_email = booking.get("customer_email") if booking else None
     customer_name = booking.get("customer_name") if booking else None
+    booking_id = booking.get("booking_id")
     
     if customer_phone:
-        send_sms(customer_phone, f"📸 Бронь создана, {customer_name}! Оплатите в течение 1 часа.")
+        send_sms(customer_phone, f"📸 Бронь создана, {customer_name}! Оплатите в течение 1 часа.", booking_id)
     if customer_email:
-        send_email(customer_email, "📸 Бронь создана!", f"Привет, {customer_name}!")
+        send_email(customer_email, "📸 Бронь создана!", f"Привет, {customer_name}!", booking_id)
 
 def handle_booking_confirmed(payload: dict):
     booking_id = payload.get("booking_id")
@@ -128,7 +158,7 @@ def handle_booking_confirmed(payload: dict):
     customer_phone = booking.get("customer_phone") if booking else None
     
     if customer_phone:
-        send_sms(customer_phone, f"✅ Бронь {booking_id} подтверждена!")
+        send_sms(customer_phone, f"✅ Бронь {booking_id} подтверждена!", booking_id)
 
 def handle_payment_succeeded(payload: dict):
     booking_id = payload.get("booking_id")
@@ -141,12 +171,15 @@ def handle_payment_succeeded(payload: dict):
     customer_phone = booking.get("customer_phone") if booking else None
     
     if customer_phone:
-        send_sms(customer_phone, f"💳 Оплата {booking_id} прошла! До встречи! 📸")
+        send_sms(customer_phone, f"💳 Оплата {booking_id} прошла! До встречи! 📸", booking_id)
 
-@app.route("/broker/consume", methods=["POST"])
-def consume_message():
+def handle_broker_message(data: dict) -> str:
+    """Обработка сообщения брокера (по HTTP или встроенным транспортом)"""
+    message_id = data.get("message_id")
+    if message_id and not processed_messages.add(message_id):
+        print("[Notification] Дубль сообщения пропущен:", message_id)
+        return "duplicate"
     try:
-        data = request.json or {}
         event_type = data.get("event_type")
         payload = data.get("payload") or {}
         print("[Notification] Получено событие:", event_type)
@@ -159,21 +192,38 @@ def consume_message():
             handle_payment_succeeded(payload)
         # другие события по желанию
 
-        # 🔑 Всегда возвращаем 200, даже если смс/телега не отправились
-        return jsonify({"status": "processed"}), 200
+        return "processed"
     except Exception as e:
-        # Логируем, но тоже отвечаем 200, чтобы брокер не ретраил бесконечно
+        # Логируем, но считаем обработанным, чтобы брокер не ретраил бесконечно
         print("[Notification] Ошибка обработки события:", e)
+        return "processed_with_error"
+
+
+@app.route("/broker/consume", methods=["POST"])
+def consume_message():
+    # 🔑 Всегда возвращаем 200, даже если смс/телега не отправились
+    try:
+        message = decode_message(request.get_data(), request.content_type)
+    except ValueError as e:
+        print("[Notification] Не удалось разобрать сообщение:", e)
         return jsonify({"status": "processed_with_error"}), 200
+    status = handle_broker_message(message)
+    return jsonify({"status": status}), 200
+
+
+# Во встроенном режиме брокер вызывает обработчик напрямую
+register_consumer("notification", lambda message: bool(handle_broker_message(message)), SUBSCRIBED_EVENTS)
 
 
 @app.route("/api/notifications", methods=["GET"])
 def get_notifications():
-    """Получить список уведомлений"""
+    """Получить список уведомлений (последние limit; ?booking_id= - только по брони)"""
     limit = int(request.args.get("limit", 100))
+    booking_id = request.args.get("booking_id")
+    notifications = notifications_by_booking.get(booking_id, []) if booking_id else notifications_db
     return jsonify({
-        "notifications": notifications_db[-limit:],
-        "total": len(notifications_db)
+        "notifications": notifications[-limit:],
+        "total": len(notifications)
     }), 200
 
 @app.route("/api/notifications/send", methods=["POST"])
@@ -222,4 +272,11 @@ def test_telegram():
 if __name__ == "__main__":
     print(f"Starting Notification Service on port {PORT}")
     print(f"Telegram configured: {bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)}")
+    if SERVICE_PUBLIC_URL:
+        start_membership(
+            MESSAGE_BROKER_URL,
+            "notification",
+            f"{SERVICE_PUBLIC_URL}/broker/consume",
+            SUBSCRIBED_EVENTS,
+        )
     app.run(host="0.0.0.0", port=PORT, debug=True)
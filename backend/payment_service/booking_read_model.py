@@ -0,0 +1,86 @@
+"""
+Локальная read-модель бронирований для Payment Service
+
+Сумма и статус брони берутся из событий брокера (booking.created /
+booking.confirmed / booking.cancelled), поэтому создание платежа без amount
+не ходит в Booking Service. HTTP-запрос остаётся только для промаха
+(бронь создана до запуска сервиса или событие ещё не доставлено).
+
+Отмена "липкая": booking.created, доставленный после booking.cancelled,
+не возвращает бронь в оплачиваемое состояние.
+"""
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Optional
+
+CANCELLED = "cancelled"
+
+
+class BookingReadModel:
+    """booking_id -> {"amount": Decimal | None, "status": str}; самые старые вытесняются"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._bookings: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+
+    def __len__(self) -> int:
+        return len(self._bookings)
+
+    def get(self, booking_id: str) -> Optional[dict]:
+        with self._lock:
+            booking = self._bookings.get(booking_id)
+            if booking is None or booking["amount"] is None and booking["status"] != CANCELLED:
+                # Без суммы запись бесполезна для платежа (кроме отмены) - это промах
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(booking)
+
+    def put(self, booking_id: str, amount=None, status: Optional[str] = None) -> None:
+        """Обновить бронь; пустые поля не затирают известные значения"""
+        with self._lock:
+            booking = self._bookings.get(booking_id)
+            if booking is None:
+                booking = self._bookings[booking_id] = {"amount": None, "status": None}
+                while len(self._bookings) > self.max_entries:
+                    self._bookings.popitem(last=False)
+            if amount is not None:
+                booking["amount"] = Decimal(str(amount))
+            if status and booking["status"] != CANCELLED:
+                booking["status"] = status
+
+    def apply_event(self, event_type: str, payload: dict) -> bool:
+        """Применить событие брони. False - событие не относится к read-модели"""
+        booking = payload.get("booking") or {}
+        booking_id = payload.get("booking_id") or booking.get("booking_id")
+        if not booking_id:
+            return False
+
+        if event_type == "booking.cancelled":
+            self.put(booking_id, status=CANCELLED)
+        elif event_type in ("booking.created", "booking.confirmed"):
+            self.put(
+                booking_id,
+                amount=booking.get("total_amount", booking.get("price")),
+                status=booking.get("status"),
+            )
+        else:
+            return False
+        self.events += 1
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._bookings),
+            "max_entries": self.max_entries,
+            "events": self.events,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,126 @@
+"""
+Circuit breaker для вызовов платёжных шлюзов
+
+Состояния:
+- closed: запросы идут; по скользящему окну последних вызовов считаются
+  доля ошибок и доля медленных вызовов (дольше latency_threshold);
+- open: при превышении любой из долей шлюз не вызывается open_for секунд -
+  платёж сразу получает ошибку (или уходит в другой шлюз), а не ждёт таймаут;
+- half_open: после паузы пропускается пробный вызов; успех закрывает breaker,
+  ошибка снова открывает.
+
+Скользящее среднее задержки (EWMA) используется для выбора самого быстрого шлюза.
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Breaker шлюза открыт - вызов не выполняется"""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        error_rate_threshold: float = 0.5,
+        slow_rate_threshold: float = 0.5,
+        latency_threshold: float = 2.0,
+        window: int = 20,
+        min_calls: int = 5,
+        open_for: float = 30.0,
+        ewma_alpha: float = 0.2,
+    ):
+        self.name = name
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_rate_threshold = slow_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.min_calls = min_calls
+        self.open_for = open_for
+        self.ewma_alpha = ewma_alpha
+        # (успех, медленный) для последних window вызовов
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.latency_ewma = None
+        self.rejected = 0
+        self.opened_count = 0
+
+    def allow(self) -> bool:
+        """Можно ли вызывать шлюз сейчас (в half_open - только один пробный вызов)"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_for:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def is_available(self) -> bool:
+        """Без побочных эффектов: закрыт или уже можно пробовать"""
+        return self.state != OPEN or time.monotonic() - self.opened_at >= self.open_for
+
+    def record(self, success: bool, latency: float) -> None:
+        with self._lock:
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += self.ewma_alpha * (latency - self.latency_ewma)
+
+            slow = latency > self.latency_threshold
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success and not slow:
+                    self.state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._open()
+                return
+
+            self._calls.append((success, slow))
+            if len(self._calls) < self.min_calls:
+                return
+            error_rate, slow_rate = self._rates()
+            if error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold:
+                self._open()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            error_rate, slow_rate = self._rates()
+            return {
+                "state": HALF_OPEN if self.state == OPEN and self.is_available() else self.state,
+                "calls_in_window": len(self._calls),
+                "error_rate": round(error_rate, 3),
+                "slow_rate": round(slow_rate, 3),
+                "latency_ewma_ms": None if self.latency_ewma is None else round(self.latency_ewma * 1000, 1),
+                "rejected": self.rejected,
+                "opened": self.opened_count,
+            }
+
+    def _rates(self):
+        if not self._calls:
+            return 0.0, 0.0
+        total = len(self._calls)
+        errors = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return errors / total, slow / total
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opened_count += 1
+        self._calls.clear()
+        print(f"⚠️ Circuit breaker шлюза {self.name} открыт на {self.open_for:.0f} с")
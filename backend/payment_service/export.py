@@ -0,0 +1,170 @@
+"""
+Потоковая выгрузка платежей и возвратов для бухгалтерии
+
+Строки идут по шлюзам, внутри шлюза - по времени: платежи и возвраты
+сливаются (heapq.merge) из индексов по времени PaymentStore и RefundLedger.
+После строк шлюза - строка итогов по нему, в конце - общий итог. Итоги
+считаются на лету, по ходу выгрузки; в них, как в SettlementReport, входят
+только оплаченные платежи и выполненные возвраты.
+
+Ни строки, ни выгрузка целиком не накапливаются: ответ отдаётся частями
+по ~CHUNK_SIZE байт (chunked transfer encoding), память не зависит от
+числа строк.
+"""
+import csv
+import heapq
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Iterator, Optional, Sequence
+
+from schemas.payment import PaymentStatus
+
+try:
+    from refunds import SUCCEEDED as REFUND_SUCCEEDED
+except ImportError:
+    from payment_service.refunds import SUCCEEDED as REFUND_SUCCEEDED
+
+CHUNK_SIZE = 64 * 1024
+
+PAYMENT = "payment"
+REFUND = "refund"
+TOTAL = "total"
+KINDS = (PAYMENT, REFUND)
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+CSV_COLUMNS = (
+    "type", "timestamp", "gateway", "payment_id", "refund_id", "booking_id", "status", "amount",
+    "external_id", "payments", "gross", "refunds", "refunded", "net",
+)
+
+# Платёж оплачен - в том числе если потом возвращён
+PAID_STATUSES = {
+    status.value for status in (PaymentStatus.SUCCEEDED, PaymentStatus.PARTIALLY_REFUNDED, PaymentStatus.REFUNDED)
+}
+
+
+def export_rows(
+    store,
+    ledger,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    gateways: Optional[Sequence[str]] = None,
+    statuses: Optional[Sequence[str]] = None,
+    kinds: Sequence[str] = KINDS,
+) -> Iterator[dict]:
+    """Строки выгрузки за [start, end) (None - без границы): платежи и возвраты по шлюзам, итоги по шлюзам и общий"""
+    if gateways is None:
+        gateways = sorted(set(store.gateways()) | set(ledger.gateways()))
+    statuses = set(statuses) if statuses else None
+    grand = _new_totals()
+    for gateway in gateways:
+        streams = []
+        if PAYMENT in kinds:
+            streams.append(_payment_rows(store.iter_created_between(gateway, start, end), gateway))
+        if REFUND in kinds:
+            streams.append(_refund_rows(ledger.iter_between(gateway, start, end), gateway))
+        totals = _new_totals()
+        for row in heapq.merge(*streams, key=_timestamp):
+            if statuses is not None and row["status"] not in statuses:
+                continue
+            _count(totals, row)
+            yield row
+        for key in grand:
+            grand[key] += totals[key]
+        yield _totals_row(gateway, totals)
+    yield _totals_row(None, grand)
+
+
+def stream(rows: Iterable[dict], fmt: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Строки выгрузки в формате fmt ("ndjson" / "csv") частями не меньше chunk_size"""
+    buffer = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(CSV_COLUMNS)
+        write = lambda row: writer.writerow([_csv_value(row.get(column)) for column in CSV_COLUMNS])  # noqa: E731
+    else:
+        write = lambda row: buffer.write(  # noqa: E731
+            json.dumps(row, default=_json_default, ensure_ascii=False, separators=(",", ":")) + "\n"
+        )
+    for row in rows:
+        write(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _payment_rows(payments, gateway: str) -> Iterator[dict]:
+    for payment in payments:
+        yield {
+            "type": PAYMENT,
+            "timestamp": payment.created_at,
+            "gateway": gateway,
+            "payment_id": payment.payment_id,
+            "refund_id": None,
+            "booking_id": payment.booking_id,
+            "status": payment.status.value,
+            "amount": payment.amount,
+            "external_id": payment.external_payment_id,
+        }
+
+
+def _refund_rows(refunds, gateway: str) -> Iterator[dict]:
+    for refund in refunds:
+        yield {
+            "type": REFUND,
+            "timestamp": refund["timestamp"],
+            "gateway": gateway,
+            "payment_id": refund["payment_id"],
+            "refund_id": refund["refund_id"],
+            "booking_id": None,
+            "status": refund["status"],
+            "amount": refund["amount"],
+            "external_id": refund["external_refund_id"],
+        }
+
+
+def _timestamp(row: dict) -> datetime:
+    return row["timestamp"]
+
+
+def _new_totals() -> dict:
+    return {"payments": 0, "gross": Decimal("0"), "refunds": 0, "refunded": Decimal("0")}
+
+
+def _count(totals: dict, row: dict) -> None:
+    if row["type"] == PAYMENT:
+        if row["status"] in PAID_STATUSES:
+            totals["payments"] += 1
+            totals["gross"] += row["amount"]
+    elif row["status"] == REFUND_SUCCEEDED:
+        totals["refunds"] += 1
+        totals["refunded"] += row["amount"]
+
+
+def _totals_row(gateway: Optional[str], totals: dict) -> dict:
+    return {"type": TOTAL, "gateway": gateway, **totals, "net": totals["gross"] - totals["refunded"]}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
@@ -2,13 +2,41 @@
 Реализация интеграций с платежными шлюзами
 Поддержка тестовых (sandbox) и продакшн режимов
 """
+import base64
+import hashlib
 import os
+import threading
+import time
 import requests
 import uuid
 from decimal import Decimal
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from enum import Enum
 
+from requests.adapters import HTTPAdapter
+
+try:
+    from circuit_breaker import CircuitBreaker, CircuitOpenError
+except ImportError:
+    from payment_service.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# Пул соединений и ограничение одновременных запросов на один клиент шлюза
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", 10))
+GATEWAY_MAX_CONCURRENCY = int(os.getenv("GATEWAY_MAX_CONCURRENCY", 10))
+# Сколько ждать свободного слота, прежде чем отказать (секунды)
+GATEWAY_ACQUIRE_TIMEOUT = float(os.getenv("GATEWAY_ACQUIRE_TIMEOUT", 5))
+GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", 10))
+
+# Circuit breaker: доля ошибок / медленных вызовов (дольше порога) в окне последних вызовов
+BREAKER_ERROR_RATE = float(os.getenv("GATEWAY_BREAKER_ERROR_RATE", 0.5))
+BREAKER_SLOW_RATE = float(os.getenv("GATEWAY_BREAKER_SLOW_RATE", 0.5))
+BREAKER_LATENCY_THRESHOLD = float(os.getenv("GATEWAY_BREAKER_LATENCY", 2.0))
+BREAKER_WINDOW = int(os.getenv("GATEWAY_BREAKER_WINDOW", 20))
+BREAKER_OPEN_FOR = float(os.getenv("GATEWAY_BREAKER_OPEN_FOR", 30))
+
+# В TEST-режиме при ошибке sandbox-а вернуть заглушку вместо ошибки (явно, по желанию)
+TEST_FALLBACK = os.getenv("PAYMENT_TEST_FALLBACK", "0").lower() in ("1", "true", "yes")
+
 
 class Environment(str, Enum):
     TEST = "test"
@@ -16,11 +44,110 @@ class Environment(str, Enum):
     MOCK = "mock"  # Заглушка для локального тестирования
 
 
+class GatewayBusyError(Exception):
+    """Все слоты одновременных запросов к шлюзу заняты"""
+
+
+# Ошибки, после которых платёж можно попробовать провести через другой шлюз
+GATEWAY_UNAVAILABLE_ERRORS = (
+    CircuitOpenError,
+    GatewayBusyError,
+    requests.ConnectionError,
+    requests.Timeout,
+)
+
+
+def is_gateway_failure(error: Exception) -> bool:
+    """Ошибка говорит о неисправности шлюза (сеть, таймаут, 5xx), а не о нашем запросе"""
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+
 class PaymentGateway:
-    """Базовый класс для платежных шлюзов"""
+    """
+    Базовый класс для платежных шлюзов.
+
+    Экземпляр долгоживущий (см. GatewayRegistry): keep-alive сессия с пулом
+    соединений, семафор, ограничивающий число одновременных запросов к шлюзу,
+    и circuit breaker, который перестаёт вызывать неисправный шлюз.
+    """
     
-    def __init__(self, environment: Environment = Environment.MOCK):
+    def __init__(
+        self,
+        environment: Environment = Environment.MOCK,
+        pool_size: int = GATEWAY_POOL_SIZE,
+        max_concurrency: int = GATEWAY_MAX_CONCURRENCY,
+    ):
         self.environment = environment
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.breaker = CircuitBreaker(
+            type(self).__name__,
+            error_rate_threshold=BREAKER_ERROR_RATE,
+            slow_rate_threshold=BREAKER_SLOW_RATE,
+            latency_threshold=BREAKER_LATENCY_THRESHOLD,
+            window=BREAKER_WINDOW,
+            open_for=BREAKER_OPEN_FOR,
+        )
+    
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Запрос к API шлюза через пул соединений с ограничением параллельности"""
+        if not self._slots.acquire(timeout=GATEWAY_ACQUIRE_TIMEOUT):
+            raise GatewayBusyError(f"{type(self).__name__}: превышен лимит одновременных запросов")
+        if not self.breaker.allow():
+            self._slots.release()
+            raise CircuitOpenError(f"{type(self).__name__}: шлюз временно недоступен (circuit breaker)")
+        with self._stats_lock:
+            self.in_flight += 1
+            self.requests_total += 1
+        started = time.monotonic()
+        failure = None
+        try:
+            kwargs.setdefault("timeout", GATEWAY_TIMEOUT)
+            response = self.session.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except Exception as e:
+            failure = e
+            with self._stats_lock:
+                self.errors_total += 1
+            raise
+        finally:
+            self.breaker.record(
+                failure is None or not is_gateway_failure(failure), time.monotonic() - started
+            )
+            with self._stats_lock:
+                self.in_flight -= 1
+            self._slots.release()
+    
+    def is_available(self) -> bool:
+        return self.breaker.is_available()
+    
+    def latency(self) -> float:
+        """Наблюдаемая задержка (EWMA, секунды); 0 - вызовов ещё не было"""
+        return self.breaker.latency_ewma or 0.0
+    
+    def stats(self) -> dict:
+        return {
+            "environment": self.environment.value,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests": self.requests_total,
+            "errors": self.errors_total,
+            "breaker": self.breaker.to_dict(),
+        }
+    
+    def close(self) -> None:
+        self.session.close()
     
     def create_payment(self, amount: Decimal, booking_id: str, return_url: Optional[str] = None) -> Dict:
         """Создание платежа"""
@@ -33,6 +160,31 @@ class PaymentGateway:
     def process_webhook(self, payload: dict) -> Dict:
         """Обработка webhook"""
         raise NotImplementedError
+    
+    def get_payment_status(self, external_payment_id: str) -> Dict:
+        """
+        Текущий статус платежа по запросу к API шлюза (сверка платежей без webhook-а).
+        Формат ответа - как у process_webhook, event_id - None
+        """
+        raise NotImplementedError
+    
+    def refund_payment(self, external_payment_id: str, amount: Decimal, refund_id: str) -> Dict:
+        """
+        Возврат (в том числе частичный) amount по платежу.
+        refund_id - ключ идемпотентности: повтор запроса не вернёт деньги дважды.
+        Возвращает {"external_refund_id": ..., "status": "succeeded" | "pending"}
+        """
+        raise NotImplementedError
+    
+    @staticmethod
+    def _pending_status(external_payment_id: str) -> Dict:
+        """Статус платежа-заглушки: шлюза нет, платёж остаётся в ожидании"""
+        return {"payment_id": external_payment_id, "status": "pending", "event_id": None, "amount": None, "metadata": {}}
+    
+    @staticmethod
+    def _stub_refund(prefix: str) -> Dict:
+        """Возврат-заглушка (MOCK или шлюз без адреса API)"""
+        return {"external_refund_id": f"{prefix}-refund-{uuid.uuid4()}", "status": "succeeded"}
 
 
 class YooKassaGateway(PaymentGateway):
@@ -46,16 +198,23 @@ class YooKassaGateway(PaymentGateway):
     PROD_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
     
     TEST_API_URL = "https://api.yookassa.ru/v3/payments"  # В тестовом режиме используется тот же URL
+    # Переопределение адреса API (например, локальный mock_gateway_server.py)
+    API_URL = os.getenv("YOOKASSA_API_URL") or TEST_API_URL
     
-    def __init__(self, environment: Environment = Environment.TEST):
-        super().__init__(environment)
+    def __init__(self, environment: Environment = Environment.TEST, **pool_options):
+        super().__init__(environment, **pool_options)
         if environment == Environment.PRODUCTION:
             self.shop_id = self.PROD_SHOP_ID
             self.secret_key = self.PROD_SECRET_KEY
         else:
             self.shop_id = self.TEST_SHOP_ID
             self.secret_key = self.TEST_SECRET_KEY
-        self.base_url = self.TEST_API_URL
+        self.base_url = self.API_URL
+        # Заголовки авторизации считаются один раз и живут в сессии
+        self.session.headers.update({
+            "Authorization": f"Basic {self._get_auth_token()}",
+            "Content-Type": "application/json",
+        })
     
     def create_payment(self, amount: Decimal, booking_id: str, return_url: Optional[str] = None) -> Dict:
         """Создание платежа в ЮKassa"""
@@ -68,12 +227,8 @@ class YooKassaGateway(PaymentGateway):
                 "status": "pending"
             }
         
-        # Реальный вызов API ЮKassa
-        headers = {
-            "Authorization": f"Basic {self._get_auth_token()}",
-            "Content-Type": "application/json",
-            "Idempotence-Key": str(uuid.uuid4())
-        }
+        # Реальный вызов API ЮKassa (Authorization / Content-Type - в заголовках сессии)
+        headers = {"Idempotence-Key": str(uuid.uuid4())}
         
         payload = {
             "amount": {
@@ -91,14 +246,7 @@ class YooKassaGateway(PaymentGateway):
         }
         
         try:
-            response = requests.post(
-                self.base_url,
-                json=payload,
-                headers=headers,
-                auth=(self.shop_id, self.secret_key),
-                timeout=10
-            )
-            response.raise_for_status()
+            response = self._request("POST", self.base_url, json=payload, headers=headers)
             data = response.json()
             
             return {
@@ -107,19 +255,20 @@ class YooKassaGateway(PaymentGateway):
                 "status": data["status"]
             }
         except Exception as e:
-            # В случае ошибки при тестировании возвращаем заглушку
-            if self.environment == Environment.TEST:
+            # Заглушка при ошибке sandbox-а - только если явно включена
+            if self.environment == Environment.TEST and TEST_FALLBACK:
+                print(f"⚠️ ЮKassa sandbox недоступна ({e}), возвращаем заглушку")
                 payment_id = str(uuid.uuid4())
                 return {
                     "external_payment_id": f"yookassa-test-{payment_id}",
                     "payment_url": f"https://yoomoney.ru/checkout/payments/v2/contract?orderId={payment_id}",
-                    "status": "pending"
+                    "status": "pending",
+                    "fallback": True
                 }
             raise
     
     def _get_auth_token(self) -> str:
         """Получение токена авторизации"""
-        import base64
         auth_string = f"{self.shop_id}:{self.secret_key}"
         return base64.b64encode(auth_string.encode()).decode()
     
@@ -138,24 +287,71 @@ class YooKassaGateway(PaymentGateway):
         return {
             "payment_id": payment_data.get("id"),
             "status": payment_data.get("status"),  # pending, succeeded, canceled
+            "event_id": event_type,  # payment.waiting_for_capture, payment.succeeded, ...
             "amount": float(payment_data.get("amount", {}).get("value", 0)),
             "metadata": payment_data.get("metadata", {})
         }
+    
+    def get_payment_status(self, external_payment_id: str) -> Dict:
+        """GET /v3/payments/{id} - объект платежа того же вида, что в уведомлении"""
+        # "yookassa-..." - заглушка (MOCK или PAYMENT_TEST_FALLBACK), в API её нет
+        if self.environment == Environment.MOCK or external_payment_id.startswith("yookassa-"):
+            return self._pending_status(external_payment_id)
+        payment_data = self._request("GET", f"{self.base_url}/{external_payment_id}").json()
+        return {**self.process_webhook({"object": payment_data}), "event_id": None}
+    
+    def refund_payment(self, external_payment_id: str, amount: Decimal, refund_id: str) -> Dict:
+        """POST /v3/refunds"""
+        if self.environment == Environment.MOCK or external_payment_id.startswith("yookassa-"):
+            return self._stub_refund("yookassa")
+        data = self._request(
+            "POST",
+            self.base_url.rsplit("/payments", 1)[0] + "/refunds",
+            json={"payment_id": external_payment_id, "amount": {"value": str(amount), "currency": "RUB"}},
+            headers={"Idempotence-Key": refund_id},
+        ).json()
+        return {"external_refund_id": data["id"], "status": data.get("status", "pending")}
 
 
 class SberPayGateway(PaymentGateway):
     """Интеграция с СберPay"""
     
-    def __init__(self, environment: Environment = Environment.TEST):
-        super().__init__(environment)
-        # В реальной реализации здесь будут настроены учетные данные
+    # Адрес register.do; без него (и в MOCK-режиме) платёж создаётся заглушкой
+    API_URL = os.getenv("SBERPAY_API_URL")
+    USERNAME = os.getenv("SBERPAY_TEST_USERNAME", "test-api")
+    PASSWORD = os.getenv("SBERPAY_TEST_PASSWORD", "test")
+    
+    # Статусы заказа Сбера: 2 - оплачен, 3 - авторизация отменена, 6 - отклонён
+    STATUS_MAPPING = {2: "succeeded", 3: "canceled", 6: "failed"}
+    
+    def __init__(self, environment: Environment = Environment.TEST, **pool_options):
+        super().__init__(environment, **pool_options)
+        self.base_url = self.API_URL
     
     def create_payment(self, amount: Decimal, booking_id: str, return_url: Optional[str] = None) -> Dict:
         """Создание платежа в СберPay"""
-        payment_id = str(uuid.uuid4())
+        if self.environment == Environment.MOCK or not self.base_url:
+            payment_id = str(uuid.uuid4())
+            return {
+                "external_payment_id": f"sberpay-{payment_id}",
+                "payment_url": f"https://securepayments.sberbank.ru/payment?orderId={payment_id}",
+                "status": "pending"
+            }
+        
+        # register.do принимает параметры формы, сумма - в копейках
+        response = self._request("POST", self.base_url, data={
+            "userName": self.USERNAME,
+            "password": self.PASSWORD,
+            "orderNumber": booking_id,
+            "amount": int(amount * 100),
+            "returnUrl": return_url or "https://example.com/return",
+        })
+        data = response.json()
+        if data.get("errorCode") not in (None, "0", 0):
+            raise ValueError(f"СберPay: {data.get('errorMessage')}")
         return {
-            "external_payment_id": f"sberpay-{payment_id}",
-            "payment_url": f"https://securepayments.sberbank.ru/payment?orderId={payment_id}",
+            "external_payment_id": data["orderId"],
+            "payment_url": data["formUrl"],
             "status": "pending"
         }
     
@@ -165,54 +361,199 @@ class SberPayGateway(PaymentGateway):
     def process_webhook(self, payload: dict) -> Dict:
         return {
             "payment_id": payload.get("orderId"),
-            "status": "succeeded" if payload.get("status") == 2 else "pending",
+            "status": self.STATUS_MAPPING.get(payload.get("status"), "pending"),
+            "event_id": payload.get("operation"),  # deposited, approved, reversed, ...
             "amount": float(payload.get("amount", 0)) / 100,  # Сбер передает в копейках
             "metadata": {}
         }
+    
+    def get_payment_status(self, external_payment_id: str) -> Dict:
+        """getOrderStatusExtended.do рядом с register.do; orderStatus - тот же код, что в уведомлении"""
+        if self.environment == Environment.MOCK or not self.base_url:
+            return self._pending_status(external_payment_id)
+        response = self._request("POST", self.base_url.rsplit("/", 1)[0] + "/getOrderStatusExtended.do", data={
+            "userName": self.USERNAME,
+            "password": self.PASSWORD,
+            "orderId": external_payment_id,
+        })
+        data = response.json()
+        if data.get("errorCode") not in (None, "0", 0):
+            raise ValueError(f"СберPay: {data.get('errorMessage')}")
+        return {
+            **self.process_webhook({"orderId": external_payment_id, "status": data.get("orderStatus"), "amount": data.get("amount", 0)}),
+            "event_id": None,
+        }
+    
+    def refund_payment(self, external_payment_id: str, amount: Decimal, refund_id: str) -> Dict:
+        """refund.do рядом с register.do; сумма в копейках, отдельного id возврата Сбер не даёт"""
+        if self.environment == Environment.MOCK or not self.base_url:
+            return self._stub_refund("sberpay")
+        data = self._request("POST", self.base_url.rsplit("/", 1)[0] + "/refund.do", data={
+            "userName": self.USERNAME,
+            "password": self.PASSWORD,
+            "orderId": external_payment_id,
+            "amount": int(amount * 100),
+        }).json()
+        if data.get("errorCode") not in (None, "0", 0):
+            raise ValueError(f"СберPay: {data.get('errorMessage')}")
+        return {"external_refund_id": f"{external_payment_id}:{refund_id}", "status": "succeeded"}
 
 
 class TinkoffGateway(PaymentGateway):
     """Интеграция с Тинькофф Касса"""
     
-    def __init__(self, environment: Environment = Environment.TEST):
-        super().__init__(environment)
+    # Адрес метода Init; без него (и в MOCK-режиме) платёж создаётся заглушкой
+    API_URL = os.getenv("TINKOFF_API_URL")
+    TERMINAL_KEY = os.getenv("TINKOFF_TEST_TERMINAL_KEY", "TinkoffBankTest")
+    PASSWORD = os.getenv("TINKOFF_TEST_PASSWORD", "TinkoffBankTest")
+    
+    STATUS_MAPPING = {"CONFIRMED": "succeeded", "REJECTED": "failed", "CANCELED": "canceled"}
+    
+    def __init__(self, environment: Environment = Environment.TEST, **pool_options):
+        super().__init__(environment, **pool_options)
+        self.base_url = self.API_URL
     
     def create_payment(self, amount: Decimal, booking_id: str, return_url: Optional[str] = None) -> Dict:
         """Создание платежа в Тинькофф"""
-        payment_id = str(uuid.uuid4())
+        if self.environment == Environment.MOCK or not self.base_url:
+            payment_id = str(uuid.uuid4())
+            return {
+                "external_payment_id": f"tinkoff-{payment_id}",
+                "payment_url": f"https://securepay.tinkoff.ru/payments?orderId={payment_id}",
+                "status": "pending"
+            }
+        
+        params = {
+            "TerminalKey": self.TERMINAL_KEY,
+            "Amount": int(amount * 100),
+            "OrderId": booking_id,
+            "Description": f"Бронирование фотостудии #{booking_id}",
+        }
+        if return_url:
+            params["SuccessURL"] = return_url
+        params["Token"] = self._token(params)
+        
+        data = self._request("POST", self.base_url, json=params).json()
+        if not data.get("Success"):
+            raise ValueError(f"Тинькофф: {data.get('Message') or data.get('ErrorCode')}")
         return {
-            "external_payment_id": f"tinkoff-{payment_id}",
-            "payment_url": f"https://securepay.tinkoff.ru/payments?orderId={payment_id}",
+            "external_payment_id": str(data["PaymentId"]),
+            "payment_url": data["PaymentURL"],
             "status": "pending"
         }
     
+    def _token(self, params: dict) -> str:
+        """Подпись запроса: SHA-256 от значений параметров с паролем, по алфавиту ключей"""
+        values = {**params, "Password": self.PASSWORD}
+        return hashlib.sha256("".join(str(values[k]) for k in sorted(values)).encode()).hexdigest()
+    
     def verify_webhook(self, payload: dict, signature: str) -> bool:
         return True
     
     def process_webhook(self, payload: dict) -> Dict:
+        payment_id = payload.get("PaymentId")
         return {
-            "payment_id": payload.get("PaymentId"),
-            "status": "succeeded" if payload.get("Status") == "CONFIRMED" else "pending",
+            # В уведомлении PaymentId - число, при создании - строка
+            "payment_id": str(payment_id) if payment_id is not None else None,
+            "status": self.STATUS_MAPPING.get(payload.get("Status"), "pending"),
+            "event_id": payload.get("Status"),  # AUTHORIZED, CONFIRMED, REJECTED, ...
             "amount": float(payload.get("Amount", 0)) / 100,
             "metadata": {}
         }
+    
+    def get_payment_status(self, external_payment_id: str) -> Dict:
+        """Метод GetState рядом с Init"""
+        if self.environment == Environment.MOCK or not self.base_url:
+            return self._pending_status(external_payment_id)
+        params = {"TerminalKey": self.TERMINAL_KEY, "PaymentId": external_payment_id}
+        params["Token"] = self._token(params)
+        data = self._request("POST", self.base_url.rsplit("/", 1)[0] + "/GetState", json=params).json()
+        if not data.get("Success"):
+            raise ValueError(f"Тинькофф: {data.get('Message') or data.get('ErrorCode')}")
+        return {**self.process_webhook(data), "event_id": None}
+    
+    def refund_payment(self, external_payment_id: str, amount: Decimal, refund_id: str) -> Dict:
+        """Метод Cancel с суммой - частичный или полный возврат"""
+        if self.environment == Environment.MOCK or not self.base_url:
+            return self._stub_refund("tinkoff")
+        params = {"TerminalKey": self.TERMINAL_KEY, "PaymentId": external_payment_id, "Amount": int(amount * 100)}
+        params["Token"] = self._token(params)
+        data = self._request("POST", self.base_url.rsplit("/", 1)[0] + "/Cancel", json=params).json()
+        if not data.get("Success"):
+            raise ValueError(f"Тинькофф: {data.get('Message') or data.get('ErrorCode')}")
+        return {"external_refund_id": f"{external_payment_id}:{refund_id}", "status": "succeeded"}
+
+
+GATEWAY_CLASSES = {
+    "yookassa": YooKassaGateway,
+    "sberpay": SberPayGateway,
+    "tinkoff": TinkoffGateway,
+}
+
+
+class GatewayRegistry:
+    """
+    Кэш клиентов шлюзов: один экземпляр на (шлюз, окружение).
+    Клиент держит пул keep-alive соединений и заранее посчитанные заголовки,
+    поэтому создавать его на каждый платёж или webhook не нужно.
+    """
+
+    def __init__(self, **pool_options):
+        self.pool_options = pool_options
+        self._clients: Dict[Tuple[str, Environment], PaymentGateway] = {}
+        self._lock = threading.Lock()
+
+    def get(self, gateway_name: str, environment: Environment) -> PaymentGateway:
+        key = (gateway_name.lower(), environment)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        gateway_class = GATEWAY_CLASSES.get(key[0])
+        if not gateway_class:
+            raise ValueError(f"Неизвестный платежный шлюз: {gateway_name}")
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = gateway_class(environment, **self.pool_options)
+                self._clients[key] = client
+            return client
+
+    def route(self, candidates, environment: Environment):
+        """
+        Шлюзы-кандидаты в порядке выбора: сначала доступные (breaker не открыт)
+        по возрастанию наблюдаемой задержки, затем недоступные.
+        """
+        clients = [(name, self.get(name, environment)) for name in candidates]
+        # sorted устойчив: при равной задержке сохраняется порядок кандидатов
+        return [
+            name
+            for name, client in sorted(clients, key=lambda item: (not item[1].is_available(), item[1].latency()))
+        ]
+
+    def stats(self) -> dict:
+        return {f"{name}:{env.value}": client.stats() for (name, env), client in list(self._clients.items())}
+
+    def open_breakers(self) -> list:
+        return [
+            f"{name}:{env.value}"
+            for (name, env), client in list(self._clients.items())
+            if not client.is_available()
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+registry = GatewayRegistry()
 
 
 def get_gateway(gateway_name: str, environment: Environment = None) -> PaymentGateway:
-    """Фабрика для получения экземпляра платежного шлюза"""
+    """Клиент платежного шлюза из общего реестра (кэшируется на (шлюз, окружение))"""
     if environment is None:
         env_str = os.getenv("PAYMENT_ENV", "mock").lower()
         environment = Environment(env_str)
     
-    gateways = {
-        "yookassa": YooKassaGateway,
-        "sberpay": SberPayGateway,
-        "tinkoff": TinkoffGateway
-    }
-    
-    gateway_class = gateways.get(gateway_name.lower())
-    if not gateway_class:
-        raise ValueError(f"Неизвестный платежный шлюз: {gateway_name}")
-    
-    return gateway_class(environment)
-
+    return registry.get(gateway_name, environment)
@@ -13,13 +13,13 @@ import os
 # Добавляем корень проекта в sys.path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 import uuid
 import requests
-import json
+from typing import Optional
 
 from schemas.payment import (
     PaymentRequest,
@@ -34,10 +34,37 @@ from schemas.payment import (
     RefundResponse,
 )
 
+from message_broker.client import start_membership
+from message_broker.transport import get_transport, register_consumer
+from message_broker.dedup import LruSeenSet
+from schemas.envelope import decode_message
+
 try:
-    from gateways import get_gateway, Environment
+    from gateways import (
+        get_gateway, registry as gateway_registry, Environment,
+        GATEWAY_UNAVAILABLE_ERRORS, is_gateway_failure,
+    )
+    from booking_read_model import BookingReadModel, CANCELLED
+    import export as payment_export
+    from reconciler import PaymentReconciler
+    from record import PaymentRecord
+    from refunds import RefundLedger, OverRefundError, derive_status
+    from settlement import SettlementReport
+    from store import PaymentStore
+    from webhook_queue import WebhookQueue, WebhookNotProcessed
 except ImportError:
-    from payment_service.gateways import get_gateway, Environment
+    from payment_service.gateways import (
+        get_gateway, registry as gateway_registry, Environment,
+        GATEWAY_UNAVAILABLE_ERRORS, is_gateway_failure,
+    )
+    from payment_service.booking_read_model import BookingReadModel, CANCELLED
+    from payment_service import export as payment_export
+    from payment_service.reconciler import PaymentReconciler
+    from payment_service.record import PaymentRecord
+    from payment_service.refunds import RefundLedger, OverRefundError, derive_status
+    from payment_service.settlement import SettlementReport
+    from payment_service.store import PaymentStore
+    from payment_service.webhook_queue import WebhookQueue, WebhookNotProcessed
 
 app = Flask(__name__)
 CORS(app)
@@ -48,41 +75,121 @@ MESSAGE_BROKER_URL = os.getenv(
     "MESSAGE_BROKER_URL", "http://localhost:5050/broker/publish"
 )
 PORT = int(os.getenv("PORT", 5002))
+# Публичный адрес реплики: если задан, реплика сама подписывается в брокере
+# на события броней (см. notification_service)
+SERVICE_PUBLIC_URL = os.getenv("SERVICE_PUBLIC_URL")
+
+# События броней для локальной read-модели (сумма и статус без запроса в Booking Service)
+SUBSCRIBED_EVENTS = ["booking.created", "booking.confirmed", "booking.cancelled"]
+BOOKING_READ_MODEL_MAX_ENTRIES = int(os.getenv("BOOKING_READ_MODEL_MAX_ENTRIES", 100_000))
+
+# Очередь приёма webhook-ов: число воркеров и каталог журнала. Шлюз получает 200 после
+# записи webhook-а в журнал (fsync, WEBHOOK_QUEUE_FSYNC=0 - только flush); WEBHOOK_QUEUE_DIR=""
+# - без журнала: ответ после обработки, не обработан за WEBHOOK_SYNC_TIMEOUT с - 503
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_DIR = os.getenv(
+    "WEBHOOK_QUEUE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+) or None
+WEBHOOK_QUEUE_FSYNC = os.getenv("WEBHOOK_QUEUE_FSYNC", "1") != "0"
+WEBHOOK_SYNC_TIMEOUT = float(os.getenv("WEBHOOK_SYNC_TIMEOUT", 10))
+
+# Защита от повторных уведомлений шлюзов: сколько помнить обработанный webhook.
+# ЮKassa повторяет уведомление в течение суток
+WEBHOOK_IDEMPOTENCY_TTL = float(os.getenv("WEBHOOK_IDEMPOTENCY_TTL", 24 * 3600))
+WEBHOOK_IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("WEBHOOK_IDEMPOTENCY_MAX_ENTRIES", 1_000_000))
+
+# Сверка зависших платежей (webhook потерян): раз в интервал (0 - выключена)
+# статус pending-платежей старше MIN_AGE запрашивается в шлюзе пачками
+RECONCILE_INTERVAL = float(os.getenv("PAYMENT_RECONCILE_INTERVAL", 60))
+RECONCILE_MIN_AGE = float(os.getenv("PAYMENT_RECONCILE_MIN_AGE", 900))
+RECONCILE_BATCH_SIZE = int(os.getenv("PAYMENT_RECONCILE_BATCH_SIZE", 100))
+# Меньше лимита одновременных запросов к шлюзу: слоты остаются созданию платежей
+RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", 4))
+# Оставшийся в pending проверяется снова через интервал, с удвоением до MAX_RETRY_DELAY;
+# после MAX_ATTEMPTS проверок или старше MAX_AGE (с) сверка платежа прекращается
+RECONCILE_MAX_RETRY_DELAY = float(os.getenv("PAYMENT_RECONCILE_MAX_RETRY_DELAY", 3600))
+RECONCILE_MAX_ATTEMPTS = int(os.getenv("PAYMENT_RECONCILE_MAX_ATTEMPTS", 30))
+RECONCILE_MAX_AGE = float(os.getenv("PAYMENT_RECONCILE_MAX_AGE", 3 * 24 * 3600))
+
+# Сколько платежей можно запросить одним POST /api/payments/batch-get
+PAYMENT_BATCH_GET_MAX_IDS = int(os.getenv("PAYMENT_BATCH_GET_MAX_IDS", 500))
 
 # Режим работы платёжных шлюзов
 PAYMENT_ENV = Environment(os.getenv("PAYMENT_ENV", "mock").lower())
 
-# In-memory хранилище
-payments_db: dict = {}
+# Маршрутизация: если клиент не указал payment_method, платёж уходит в доступный
+# шлюз с наименьшей наблюдаемой задержкой (и в следующий - при его отказе)
+DEFAULT_GATEWAY = os.getenv("PAYMENT_DEFAULT_GATEWAY", PaymentMethod.YOOKASSA.value)
+GATEWAY_ROUTING = os.getenv("PAYMENT_GATEWAY_ROUTING", "0").lower() in ("1", "true", "yes")
+GATEWAY_ROUTES = [
+    name.strip()
+    for name in os.getenv("PAYMENT_GATEWAY_ROUTES", "yookassa,sberpay,tinkoff").split(",")
+    if name.strip()
+]
+
+# HTTP или встроенный брокер (BROKER_TRANSPORT)
+broker_transport = get_transport(MESSAGE_BROKER_URL, "payment")
+
+# In-memory хранилище с индексами по external_payment_id и booking_id
+payments_db = PaymentStore()
+
+def apply_refund_totals(payment_id: str, refunded: Decimal) -> None:
+    """Статус и возвращённая сумма платежа выводятся из журнала возвратов"""
+    payment = payments_db.get(payment_id)
+    payments_db.update(
+        payment_id,
+        refunded_amount=refunded,
+        status=derive_status(payment.amount, refunded, PaymentStatus.SUCCEEDED),
+        updated_at=datetime.now(),
+    )
 
 
-def serialize_for_json(obj):
-    """Хелпер для сериализации datetime и Decimal в JSON"""
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError(f"Type {type(obj)} not serializable")
+# Журнал возвратов (итоги по платежу) и сводка для сверки расчётов со шлюзами
+refund_ledger = RefundLedger(on_change=apply_refund_totals)
+settlement = SettlementReport()
 
+# Суммы и статусы броней из событий брокера
+booking_read_model = BookingReadModel(BOOKING_READ_MODEL_MAX_ENTRIES)
 
-def publish_event(event: dict) -> None:
-    """Публикация события в Message Broker"""
+# Уже обработанные webhook-и: (шлюз, id платежа в шлюзе, статус, id события)
+processed_webhooks = LruSeenSet(WEBHOOK_IDEMPOTENCY_TTL, WEBHOOK_IDEMPOTENCY_MAX_ENTRIES)
+
+
+def publish_event(event: dict, idempotency_key: Optional[str] = None) -> None:
+    """
+    Публикация события в Message Broker.
+    idempotency_key - брокер отбросит повторную публикацию с тем же ключом
+    (например, при повторном webhook-е о том же платеже).
+    """
     try:
-        # Сериализуем event в JSON строку, а затем обратно в dict для requests
-        event_json = json.dumps(event, default=serialize_for_json)
-        event_dict = json.loads(event_json)
-        resp = requests.post(MESSAGE_BROKER_URL, json=event_dict, timeout=5)
-        resp.raise_for_status()
+        if idempotency_key:
+            event = {**event, "idempotency_key": idempotency_key}
+        # datetime / Decimal сериализуются один раз - при кодировании конверта
+        broker_transport.publish(event)
         print(f"✅ Event отправлен: {event.get('event_type')}")
     except Exception as e:
         print(f"❌ Ошибка публикации события: {e}")
 
 
-def get_booking_amount(booking_id: str) -> Decimal:
+def payment_json(payment: PaymentRecord) -> str:
+    """JSON платежа для ответа API (кэшируется в записи до её изменения)"""
+    return payment.to_json(app.json.dumps)
+
+
+def json_response(body: str, status: int = 200):
+    """Ответ с готовым JSON (как jsonify, но без повторной сериализации)"""
+    return app.response_class(body + "\n", status=status, mimetype=app.json.mimetype)
+
+
+def get_booking(booking_id: str) -> Optional[dict]:
     """
-    Получить сумму брони из Booking Service.
-    Пытается прочитать total_amount или price.
+    Сумма и статус брони: из локальной read-модели, при промахе - из Booking Service
+    (ответ сохраняется в read-модель). None - бронь получить не удалось.
     """
+    booking = booking_read_model.get(booking_id)
+    if booking is not None:
+        return booking
+
     try:
         resp = requests.get(
             f"{BOOKING_SERVICE_URL}/api/bookings/{booking_id}", timeout=5
@@ -91,18 +198,28 @@ def get_booking_amount(booking_id: str) -> Decimal:
             print(
                 f"⚠️ Не удалось получить бронирование {booking_id}: {resp.status_code}"
             )
-            return Decimal("0")
+            return None
 
-        booking = resp.json()
-        amount = booking.get("total_amount") or booking.get("price")
+        data = resp.json()
+        amount = data.get("total_amount") or data.get("price")
         if amount is None:
             print(f"⚠️ В бронировании {booking_id} нет total_amount/price")
-            return Decimal("0")
-
-        return Decimal(str(amount))
+        booking_read_model.put(booking_id, amount=amount, status=data.get("status"))
+        return {"amount": Decimal(str(amount)) if amount is not None else None, "status": data.get("status")}
     except Exception as e:
         print(f"❌ Ошибка запроса к Booking Service: {e}")
-        return Decimal("0")
+        return None
+
+
+def handle_broker_message(data: dict) -> str:
+    """Событие брони из брокера (по HTTP или встроенным транспортом) -> read-модель"""
+    try:
+        applied = booking_read_model.apply_event(data.get("event_type"), data.get("payload") or {})
+        return "processed" if applied else "ignored"
+    except Exception as e:
+        # Повтор не поможет: битое событие; при промахе сработает запрос в Booking Service
+        print(f"❌ Ошибка обработки события брони: {e}")
+        return "processed_with_error"
 
 
 def create_payment_gateway(
@@ -116,10 +233,34 @@ def create_payment_gateway(
     return gateway.create_payment(amount, booking_id, return_url)
 
 
-def process_webhook(
+def create_payment_routed(
+    candidates: list,
+    amount: Decimal,
+    booking_id: str,
+    return_url: str | None = None,
+):
+    """
+    Создание платежа в первом работающем шлюзе из candidates.
+    Возвращает (PaymentMethod, результат шлюза); если отказали все - последнюю ошибку.
+    """
+    last_error = None
+    for payment_method in candidates:
+        try:
+            return payment_method, create_payment_gateway(payment_method, amount, booking_id, return_url)
+        except GATEWAY_UNAVAILABLE_ERRORS as e:
+            last_error = e
+        except Exception as e:
+            if not is_gateway_failure(e):
+                raise
+            last_error = e
+        print(f"⚠️ Шлюз {payment_method.value} недоступен: {last_error}")
+    raise last_error
+
+
+def parse_webhook(
     gateway: PaymentMethod, webhook_data: dict, signature: str | None = None
 ):
-    """Обработка webhook от платёжного шлюза"""
+    """Проверка подписи и разбор webhook-а шлюзом (быстрая часть, до подтверждения)"""
     gateway_instance = get_gateway(gateway.value, PAYMENT_ENV)
 
     # Проверка подписи в проде
@@ -127,7 +268,21 @@ def process_webhook(
         if not gateway_instance.verify_webhook(webhook_data, signature):
             return {"error": "Невалидная подпись"}, 400
 
-    processed_data = gateway_instance.process_webhook(webhook_data)
+    return gateway_instance.process_webhook(webhook_data)
+
+
+def process_webhook(
+    gateway: PaymentMethod, webhook_data: dict, signature: str | None = None
+):
+    """Обработка webhook от платёжного шлюза (синхронно)"""
+    processed_data = parse_webhook(gateway, webhook_data, signature)
+    if isinstance(processed_data, tuple):
+        return processed_data
+    return apply_webhook(processed_data)
+
+
+def apply_webhook(processed_data: dict):
+    """Обновление платежа по разобранному webhook-у, подтверждение брони и событие"""
     external_payment_id = processed_data.get("payment_id")
     status = processed_data.get("status", "pending")
 
@@ -139,65 +294,106 @@ def process_webhook(
     }
     mapped_status = status_mapping.get(status.lower(), PaymentStatus.PENDING.value)
 
-    # Находим платёж по external_payment_id
-    payment = None
-    for p in payments_db.values():
-        if p.get("external_payment_id") == external_payment_id:
-            payment = p
-            break
+    # Находим платёж по external_payment_id (индекс хранилища)
+    payment = payments_db.get_by_external_id(external_payment_id)
 
     if not payment:
         return {"error": "Платёж не найден"}, 404
 
-    old_status = payment["status"]
-    payment["status"] = mapped_status
-    payment["updated_at"] = datetime.now().isoformat()
-    
-    # Обновляем в БД (payment уже ссылается на объект из payments_db)
-    payments_db[payment["payment_id"]] = payment
+    # Webhook (воркер очереди) и сверка одного платежа могут выполняться одновременно:
+    # статус меняется compare-and-set, подтверждение брони, учёт и событие - только
+    # у обработчика, который его изменил
+    while True:
+        # Статус платежа с возвратами выводится из журнала возвратов:
+        # запоздавший webhook об оплате его не перетирает
+        old_status = payment.status
+        if old_status in (PaymentStatus.PARTIALLY_REFUNDED, PaymentStatus.REFUNDED):
+            return {"status": "ok"}
+        if old_status == mapped_status:
+            # Статус не изменился (повтор или ещё pending) - без побочных действий
+            payments_db.update(payment.payment_id, updated_at=datetime.now())
+            return {"status": "ok"}
+        if payments_db.compare_and_update(
+            payment.payment_id,
+            old_status,
+            status=mapped_status,
+            updated_at=datetime.now(),
+        ):
+            break
 
     # Успешная оплата
-    if (
-        mapped_status == PaymentStatus.SUCCEEDED.value
-        and old_status != PaymentStatus.SUCCEEDED.value
-    ):
+    if mapped_status == PaymentStatus.SUCCEEDED.value:
+        settlement.record_payment(payment.payment_method.value, payment.amount)
+
         # Подтверждаем бронь
         try:
             requests.post(
-                f"{BOOKING_SERVICE_URL}/api/bookings/{payment['booking_id']}/confirm",
+                f"{BOOKING_SERVICE_URL}/api/bookings/{payment.booking_id}/confirm",
                 timeout=5,
             )
         except Exception as e:
             print(f"⚠️ Не удалось подтвердить бронь: {e}")
 
-        # Конвертируем payment dict в PaymentResponse, обрабатывая строковые даты
-        payment_for_response = payment.copy()
-        if isinstance(payment_for_response.get("created_at"), str):
-            payment_for_response["created_at"] = datetime.fromisoformat(payment_for_response["created_at"])
-        if payment_for_response.get("updated_at") and isinstance(payment_for_response["updated_at"], str):
-            payment_for_response["updated_at"] = datetime.fromisoformat(payment_for_response["updated_at"])
-        if isinstance(payment_for_response.get("amount"), (str, float)):
-            payment_for_response["amount"] = Decimal(str(payment_for_response["amount"]))
-        
         event = PaymentSucceededEvent(
-            payment=PaymentResponse(**payment_for_response),
-            booking_id=payment["booking_id"],
+            payment=payment.to_response(),
+            booking_id=payment.booking_id,
             timestamp=datetime.now(),
         )
-        publish_event(event.dict())
+        publish_event(event.dict(), idempotency_key=f"{event.event_type}:{payment.payment_id}")
 
     # Неуспешная оплата
     elif mapped_status == PaymentStatus.FAILED.value:
         event = PaymentFailedEvent(
-            payment_id=payment["payment_id"],
-            booking_id=payment["booking_id"],
+            payment_id=payment.payment_id,
+            booking_id=payment.booking_id,
             timestamp=datetime.now(),
         )
-        publish_event(event.dict())
+        publish_event(event.dict(), idempotency_key=f"{event.event_type}:{payment.payment_id}")
 
     return {"status": "ok"}
 
 
+@app.route("/api/payments", methods=["GET"])
+def list_payments():
+    """Платежи бронирования: GET /api/payments?booking_id=..."""
+    booking_id = request.args.get("booking_id")
+    if not booking_id:
+        return jsonify({"error": "booking_id обязателен"}), 400
+
+    # Ответ собирается из кэшированного JSON платежей
+    payments = [payment_json(p) for p in payments_db.list_by_booking(booking_id)]
+    return json_response(
+        f'{{"booking_id": {app.json.dumps(booking_id)}, "payments": [{", ".join(payments)}], "total": {len(payments)}}}'
+    )
+
+
+@app.route("/api/payments/batch-get", methods=["POST"])
+def batch_get_payments():
+    """
+    Статусы нескольких платежей одним запросом: {"payment_ids": [...]}.
+    Платежи - в порядке запроса (без повторов), ненайденные id - в not_found
+    """
+    payment_ids = (request.get_json(silent=True) or {}).get("payment_ids")
+    if not isinstance(payment_ids, list) or not all(isinstance(pid, str) for pid in payment_ids):
+        return jsonify({"error": "payment_ids - список id платежей"}), 400
+    payment_ids = list(dict.fromkeys(payment_ids))
+    if len(payment_ids) > PAYMENT_BATCH_GET_MAX_IDS:
+        return jsonify({"error": f"Не больше {PAYMENT_BATCH_GET_MAX_IDS} id за запрос"}), 400
+
+    # Ответ собирается из кэшированного JSON платежей
+    payments = []
+    not_found = []
+    for payment_id in payment_ids:
+        payment = payments_db.get(payment_id)
+        if payment is None:
+            not_found.append(payment_id)
+        else:
+            payments.append(payment_json(payment))
+    return json_response(
+        f'{{"not_found": {app.json.dumps(not_found)}, "payments": [{", ".join(payments)}], "total": {len(payments)}}}'
+    )
+
+
 @app.route("/api/payments", methods=["POST"])
 def create_payment():
     """Создание нового платежа"""
@@ -211,60 +407,161 @@ def create_payment():
     # 1. Берём amount из запроса, если он есть
     amount_raw = data.get("amount")
 
-    # 2. Если нет — тянем из Booking Service
+    # 2. Если нет — из read-модели броней (при промахе - из Booking Service).
+    #    С amount в запросе бронь проверяется только по read-модели, без запроса
+    booking = get_booking(booking_id) if amount_raw is None else booking_read_model.get(booking_id)
+    if booking and booking["status"] == CANCELLED:
+        return jsonify({"error": "Бронирование отменено"}), 409
+
     if amount_raw is None:
-        print("ℹ️ amount не указан, получаем из Booking Service…")
-        amount = get_booking_amount(booking_id)
+        amount = booking["amount"] if booking and booking["amount"] is not None else Decimal("0")
         if amount <= 0:
             return jsonify({"error": "Не удалось определить сумму платежа"}), 400
     else:
         amount = Decimal(str(amount_raw))
 
+    pinned = data.get("payment_method")
     try:
-        payment_method = PaymentMethod(data.get("payment_method", "yookassa"))
+        payment_method = PaymentMethod(pinned or DEFAULT_GATEWAY)
+    except ValueError:
+        return jsonify({"error": "Неверный payment_method"}), 400
+
+    # Шлюз, выбранный клиентом, не подменяем
+    if pinned or not GATEWAY_ROUTING:
+        candidates = [payment_method]
+    else:
+        candidates = [PaymentMethod(name) for name in gateway_registry.route(GATEWAY_ROUTES, PAYMENT_ENV)]
 
-        gateway_result = create_payment_gateway(
-            payment_method,
+    try:
+        payment_method, gateway_result = create_payment_routed(
+            candidates,
             amount,
             booking_id,
             data.get("return_url"),
         )
 
-        payment_id = str(uuid.uuid4())
-        created_at = datetime.now()
-        payment_data = {
-            "payment_id": payment_id,
-            "booking_id": booking_id,
-            "amount": amount,
-            "payment_method": payment_method.value,
-            "status": PaymentStatus.PENDING.value,
-            "created_at": created_at,
-            "updated_at": None,
-            "external_payment_id": gateway_result.get("external_payment_id"),
-            "payment_url": gateway_result.get("payment_url"),
-        }
-
-        # Для хранения в БД конвертируем datetime в строку
-        payments_db[payment_id] = {
-            **payment_data,
-            "created_at": created_at.isoformat(),
-            "updated_at": None,
-        }
-        print(f"✅ Платёж создан: {payment_id}")
-
-        resp = PaymentResponse(**payment_data)
-        return jsonify(resp.dict()), 201
-
-    except ValueError:
-        return jsonify({"error": "Неверный payment_method"}), 400
+        payment = payments_db.add(PaymentRecord(
+            payment_id=str(uuid.uuid4()),
+            booking_id=booking_id,
+            amount=amount,
+            payment_method=payment_method,
+            status=PaymentStatus.PENDING,
+            external_payment_id=gateway_result.get("external_payment_id"),
+            payment_url=gateway_result.get("payment_url"),
+        ))
+        print(f"✅ Платёж создан: {payment.payment_id}")
+
+        return json_response(payment_json(payment), 201)
+
+    except GATEWAY_UNAVAILABLE_ERRORS as e:
+        print(f"❌ Платёжный шлюз недоступен: {e}")
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"❌ Ошибка платежа: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def webhook_idempotency_key(gateway: str, processed_data: dict) -> str:
+    return ":".join((
+        gateway,
+        str(processed_data.get("payment_id")),
+        str(processed_data.get("status")),
+        str(processed_data.get("event_id") or ""),
+    ))
+
+
+def handle_queued_webhook(record: dict) -> None:
+    """Обработка webhook-а из очереди приёма (воркер WebhookQueue)"""
+    processed_data = parse_webhook(PaymentMethod(record["gateway"]), record["payload"])
+
+    # Повтор мог попасть в очередь, пока первый webhook ещё обрабатывался.
+    # Webhook-и платежа обрабатываются одним воркером, поэтому проверка атомарна
+    key = webhook_idempotency_key(record["gateway"], processed_data)
+    if not processed_webhooks.add(key):
+        print(f"ℹ️ Повторный webhook пропущен: {key}")
+        return
+    try:
+        result = apply_webhook(processed_data)
+    except Exception:
+        processed_webhooks.discard(key)
+        raise
+    if isinstance(result, tuple) and result[1] == 404:
+        processed_webhooks.discard(key)
+        # Webhook мог обогнать сохранение платежа - очередь повторит попытку
+        raise LookupError(f"Платёж {processed_data.get('payment_id')} не найден")
+
+
+def recheck_failed_webhook(record: dict, error: Exception) -> None:
+    """
+    Webhook не обработан после всех попыток (остался в журнале как dead-letter):
+    статус платежа перепроверит ближайшая сверка
+    """
+    payment = payments_db.get_by_external_id(record["key"])
+    if payment is not None and payments_db.request_check(payment.payment_id):
+        print(f"ℹ️ Платёж {payment.payment_id} поставлен на сверку после отказа webhook-а")
+
+
+# Очередь приёма webhook-ов: шлюз получает 200 после записи в журнал
+# (без журнала - после обработки)
+webhook_queue = WebhookQueue(
+    handle_queued_webhook,
+    workers=WEBHOOK_WORKERS,
+    persistence_dir=WEBHOOK_QUEUE_DIR,
+    fsync=WEBHOOK_QUEUE_FSYNC,
+    on_failure=recheck_failed_webhook,
+)
+webhook_queue.start()
+if not webhook_queue.persistent:
+    print("⚠️ WEBHOOK_QUEUE_DIR пуст: журнала нет, webhook подтверждается только после обработки")
+
+
+def check_payment_status(payment: PaymentRecord) -> dict:
+    """Статус платежа в шлюзе (для сверки)"""
+    gateway = get_gateway(payment.payment_method.value, PAYMENT_ENV)
+    return gateway.get_payment_status(payment.external_payment_id)
+
+
+def reconcile_payment(payment: PaymentRecord, processed_data: dict) -> None:
+    """
+    Статус, полученный сверкой, применяется так же, как webhook с этим статусом.
+    Одновременный настоящий webhook не применится второй раз: переход статуса в
+    apply_webhook - compare-and-set
+    """
+    key = webhook_idempotency_key(payment.payment_method.value, processed_data)
+    # Пока шёл запрос статуса, платёж мог обновить webhook
+    if payment.status != PaymentStatus.PENDING or not processed_webhooks.add(key):
+        return
+    try:
+        apply_webhook(processed_data)
+    except Exception:
+        processed_webhooks.discard(key)
+        raise
+
+
+reconciler = PaymentReconciler(
+    payments_db,
+    check_payment_status,
+    reconcile_payment,
+    min_age=RECONCILE_MIN_AGE,
+    interval=RECONCILE_INTERVAL,
+    batch_size=RECONCILE_BATCH_SIZE,
+    concurrency=RECONCILE_CONCURRENCY,
+    max_retry_delay=RECONCILE_MAX_RETRY_DELAY,
+    max_attempts=RECONCILE_MAX_ATTEMPTS,
+    max_age=RECONCILE_MAX_AGE,
+)
+if RECONCILE_INTERVAL > 0:
+    reconciler.start()
+
+
 @app.route("/api/payments/webhook/<gateway>", methods=["POST"])
 def webhook(gateway: str):
-    """Webhook от платёжного шлюза"""
+    """
+    Webhook от платёжного шлюза.
+    Подпись проверяется и webhook разбирается сразу, остальная обработка -
+    асинхронно в очереди после записи в журнал (порядок webhook-ов одного
+    платежа сохраняется); без журнала ответ - после обработки.
+    """
     try:
         webhook_data = request.json or {}
 
@@ -277,17 +574,90 @@ def webhook(gateway: str):
             "Signature"
         )
 
-        result = process_webhook(payment_method, webhook_data, signature)
-
-        if isinstance(result, tuple):
-            body, code = result
+        processed_data = parse_webhook(payment_method, webhook_data, signature)
+        if isinstance(processed_data, tuple):
+            body, code = processed_data
             return jsonify(body), code
 
-        return jsonify(result), 200
+        if not processed_data.get("payment_id"):
+            return jsonify({"error": "В webhook-е нет идентификатора платежа"}), 400
+
+        # Повторное уведомление шлюза отвечаем сразу, без очереди и вызовов сервисов
+        if webhook_idempotency_key(payment_method.value, processed_data) in processed_webhooks:
+            return jsonify({"status": "duplicate"}), 200
+
+        # Без журнала webhook в памяти потерялся бы при остановке: ждём обработки,
+        # при ошибке - 503, шлюз повторит уведомление
+        wait = None if webhook_queue.persistent else WEBHOOK_SYNC_TIMEOUT
+        try:
+            webhook_id = webhook_queue.submit(
+                payment_method.value, processed_data["payment_id"], webhook_data, signature, wait=wait
+            )
+        except WebhookNotProcessed as e:
+            print(f"⚠️ {e}")
+            return jsonify({"error": str(e)}), 503
+        status = "accepted" if webhook_queue.persistent else "processed"
+        return jsonify({"status": status, "webhook_id": webhook_id}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/payments/webhooks/stats", methods=["GET"])
+def webhook_stats():
+    """
+    Очередь приёма webhook-ов: глубина, счётчики и задержка приём -> обработка;
+    idempotency - попадания в хранилище обработанных webhook-ов (доля повторов)
+    """
+    return jsonify({**webhook_queue.stats(), "idempotency": processed_webhooks.stats()}), 200
+
+
+@app.route("/api/payments/webhooks/dead-letters", methods=["GET"])
+def webhook_dead_letters():
+    """Webhook-и, не обработанные после всех попыток (хранятся в журнале очереди)"""
+    limit = request.args.get("limit", default=100, type=int)
+    dead_letters = webhook_queue.dead_letters(limit)
+    return jsonify({"total": webhook_queue.dead_letter_count(), "dead_letters": dead_letters}), 200
+
+
+@app.route("/api/payments/webhooks/dead-letters/replay", methods=["POST"])
+def replay_webhook_dead_letters():
+    """Вернуть dead-letter-ы в очередь: {"webhook_id": "..."} - один, без тела - все"""
+    data = request.get_json(silent=True) or {}
+    replayed = webhook_queue.replay(data.get("webhook_id"))
+    if data.get("webhook_id") and not replayed:
+        return jsonify({"error": "Webhook не найден среди необработанных"}), 404
+    return jsonify({"replayed": replayed}), 200
+
+
+@app.route("/broker/consume", methods=["POST"])
+def consume_message():
+    try:
+        message = decode_message(request.get_data(), request.content_type)
+    except ValueError as e:
+        print(f"❌ Не удалось разобрать сообщение брокера: {e}")
+        return jsonify({"status": "processed_with_error"}), 200
+    return jsonify({"status": handle_broker_message(message)}), 200
+
+
+# Во встроенном режиме брокер вызывает обработчик напрямую
+register_consumer("payment", lambda message: bool(handle_broker_message(message)), SUBSCRIBED_EVENTS)
+
+
+@app.route("/api/payments/reconciliation", methods=["GET"])
+def reconciliation_stats():
+    """Сверка зависших платежей: счётчики, задержка запросов статуса, итоги последнего прохода"""
+    return jsonify(reconciler.stats()), 200
+
+
+@app.route("/api/payments/reconciliation/run", methods=["POST"])
+def run_reconciliation():
+    """Внеочередной проход сверки; min_age (секунды) переопределяет возраст платежей"""
+    data = request.get_json(silent=True) or {}
+    min_age = data.get("min_age")
+    summary = reconciler.run_once(float(min_age) if min_age is not None else None)
+    return jsonify(summary), 200
+
+
 @app.route("/api/payments/<payment_id>", methods=["GET"])
 def get_payment(payment_id: str):
     """Получение статуса платежа"""
@@ -295,61 +665,159 @@ def get_payment(payment_id: str):
     if not payment:
         return jsonify({"error": "Платёж не найден"}), 404
     
-    # Конвертируем строковые даты обратно в datetime для PaymentResponse
-    payment_for_response = payment.copy()
-    if isinstance(payment_for_response.get("created_at"), str):
-        payment_for_response["created_at"] = datetime.fromisoformat(payment_for_response["created_at"])
-    if payment_for_response.get("updated_at") and isinstance(payment_for_response["updated_at"], str):
-        payment_for_response["updated_at"] = datetime.fromisoformat(payment_for_response["updated_at"])
-    if isinstance(payment_for_response.get("amount"), (str, float)):
-        payment_for_response["amount"] = Decimal(str(payment_for_response["amount"]))
-    
-    resp = PaymentResponse(**payment_for_response)
-    return jsonify(resp.dict()), 200
+    return json_response(payment_json(payment))
 
 
 @app.route("/api/payments/<payment_id>/refund", methods=["POST"])
 def refund_payment(payment_id: str):
-    """Возврат средств (прототип)"""
+    """
+    Возврат средств, в том числе частичный (несколько возвратов по платежу).
+    Без amount возвращается весь остаток. Статус платежа - из журнала возвратов
+    """
     try:
         payment = payments_db.get(payment_id)
         if not payment:
             return jsonify({"error": "Платёж не найден"}), 404
 
-        if payment["status"] != PaymentStatus.SUCCEEDED.value:
+        if payment.status not in (PaymentStatus.SUCCEEDED, PaymentStatus.PARTIALLY_REFUNDED):
             return jsonify(
                 {"error": "Возврат возможен только для успешных платежей"}
             ), 400
 
-        data = request.json or {}
-        refund_req = RefundRequest(**data)
+        data = request.get_json(silent=True) or {}
+        refund_req = RefundRequest(**{**data, "payment_id": payment_id})
         refund_amount = (
             refund_req.amount
-            if refund_req.amount
-            else Decimal(str(payment["amount"]))
+            if refund_req.amount is not None
+            else refund_ledger.available(payment_id, payment.amount)
         )
 
-        refund_id = str(uuid.uuid4())
-        payment["status"] = PaymentStatus.REFUNDED.value
-        payment["updated_at"] = datetime.now().isoformat()
+        try:
+            refund = refund_ledger.reserve(
+                payment_id, payment.amount, refund_amount, refund_req.reason, payment.payment_method.value
+            )
+        except OverRefundError as e:
+            # Сумма больше остатка: конфликт с уже выполненными возвратами
+            return jsonify({"error": str(e), "available": refund_ledger.available(payment_id, payment.amount)}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        refund_resp = RefundResponse(
-            refund_id=refund_id,
-            payment_id=payment_id,
-            amount=refund_amount,
-            status="succeeded",
-            timestamp=datetime.now(),
-        )
+        gateway = get_gateway(payment.payment_method.value, PAYMENT_ENV)
+        try:
+            result = gateway.refund_payment(payment.external_payment_id, refund_amount, refund["refund_id"])
+        except Exception as e:
+            refund_ledger.fail(refund["refund_id"], payment_id, str(e))
+            print(f"❌ Возврат {refund['refund_id']} не выполнен: {e}")
+            code = 503 if isinstance(e, GATEWAY_UNAVAILABLE_ERRORS) else 502
+            return jsonify({"error": str(e), "refund_id": refund["refund_id"]}), code
+
+        refund = refund_ledger.complete(refund["refund_id"], payment_id, result.get("external_refund_id"))
+        settlement.record_refund(payment.payment_method.value, refund_amount)
+        print(f"✅ Возврат {refund_amount} по платежу {payment_id}")
+
+        refund_resp = RefundResponse(**refund)
         return jsonify(refund_resp.dict()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/payments/<payment_id>/refunds", methods=["GET"])
+def list_refunds(payment_id: str):
+    """Журнал возвратов платежа и остаток к возврату"""
+    payment = payments_db.get(payment_id)
+    if not payment:
+        return jsonify({"error": "Платёж не найден"}), 404
+    refunds = refund_ledger.list(payment_id)
+    return jsonify({
+        "payment_id": payment_id,
+        "amount": payment.amount,
+        "refunded_amount": refund_ledger.refunded(payment_id),
+        "available": refund_ledger.available(payment_id, payment.amount),
+        "refunds": refunds,
+        "total": len(refunds),
+    }), 200
+
+
+@app.route("/api/payments/settlement", methods=["GET"])
+def settlement_report():
+    """Итоги оплат и возвратов по дням и шлюзам: ?date=YYYY-MM-DD&gateway=..."""
+    day = request.args.get("date")
+    try:
+        day = date.fromisoformat(day) if day else None
+    except ValueError:
+        return jsonify({"error": "date в формате YYYY-MM-DD"}), 400
+    return jsonify(settlement.report(day, request.args.get("gateway"))), 200
+
+
+def parse_export_bound(value: Optional[str], is_end: bool) -> Optional[datetime]:
+    """Граница периода выгрузки: дата (конец - включительно) или дата-время; None - без границы"""
+    if not value:
+        return None
+    if len(value) == 10:
+        day = datetime.combine(date.fromisoformat(value), datetime.min.time())
+        return day + timedelta(days=1) if is_end else day
+    return datetime.fromisoformat(value)
+
+
+@app.route("/api/payments/export", methods=["GET"])
+def export_payments():
+    """
+    Потоковая выгрузка платежей и возвратов по шлюзам с итогами:
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&gateway=yookassa,sberpay&status=succeeded&type=payment,refund&format=csv
+    """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in payment_export.FORMATS:
+        return jsonify({"error": f"format: {', '.join(payment_export.FORMATS)}"}), 400
+    try:
+        start = parse_export_bound(request.args.get("from"), is_end=False)
+        end = parse_export_bound(request.args.get("to"), is_end=True)
+    except ValueError:
+        return jsonify({"error": "from / to в формате YYYY-MM-DD или ISO 8601"}), 400
+    gateways = request.args.get("gateway")
+    statuses = request.args.get("status")
+    kinds = request.args.get("type")
+    kinds = kinds.split(",") if kinds else payment_export.KINDS
+    if any(kind not in payment_export.KINDS for kind in kinds):
+        return jsonify({"error": f"type: {', '.join(payment_export.KINDS)}"}), 400
+
+    rows = payment_export.export_rows(
+        payments_db,
+        refund_ledger,
+        start,
+        end,
+        gateways=gateways.split(",") if gateways else None,
+        statuses=statuses.split(",") if statuses else None,
+        kinds=kinds,
+    )
+    # Без Content-Length: ответ уходит частями (chunked) по мере обхода индекса
+    return Response(
+        payment_export.stream(rows, fmt),
+        mimetype=payment_export.FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=payments.{fmt}"},
+    )
+
+
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "healthy", "service": "payment"}), 200
+    open_breakers = gateway_registry.open_breakers()
+    return jsonify({
+        "status": "degraded" if open_breakers else "healthy",
+        "service": "payment",
+        "webhook_queue_depth": webhook_queue.depth(),
+        "open_breakers": open_breakers,
+        "gateways": gateway_registry.stats(),
+        "booking_read_model": booking_read_model.stats(),
+    }), 200
 
 
 if __name__ == "__main__":
     print(f"🚀 Starting Payment Service on port {PORT}")
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    if SERVICE_PUBLIC_URL:
+        start_membership(
+            MESSAGE_BROKER_URL.rsplit("/", 1)[0],
+            "payment",
+            f"{SERVICE_PUBLIC_URL}/broker/consume",
+            SUBSCRIBED_EVENTS,
+        )
+    # Без перезагрузчика: иначе журнал восстановят два процесса и webhook-ы обработаются дважды
+    app.run(host="0.0.0.0", port=PORT, debug=True, use_reloader=False)
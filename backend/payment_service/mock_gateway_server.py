@@ -0,0 +1,328 @@
+"""
+Локальный mock-сервер платёжных шлюзов (ЮKassa, СберPay, Тинькофф)
+
+Отвечает на запросы создания платежа в форматах API шлюзов и через заданную
+задержку присылает в Payment Service webhook в реальном формате шлюза
+(как payment_service/test_webhook.py). Задержка ответа, доля ошибок и таймаутов,
+исход оплаты и задержка webhook-а настраиваются - для нагрузочных тестов без сети.
+
+Запуск (из каталога backend):
+    python payment_service/mock_gateway_server.py
+
+Payment Service в режиме test, направленный на mock:
+    PAYMENT_ENV=test
+    YOOKASSA_API_URL=http://localhost:5090/yookassa/v3/payments
+    SBERPAY_API_URL=http://localhost:5090/sberpay/payment/rest/register.do
+    TINKOFF_API_URL=http://localhost:5090/tinkoff/v2/Init
+
+Настройки (переменные окружения; на лету - POST /_config, ключи без MOCK_: {"error_rate": 0.3}):
+    MOCK_LATENCY_MS      медиана задержки ответа, мс (по умолчанию 120)
+    MOCK_LATENCY_SIGMA   разброс логнормального распределения (0 - фиксированная задержка)
+    MOCK_ERROR_RATE      доля ответов 500
+    MOCK_TIMEOUT_RATE    доля запросов, которые "зависают" на MOCK_TIMEOUT_MS
+    MOCK_SUCCESS_RATE    доля успешных оплат в webhook-ах (остальные - отказ)
+    MOCK_WEBHOOK_DELAY_MS  задержка webhook-а после создания платежа, мс
+    MOCK_DUPLICATE_RATE  доля webhook-ов, которые шлюз присылает повторно
+    MOCK_WEBHOOK_LOSS_RATE  доля "потерянных" webhook-ов: платёж завершён, но уведомления
+                         нет - статус отдают только методы запроса статуса (сверка)
+    PAYMENT_WEBHOOK_URL  куда слать webhook-и (к адресу добавляется /<шлюз>; ключ webhook_url)
+"""
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+PORT = int(os.getenv("PORT", 5090))
+
+config = {
+    "latency_ms": float(os.getenv("MOCK_LATENCY_MS", 120)),
+    "latency_sigma": float(os.getenv("MOCK_LATENCY_SIGMA", 0.5)),
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", 0)),
+    "timeout_rate": float(os.getenv("MOCK_TIMEOUT_RATE", 0)),
+    "timeout_ms": float(os.getenv("MOCK_TIMEOUT_MS", 30000)),
+    "success_rate": float(os.getenv("MOCK_SUCCESS_RATE", 0.95)),
+    "webhook_delay_ms": float(os.getenv("MOCK_WEBHOOK_DELAY_MS", 1000)),
+    "duplicate_rate": float(os.getenv("MOCK_DUPLICATE_RATE", 0)),
+    "webhook_loss_rate": float(os.getenv("MOCK_WEBHOOK_LOSS_RATE", 0)),
+    "webhook_url": os.getenv("PAYMENT_WEBHOOK_URL", "http://localhost:5002/api/payments/webhook"),
+}
+
+stats = {
+    "requests": 0, "errors": 0, "timeouts": 0,
+    "webhooks_sent": 0, "webhooks_failed": 0, "webhooks_lost": 0, "status_requests": 0,
+}
+stats_lock = threading.Lock()
+# id платежа в шлюзе -> исход: None - ещё не оплачен, True - успех, False - отказ
+payments: dict = {}
+webhook_session = requests.Session()
+
+
+def _count(key: str) -> None:
+    with stats_lock:
+        stats[key] += 1
+
+
+def simulate_gateway():
+    """Задержка и сбои шлюза. Возвращает ответ-ошибку или None"""
+    _count("requests")
+    roll = random.random()
+    if roll < config["timeout_rate"]:
+        _count("timeouts")
+        time.sleep(config["timeout_ms"] / 1000)
+    elif config["latency_ms"] > 0:
+        # Логнормальное распределение: медиана latency_ms, длинный хвост при sigma > 0
+        delay = config["latency_ms"] * math.exp(random.gauss(0, config["latency_sigma"]))
+        time.sleep(delay / 1000)
+    if random.random() < config["error_rate"]:
+        _count("errors")
+        return jsonify({"error": "internal gateway error"}), 500
+    return None
+
+
+def schedule_webhook(gateway: str, payment_id: str, payload_factory) -> None:
+    """Завершить платёж после задержки и отправить webhook (возможно, повторно или никогда)"""
+    payments[payment_id] = None
+    succeeded = random.random() < config["success_rate"]
+    payload = payload_factory(succeeded)
+    sends = 2 if random.random() < config["duplicate_rate"] else 1
+
+    def send():
+        payments[payment_id] = succeeded
+        if random.random() < config["webhook_loss_rate"]:
+            _count("webhooks_lost")
+            return
+        for _ in range(sends):
+            try:
+                webhook_session.post(f"{config['webhook_url']}/{gateway}", json=payload, timeout=10)
+                _count("webhooks_sent")
+            except requests.RequestException:
+                _count("webhooks_failed")
+
+    timer = threading.Timer(config["webhook_delay_ms"] / 1000, send)
+    timer.daemon = True
+    timer.start()
+
+
+# ---------- ЮKassa ----------
+
+@app.route("/yookassa/v3/payments", methods=["POST"])
+def yookassa_create():
+    error = simulate_gateway()
+    if error:
+        return error
+
+    data = request.get_json() or {}
+    payment_id = str(uuid.uuid4())
+    amount = data.get("amount", {"value": "0.00", "currency": "RUB"})
+    metadata = data.get("metadata", {})
+
+    def webhook(succeeded: bool) -> dict:
+        status = "succeeded" if succeeded else "canceled"
+        return {
+            "type": "notification",
+            "event": f"payment.{status}",
+            "object": {
+                "id": payment_id,
+                "status": status,
+                "amount": amount,
+                "metadata": metadata,
+                "created_at": datetime.now().isoformat(),
+            },
+        }
+
+    schedule_webhook("yookassa", payment_id, webhook)
+    return jsonify({
+        "id": payment_id,
+        "status": "pending",
+        "paid": False,
+        "amount": amount,
+        "confirmation": {
+            "type": "redirect",
+            "confirmation_url": f"http://localhost:{PORT}/checkout/yookassa/{payment_id}",
+        },
+        "created_at": datetime.now().isoformat(),
+        "metadata": metadata,
+    }), 200
+
+
+@app.route("/yookassa/v3/payments/<payment_id>", methods=["GET"])
+def yookassa_get(payment_id: str):
+    error = simulate_gateway()
+    if error:
+        return error
+    _count("status_requests")
+    if payment_id not in payments:
+        return jsonify({"type": "error", "code": "not_found"}), 404
+    outcome = payments[payment_id]
+    status = "pending" if outcome is None else "succeeded" if outcome else "canceled"
+    return jsonify({"id": payment_id, "status": status, "paid": bool(outcome)}), 200
+
+
+@app.route("/yookassa/v3/refunds", methods=["POST"])
+def yookassa_refund():
+    error = simulate_gateway()
+    if error:
+        return error
+    data = request.get_json() or {}
+    if not payments.get(data.get("payment_id")):
+        return jsonify({"type": "error", "code": "invalid_request", "description": "Платёж не оплачен"}), 400
+    return jsonify({
+        "id": str(uuid.uuid4()),
+        "payment_id": data["payment_id"],
+        "status": "succeeded",
+        "amount": data.get("amount"),
+        "created_at": datetime.now().isoformat(),
+    }), 200
+
+
+# ---------- СберPay ----------
+
+@app.route("/sberpay/payment/rest/register.do", methods=["POST"])
+def sberpay_register():
+    error = simulate_gateway()
+    if error:
+        return error
+
+    order_id = str(uuid.uuid4())
+    amount = int(request.values.get("amount", 0))
+    order_number = request.values.get("orderNumber")
+
+    def webhook(succeeded: bool) -> dict:
+        return {
+            "orderId": order_id,
+            "orderNumber": order_number,
+            "operation": "deposited" if succeeded else "declinedByTimeout",
+            "status": 2 if succeeded else 6,
+            "amount": amount,
+        }
+
+    schedule_webhook("sberpay", order_id, webhook)
+    return jsonify({
+        "orderId": order_id,
+        "formUrl": f"http://localhost:{PORT}/checkout/sberpay/{order_id}",
+    }), 200
+
+
+@app.route("/sberpay/payment/rest/getOrderStatusExtended.do", methods=["POST"])
+def sberpay_status():
+    error = simulate_gateway()
+    if error:
+        return error
+    _count("status_requests")
+    order_id = request.values.get("orderId")
+    if order_id not in payments:
+        return jsonify({"errorCode": "6", "errorMessage": "Заказ не найден"}), 200
+    outcome = payments[order_id]
+    # 0 - зарегистрирован, не оплачен; 2 - оплачен; 6 - отклонён
+    return jsonify({"errorCode": "0", "orderStatus": 0 if outcome is None else 2 if outcome else 6}), 200
+
+
+@app.route("/sberpay/payment/rest/refund.do", methods=["POST"])
+def sberpay_refund():
+    error = simulate_gateway()
+    if error:
+        return error
+    if not payments.get(request.values.get("orderId")):
+        return jsonify({"errorCode": "7", "errorMessage": "Заказ не оплачен"}), 200
+    return jsonify({"errorCode": "0", "errorMessage": "Успешно"}), 200
+
+
+# ---------- Тинькофф ----------
+
+@app.route("/tinkoff/v2/Init", methods=["POST"])
+def tinkoff_init():
+    error = simulate_gateway()
+    if error:
+        return error
+
+    data = request.get_json() or {}
+    payment_id = str(random.randint(10**9, 10**10 - 1))
+
+    def webhook(succeeded: bool) -> dict:
+        return {
+            "TerminalKey": data.get("TerminalKey"),
+            "OrderId": data.get("OrderId"),
+            "Success": succeeded,
+            "Status": "CONFIRMED" if succeeded else "REJECTED",
+            "PaymentId": int(payment_id),
+            "ErrorCode": "0" if succeeded else "1051",
+            "Amount": data.get("Amount"),
+        }
+
+    schedule_webhook("tinkoff", payment_id, webhook)
+    return jsonify({
+        "Success": True,
+        "ErrorCode": "0",
+        "TerminalKey": data.get("TerminalKey"),
+        "Status": "NEW",
+        "PaymentId": payment_id,
+        "OrderId": data.get("OrderId"),
+        "Amount": data.get("Amount"),
+        "PaymentURL": f"http://localhost:{PORT}/checkout/tinkoff/{payment_id}",
+    }), 200
+
+
+@app.route("/tinkoff/v2/GetState", methods=["POST"])
+def tinkoff_get_state():
+    error = simulate_gateway()
+    if error:
+        return error
+    _count("status_requests")
+    payment_id = str((request.get_json() or {}).get("PaymentId"))
+    if payment_id not in payments:
+        return jsonify({"Success": False, "ErrorCode": "7", "Message": "Платёж не найден"}), 200
+    outcome = payments[payment_id]
+    status = "NEW" if outcome is None else "CONFIRMED" if outcome else "REJECTED"
+    return jsonify({"Success": True, "ErrorCode": "0", "PaymentId": int(payment_id), "Status": status}), 200
+
+
+@app.route("/tinkoff/v2/Cancel", methods=["POST"])
+def tinkoff_cancel():
+    error = simulate_gateway()
+    if error:
+        return error
+    data = request.get_json() or {}
+    payment_id = str(data.get("PaymentId"))
+    if not payments.get(payment_id):
+        return jsonify({"Success": False, "ErrorCode": "9", "Message": "Платёж не оплачен"}), 200
+    return jsonify({
+        "Success": True, "ErrorCode": "0", "PaymentId": int(payment_id),
+        "Status": "PARTIAL_REFUNDED", "NewAmount": data.get("Amount"),
+    }), 200
+
+
+# ---------- Управление ----------
+
+@app.route("/_config", methods=["GET", "POST"])
+def mock_config():
+    """Текущие настройки; POST меняет их на лету (например, {"error_rate": 0.3})"""
+    if request.method == "POST":
+        for key, value in (request.get_json() or {}).items():
+            if key not in config:
+                return jsonify({"error": f"Неизвестная настройка: {key}"}), 400
+            config[key] = value if key == "webhook_url" else float(value)
+    return jsonify(config), 200
+
+
+@app.route("/_stats", methods=["GET"])
+def mock_stats():
+    with stats_lock:
+        return jsonify(dict(stats)), 200
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "healthy", "service": "mock-payment-gateways"}), 200
+
+
+if __name__ == "__main__":
+    print(f"🧪 Mock платёжных шлюзов на порту {PORT}")
+    app.run(host="0.0.0.0", port=PORT, threaded=True)
@@ -0,0 +1,179 @@
+"""
+Сверка зависших платежей с платёжными шлюзами
+
+Если webhook шлюза потерян, платёж навсегда остаётся в pending. Сверка
+периодически берёт из индекса по возрасту (PaymentStore.pending_older_than)
+платежи в pending старше min_age, пачками по batch_size запрашивает их статус
+в шлюзе (не больше concurrency запросов одновременно) и применяет
+изменившиеся статусы тем же путём, что и webhook-и.
+
+За один проход проверяется не больше max_per_run платежей - с самым ранним
+сроком проверки. Платёж, оставшийся в pending (или проверка не удалась),
+уходит в конец очереди: следующая проверка - через retry_delay, удваиваясь
+с каждой попыткой до max_retry_delay. Поэтому платежи, зависшие в шлюзе,
+не занимают каждый проход, и до более новых очередь доходит. После
+max_attempts проверок или старше max_age платёж больше не сверяется
+(abandoned в статистике).
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from message_broker.metrics import Histogram
+
+try:
+    from record import PaymentRecord
+    from store import PaymentStore, PENDING
+except ImportError:
+    from payment_service.record import PaymentRecord
+    from payment_service.store import PaymentStore, PENDING
+
+
+class PaymentReconciler:
+    """Фоновая сверка pending-платежей: статус из шлюза -> apply(payment, processed_data)"""
+
+    def __init__(
+        self,
+        store: PaymentStore,
+        check_status: Callable[[PaymentRecord], dict],
+        apply: Callable[[PaymentRecord, dict], None],
+        min_age: float = 900.0,
+        interval: float = 60.0,
+        batch_size: int = 100,
+        concurrency: int = 8,
+        max_per_run: int = 5000,
+        retry_delay: Optional[float] = None,
+        max_retry_delay: float = 3600.0,
+        max_attempts: int = 30,
+        max_age: float = 3 * 24 * 3600.0,
+    ):
+        self.store = store
+        self.check_status = check_status
+        self.apply = apply
+        self.min_age = min_age
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_per_run = max_per_run
+        # Повторная проверка оставшегося в pending: через retry_delay (по умолчанию -
+        # интервал), с удвоением до max_retry_delay; не больше max_attempts и до возраста max_age, с
+        self.retry_delay = interval if retry_delay is None else retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="payment-reconcile")
+        self.concurrency = max(1, concurrency)
+        self._run_lock = threading.Lock()
+
+        # Метрики
+        self.check_latency = Histogram()
+        self.runs = 0
+        self.checked = 0
+        self.resolved = 0
+        self.errors = 0
+        self.last_run: Optional[dict] = None
+
+    def start(self) -> None:
+        threading.Thread(target=self._loop, daemon=True, name="payment-reconciler").start()
+
+    def run_once(self, min_age: Optional[float] = None) -> dict:
+        """Один проход сверки; возвращает его итоги (в том числе пропускную способность)"""
+        with self._run_lock:
+            started = time.monotonic()
+            now = datetime.now()
+            cutoff = now - timedelta(seconds=self.min_age if min_age is None else min_age)
+            stale = self.store.pending_due(cutoff, now, limit=self.max_per_run)
+            summary = {
+                "stale": len(stale), "checked": 0, "still_pending": 0, "resolved": 0, "errors": 0, "abandoned": 0,
+            }
+
+            for i in range(0, len(stale), self.batch_size):
+                batch = stale[i:i + self.batch_size]
+                for payment, outcome in zip(batch, self._pool.map(self._reconcile, batch)):
+                    summary[outcome] += 1
+                    # Остался в pending (статус не изменился, не распознан или не применён) - в конец очереди
+                    if payment.status == PENDING and not self._reschedule(payment):
+                        summary["abandoned"] += 1
+                summary["checked"] += len(batch)
+
+            elapsed = time.monotonic() - started
+            summary["seconds"] = round(elapsed, 3)
+            summary["per_second"] = round(summary["checked"] / elapsed, 1) if summary["checked"] and elapsed else None
+            summary["finished_at"] = datetime.now().isoformat()
+
+            self.runs += 1
+            self.checked += summary["checked"]
+            self.resolved += summary["resolved"]
+            self.errors += summary["errors"]
+            self.last_run = summary
+            if summary["resolved"] or summary["errors"]:
+                print(
+                    f"🔄 Сверка платежей: проверено {summary['checked']}, "
+                    f"обновлено {summary['resolved']}, ошибок {summary['errors']}"
+                )
+            return summary
+
+    def stats(self) -> dict:
+        return {
+            "min_age_seconds": self.min_age,
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "pending": self.store.pending_count(),
+            "abandoned": self.store.abandoned_count(),
+            "retry_delay_seconds": self.retry_delay,
+            "max_attempts": self.max_attempts,
+            "runs": self.runs,
+            "checked": self.checked,
+            "resolved": self.resolved,
+            "errors": self.errors,
+            "check_latency": self.check_latency.summary(),
+            "last_run": self.last_run,
+        }
+
+    def _reschedule(self, payment: PaymentRecord) -> bool:
+        """Платёж остался в pending: следующая проверка с backoff; False - сверка прекращена"""
+        attempts = self.store.check_attempts(payment.payment_id) + 1
+        now = datetime.now()
+        if attempts >= self.max_attempts or (now - payment.created_at).total_seconds() >= self.max_age:
+            print(f"⚠️ Сверка платежа {payment.payment_id} прекращена: попыток {attempts}, всё ещё pending")
+            self.store.reschedule_check(payment.payment_id, None)
+            return False
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        self.store.reschedule_check(payment.payment_id, now + timedelta(seconds=delay))
+        return True
+
+    def _reconcile(self, payment: PaymentRecord) -> str:
+        """
+        Сверка одного платежа: "resolved" - платёж вышел из pending, "still_pending" - нет
+        (в том числе статус шлюза, который apply не распознал и оставил pending)
+        """
+        started = time.monotonic()
+        try:
+            processed_data = self.check_status(payment)
+        except Exception as e:
+            print(f"⚠️ Сверка платежа {payment.payment_id}: {e}")
+            return "errors"
+        finally:
+            self.check_latency.observe(time.monotonic() - started)
+
+        if processed_data.get("status", PENDING) == PENDING:
+            return "still_pending"
+        try:
+            self.apply(payment, processed_data)
+        except Exception as e:
+            print(f"⚠️ Сверка платежа {payment.payment_id}: {e}")
+            return "errors"
+        current = self.store.get(payment.payment_id)
+        if current is None or current.status == PENDING:
+            return "still_pending"
+        return "resolved"
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Ошибка сверки платежей: {e}")
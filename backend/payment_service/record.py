@@ -0,0 +1,125 @@
+"""
+Внутренняя запись платежа Payment Service
+
+Платёж разбирается один раз - при создании: сумма хранится Decimal, даты -
+datetime, статус и шлюз - перечислениями. Ответ API (dict полей PaymentResponse
+и его JSON) строится лениво и кэшируется в записи до следующего изменения,
+поэтому GET /api/payments/<id> не копирует dict, не разбирает даты и не
+создаёт pydantic-модель на каждый запрос.
+
+Записи меняются только через PaymentStore.update(): он сбрасывает кэш.
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Optional
+
+from schemas.payment import PaymentMethod, PaymentResponse, PaymentStatus
+
+# Поля записи в порядке PaymentResponse
+FIELDS = (
+    "payment_id",
+    "booking_id",
+    "amount",
+    "status",
+    "payment_method",
+    "payment_url",
+    "external_payment_id",
+    "created_at",
+    "updated_at",
+    "refunded_amount",
+)
+
+
+class PaymentRecord:
+    """Типизированный платёж с кэшем сериализованного представления"""
+
+    __slots__ = FIELDS + ("_version", "_dict", "_json")
+
+    def __init__(
+        self,
+        payment_id: str,
+        booking_id: Optional[str] = None,
+        amount=Decimal("0"),
+        status=PaymentStatus.PENDING,
+        payment_method=None,
+        payment_url: Optional[str] = None,
+        external_payment_id: Optional[str] = None,
+        created_at=None,
+        updated_at=None,
+        refunded_amount=Decimal("0"),
+    ):
+        self.payment_id = payment_id
+        self.booking_id = booking_id
+        self.amount = _decimal(amount)
+        self.status = PaymentStatus(status)
+        self.payment_method = PaymentMethod(payment_method) if payment_method else None
+        self.payment_url = payment_url
+        self.external_payment_id = external_payment_id
+        self.created_at = _datetime(created_at) or datetime.now()
+        self.updated_at = _datetime(updated_at)
+        self.refunded_amount = _decimal(refunded_amount)
+        self._version = 0
+        self._dict = None
+        self._json = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PaymentRecord":
+        return cls(**{field: data[field] for field in FIELDS if field in data})
+
+    def __repr__(self) -> str:
+        return f"PaymentRecord({self.payment_id!r}, status={self.status.value!r})"
+
+    def update(self, **changes) -> None:
+        """Изменить поля (с приведением типов) и сбросить кэш"""
+        for field, value in changes.items():
+            if field not in FIELDS:
+                raise AttributeError(f"У платежа нет поля {field}")
+            if field in ("amount", "refunded_amount"):
+                value = _decimal(value)
+            elif field == "status":
+                value = PaymentStatus(value)
+            elif field == "payment_method":
+                value = PaymentMethod(value) if value else None
+            elif field in ("created_at", "updated_at"):
+                value = _datetime(value)
+            setattr(self, field, value)
+        # Версия меняется после полей: кэш, собранный по старой версии, не будет отдан
+        self._version += 1
+        self._dict = None
+        self._json = None
+
+    def to_dict(self) -> dict:
+        """Поля PaymentResponse (Decimal / datetime / перечисления); не изменять"""
+        cached = self._dict
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        version = self._version
+        data = {field: getattr(self, field) for field in FIELDS}
+        self._dict = (version, data)
+        return data
+
+    def to_json(self, dumps: Callable[[dict], str]) -> str:
+        """JSON ответа API; dumps - сериализатор приложения (app.json.dumps)"""
+        cached = self._json
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        version = self._version
+        body = dumps(self.to_dict())
+        self._json = (version, body)
+        return body
+
+    def to_response(self) -> PaymentResponse:
+        """Pydantic-модель (для событий брокера)"""
+        return PaymentResponse(**self.to_dict())
+
+
+def _decimal(value) -> Decimal:
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value)) if value is not None else Decimal("0")
+
+
+def _datetime(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
@@ -0,0 +1,151 @@
+"""
+Журнал возвратов по платежам
+
+Каждый возврат - запись журнала платежа (в том числе частичный, их может быть
+несколько). Для платежа хранятся текущие итоги: возвращено и зарезервировано
+возвратами, которые ещё выполняются в шлюзе, - поэтому остаток к возврату
+и статус платежа считаются за O(1), без перебора истории.
+
+Резерв берётся до запроса в шлюз под блокировкой журнала: два одновременных
+возврата не могут вместе превысить сумму платежа.
+
+Для выгрузок возвраты дополнительно индексируются по шлюзу и времени.
+"""
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, List, Optional
+
+from schemas.payment import PaymentStatus
+
+try:
+    from timeline import TimeIndex
+except ImportError:
+    from payment_service.timeline import TimeIndex
+
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class OverRefundError(ValueError):
+    """Сумма возврата больше остатка платежа"""
+
+
+def derive_status(amount: Decimal, refunded: Decimal, status: PaymentStatus) -> PaymentStatus:
+    """Статус платежа по итогам журнала возвратов"""
+    if refunded <= 0:
+        return status
+    if refunded >= amount:
+        return PaymentStatus.REFUNDED
+    return PaymentStatus.PARTIALLY_REFUNDED
+
+
+class RefundLedger:
+    """
+    payment_id -> возвраты и итоги {"refunded", "reserved"}.
+    on_change(payment_id, refunded) вызывается под блокировкой журнала после
+    каждого изменения возвращённой суммы - порядок обновлений платежа совпадает
+    с порядком изменений журнала.
+    """
+
+    def __init__(self, on_change: Optional[Callable[[str, Decimal], None]] = None):
+        self.on_change = on_change
+        self._refunds: Dict[str, List[dict]] = {}
+        self._totals: Dict[str, Dict[str, Decimal]] = {}
+        # шлюз -> возвраты по времени создания
+        self._by_time: Dict[str, TimeIndex] = {}
+        self._lock = threading.Lock()
+
+    def refunded(self, payment_id: str) -> Decimal:
+        totals = self._totals.get(payment_id)
+        return totals["refunded"] if totals else Decimal("0")
+
+    def available(self, payment_id: str, payment_amount: Decimal) -> Decimal:
+        """Сколько ещё можно вернуть (с учётом выполняющихся возвратов)"""
+        totals = self._totals.get(payment_id)
+        if not totals:
+            return payment_amount
+        return payment_amount - totals["refunded"] - totals["reserved"]
+
+    def list(self, payment_id: str) -> List[dict]:
+        with self._lock:
+            return [dict(refund) for refund in self._refunds.get(payment_id, ())]
+
+    def gateways(self) -> List[str]:
+        with self._lock:
+            return sorted(self._by_time)
+
+    def iter_between(
+        self, gateway: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> Iterator[dict]:
+        """Возвраты шлюза, созданные в [start, end), по времени (копии записей); None - без границы"""
+        index = self._by_time.get(gateway)
+        if index is None:
+            return
+        for refund in index.iter_between(start, end):
+            yield dict(refund)
+
+    def reserve(
+        self,
+        payment_id: str,
+        payment_amount: Decimal,
+        amount: Decimal,
+        reason: Optional[str] = None,
+        gateway: str = "",
+    ) -> dict:
+        """Записать возврат в статусе pending и зарезервировать сумму"""
+        if amount <= 0:
+            raise ValueError("Сумма возврата должна быть больше нуля")
+        with self._lock:
+            available = self.available(payment_id, payment_amount)
+            if amount > available:
+                raise OverRefundError(f"Сумма возврата {amount} больше остатка платежа {available}")
+            refund = {
+                "refund_id": str(uuid.uuid4()),
+                "payment_id": payment_id,
+                "amount": amount,
+                "status": PENDING,
+                "reason": reason,
+                "external_refund_id": None,
+                "gateway": gateway,
+                "timestamp": datetime.now(),
+            }
+            self._refunds.setdefault(payment_id, []).append(refund)
+            index = self._by_time.get(gateway)
+            if index is None:
+                index = self._by_time[gateway] = TimeIndex(self._lock)
+            index.add(refund["timestamp"].timestamp(), refund)
+            totals = self._totals.setdefault(payment_id, {"refunded": Decimal("0"), "reserved": Decimal("0")})
+            totals["reserved"] += amount
+            return dict(refund)
+
+    def complete(self, refund_id: str, payment_id: str, external_refund_id: Optional[str]) -> dict:
+        """Шлюз принял возврат: резерв переходит в возвращённую сумму"""
+        with self._lock:
+            refund = self._find(payment_id, refund_id)
+            refund["status"] = SUCCEEDED
+            refund["external_refund_id"] = external_refund_id
+            totals = self._totals[payment_id]
+            totals["reserved"] -= refund["amount"]
+            totals["refunded"] += refund["amount"]
+            if self.on_change:
+                self.on_change(payment_id, totals["refunded"])
+            return dict(refund)
+
+    def fail(self, refund_id: str, payment_id: str, error: str) -> dict:
+        """Шлюз отказал: резерв снимается"""
+        with self._lock:
+            refund = self._find(payment_id, refund_id)
+            refund["status"] = FAILED
+            refund["error"] = error
+            self._totals[payment_id]["reserved"] -= refund["amount"]
+            return dict(refund)
+
+    def _find(self, payment_id: str, refund_id: str) -> dict:
+        # Возвратов у платежа единицы - ищем с конца, там самые свежие
+        for refund in reversed(self._refunds.get(payment_id, ())):
+            if refund["refund_id"] == refund_id:
+                return refund
+        raise KeyError(f"Возврат {refund_id} не найден")
@@ -0,0 +1,50 @@
+"""
+Сводка для сверки расчётов со шлюзами (settlement)
+
+Итоги по (дата, шлюз) обновляются в момент события - успешной оплаты или
+возврата, поэтому отчёт строится из готовых сумм, а не пересчётом истории
+платежей и возвратов.
+"""
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+
+class SettlementReport:
+    """(дата, шлюз) -> число и сумма оплат и возвратов"""
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+
+    def record_payment(self, gateway: str, amount: Decimal, at: Optional[datetime] = None) -> None:
+        self._add(gateway, at, "payments", "gross", amount)
+
+    def record_refund(self, gateway: str, amount: Decimal, at: Optional[datetime] = None) -> None:
+        self._add(gateway, at, "refunds", "refunded", amount)
+
+    def report(self, day: Optional[date] = None, gateway: Optional[str] = None) -> dict:
+        """Итоги за день (или за всё время) по шлюзам и общий итог"""
+        day_key = day.isoformat() if day else None
+        rows = []
+        totals = {"payments": 0, "gross": Decimal("0"), "refunds": 0, "refunded": Decimal("0")}
+        with self._lock:
+            for (bucket_day, bucket_gateway), bucket in sorted(self._buckets.items()):
+                if day_key and bucket_day != day_key or gateway and bucket_gateway != gateway:
+                    continue
+                rows.append({"date": bucket_day, "gateway": bucket_gateway, **bucket, "net": bucket["gross"] - bucket["refunded"]})
+                for key in totals:
+                    totals[key] += bucket[key]
+        return {"rows": rows, "totals": {**totals, "net": totals["gross"] - totals["refunded"]}}
+
+    def _add(self, gateway: str, at: Optional[datetime], count_key: str, sum_key: str, amount: Decimal) -> None:
+        key = ((at or datetime.now()).date().isoformat(), gateway)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = {
+                    "payments": 0, "gross": Decimal("0"), "refunds": 0, "refunded": Decimal("0"),
+                }
+            bucket[count_key] += 1
+            bucket[sum_key] += amount
@@ -0,0 +1,295 @@
+"""
+In-memory хранилище платежей с вторичными индексами
+
+- по external_payment_id (id платежа в шлюзе) - поиск платежа при webhook-е за O(1);
+- по booking_id - все платежи бронирования;
+- по возрасту платежей в статусе pending и по времени следующей проверки
+  уже проверенных - сверка зависших платежей (PaymentReconciler) читает
+  только их, а не всю таблицу;
+- по шлюзу и времени создания (TimeIndex) - выгрузка за период читает
+  только свой диапазон, пачками и в порядке времени.
+
+Индексы (и кэш сериализации записи) обновляются в add() / update(), поэтому
+платежи нужно менять только через хранилище.
+"""
+import heapq
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    from record import PaymentRecord
+    from timeline import TimeIndex
+except ImportError:
+    from payment_service.record import PaymentRecord
+    from payment_service.timeline import TimeIndex
+
+# Поля платежа, по которым построены индексы
+INDEXED_FIELDS = ("external_payment_id", "booking_id")
+# Поля, по которым построен индекс по времени
+TIME_INDEXED_FIELDS = ("payment_method", "created_at")
+
+PENDING = "pending"
+
+
+class PaymentStore:
+    """Платежи (PaymentRecord) по payment_id + индексы по external_payment_id и booking_id"""
+
+    def __init__(self):
+        self._payments: Dict[str, PaymentRecord] = {}
+        self._by_external_id: Dict[str, str] = {}
+        # booking_id -> payment_id в порядке создания (dict как упорядоченное множество)
+        self._by_booking: Dict[str, Dict[str, None]] = {}
+        # payment_id -> created_at (timestamp) ещё не проверенных сверкой платежей в pending,
+        # в порядке добавления. Платежи добавляются при создании, поэтому порядок - по возрасту
+        self._pending: Dict[str, float] = {}
+        # Проверенные сверкой и оставшиеся в pending: payment_id -> [следующая проверка, попыток]
+        # и куча (следующая проверка, payment_id); устаревшие элементы кучи пропускаются
+        self._rechecks: Dict[str, list] = {}
+        self._recheck_heap: List[Tuple[float, str]] = []
+        # Сверка прекращена (попытки или возраст исчерпаны), платёж остался в pending
+        self._abandoned: Dict[str, None] = {}
+        self._lock = threading.RLock()
+        # шлюз -> payment_id по времени создания
+        self._by_time: Dict[str, TimeIndex] = {}
+
+    def __len__(self) -> int:
+        return len(self._payments)
+
+    def __contains__(self, payment_id: str) -> bool:
+        return payment_id in self._payments
+
+    def __iter__(self) -> Iterator[PaymentRecord]:
+        with self._lock:
+            return iter(list(self._payments.values()))
+
+    def get(self, payment_id: str) -> Optional[PaymentRecord]:
+        return self._payments.get(payment_id)
+
+    def add(self, payment: Union[PaymentRecord, dict]) -> PaymentRecord:
+        """Добавить платёж; dict разбирается в PaymentRecord"""
+        if isinstance(payment, dict):
+            payment = PaymentRecord.from_dict(payment)
+        with self._lock:
+            payment_id = payment.payment_id
+            if payment_id in self._payments:
+                self._unindex(self._payments[payment_id])
+                self._unindex_time(self._payments[payment_id])
+                self._unindex_pending(payment_id)
+            self._payments[payment_id] = payment
+            self._index(payment)
+            self._index_time(payment)
+            self._index_pending(payment)
+            return payment
+
+    def update(self, payment_id: str, **changes) -> Optional[PaymentRecord]:
+        """Изменить поля платежа; индексы перестраиваются, если изменились их поля"""
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment is None:
+                return None
+            reindex = any(
+                field in changes and changes[field] != getattr(payment, field) for field in INDEXED_FIELDS
+            )
+            retime = any(
+                field in changes and changes[field] != getattr(payment, field) for field in TIME_INDEXED_FIELDS
+            )
+            if reindex:
+                self._unindex(payment)
+            if retime:
+                self._unindex_time(payment)
+            payment.update(**changes)
+            if reindex:
+                self._index(payment)
+            if retime:
+                self._index_time(payment)
+            if "status" in changes:
+                self._index_pending(payment)
+            return payment
+
+    def compare_and_update(self, payment_id: str, expected_status: str, **changes) -> Optional[PaymentRecord]:
+        """
+        update(), только если статус платежа всё ещё expected_status; None - платежа нет
+        или статус уже изменил другой обработчик (webhook и сверка одного платежа)
+        """
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment is None or payment.status != expected_status:
+                return None
+            return self.update(payment_id, **changes)
+
+    def get_by_external_id(self, external_payment_id: str) -> Optional[PaymentRecord]:
+        payment_id = self._by_external_id.get(external_payment_id)
+        return self._payments.get(payment_id) if payment_id else None
+
+    def list_by_booking(self, booking_id: str) -> List[PaymentRecord]:
+        with self._lock:
+            return [self._payments[pid] for pid in self._by_booking.get(booking_id, ())]
+
+    def pending_older_than(self, cutoff: datetime, limit: Optional[int] = None) -> List[PaymentRecord]:
+        """
+        Ещё не проверенные сверкой платежи в pending, созданные раньше cutoff,
+        от самых старых. Обход индекса останавливается на первом более новом платеже.
+        """
+        cutoff_ts = cutoff.timestamp()
+        result = []
+        with self._lock:
+            for payment_id, created_ts in self._pending.items():
+                if created_ts >= cutoff_ts or (limit is not None and len(result) >= limit):
+                    break
+                result.append(self._payments[payment_id])
+        return result
+
+    def pending_due(self, cutoff: datetime, now: datetime, limit: Optional[int] = None) -> List[PaymentRecord]:
+        """
+        Платежи для прохода сверки в порядке срока проверки: не проверенные и
+        созданные раньше cutoff (срок - создание + (now - cutoff)) и проверенные
+        с наступившим временем следующей проверки
+        """
+        cutoff_ts = cutoff.timestamp()
+        now_ts = now.timestamp()
+        age = now_ts - cutoff_ts
+        with self._lock:
+            due_rechecks = []
+            while self._recheck_heap and self._recheck_heap[0][0] <= now_ts:
+                due_rechecks.append(heapq.heappop(self._recheck_heap))
+            # Просмотренное возвращается в кучу: срок меняет только reschedule_check()
+            for entry in due_rechecks:
+                heapq.heappush(self._recheck_heap, entry)
+            rechecks = iter(
+                (due, payment_id) for due, payment_id in due_rechecks
+                if self._rechecks.get(payment_id, (None,))[0] == due
+            )
+            fresh = iter(
+                (created_ts + age, payment_id) for payment_id, created_ts in self._pending.items()
+            )
+
+            result = []
+            recheck = next(rechecks, None)
+            new = next(fresh, None)
+            if new is not None and new[0] >= now_ts:
+                new = None
+            while (recheck is not None or new is not None) and (limit is None or len(result) < limit):
+                if new is None or (recheck is not None and recheck[0] <= new[0]):
+                    result.append(self._payments[recheck[1]])
+                    recheck = next(rechecks, None)
+                else:
+                    result.append(self._payments[new[1]])
+                    new = next(fresh, None)
+                    if new is not None and new[0] >= now_ts:
+                        new = None
+        return result
+
+    def check_attempts(self, payment_id: str) -> int:
+        """Сколько раз сверка проверила платёж и он остался в pending"""
+        recheck = self._rechecks.get(payment_id)
+        return recheck[1] if recheck is not None else 0
+
+    def reschedule_check(self, payment_id: str, next_check: Optional[datetime]) -> None:
+        """
+        Платёж проверен и остался в pending: следующая проверка - в next_check
+        (в конец очереди сверки); None - больше не проверять
+        """
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment is None or payment.status != PENDING or payment_id in self._abandoned:
+                return
+            attempts = self.check_attempts(payment_id) + 1
+            self._unindex_pending(payment_id)
+            if next_check is None:
+                self._abandoned[payment_id] = None
+                return
+            due = next_check.timestamp()
+            self._rechecks[payment_id] = [due, attempts]
+            heapq.heappush(self._recheck_heap, (due, payment_id))
+            if len(self._recheck_heap) > 2 * len(self._rechecks) + 64:
+                # Устаревших элементов больше, чем актуальных - куча пересобирается
+                self._recheck_heap = [(due, pid) for pid, (due, _) in self._rechecks.items()]
+                heapq.heapify(self._recheck_heap)
+
+    def request_check(self, payment_id: str, when: Optional[datetime] = None) -> bool:
+        """
+        Проверить платёж в pending при ближайшей сверке после when (по умолчанию -
+        сейчас), даже недавний или со сверкой, которая уже прекращена; счётчик
+        попыток сохраняется. False - платёж не в pending
+        """
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment is None or payment.status != PENDING:
+                return False
+            attempts = self.check_attempts(payment_id)
+            self._unindex_pending(payment_id)
+            due = (when or datetime.now()).timestamp()
+            self._rechecks[payment_id] = [due, attempts]
+            heapq.heappush(self._recheck_heap, (due, payment_id))
+        return True
+
+    def pending_count(self) -> int:
+        """Платежи в pending, которые ещё сверяются"""
+        return len(self._pending) + len(self._rechecks)
+
+    def abandoned_count(self) -> int:
+        """Платежи в pending, сверка которых прекращена"""
+        return len(self._abandoned)
+
+    def gateways(self) -> List[str]:
+        with self._lock:
+            return sorted(self._by_time)
+
+    def iter_created_between(
+        self, gateway: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> Iterator[PaymentRecord]:
+        """Платежи шлюза, созданные в [start, end), по времени создания; None - без границы"""
+        index = self._by_time.get(gateway)
+        if index is None:
+            return
+        for payment_id in index.iter_between(start, end):
+            payment = self._payments.get(payment_id)
+            if payment is not None:
+                yield payment
+
+    def _index_pending(self, payment: PaymentRecord) -> None:
+        payment_id = payment.payment_id
+        if payment.status != PENDING:
+            self._unindex_pending(payment_id)
+        elif payment_id not in self._pending and payment_id not in self._rechecks and payment_id not in self._abandoned:
+            self._pending[payment_id] = payment.created_at.timestamp()
+
+    def _unindex_pending(self, payment_id: str) -> None:
+        # Элемент кучи остаётся и пропускается в pending_due()
+        self._pending.pop(payment_id, None)
+        self._rechecks.pop(payment_id, None)
+        self._abandoned.pop(payment_id, None)
+
+    def _index_time(self, payment: PaymentRecord) -> None:
+        gateway = gateway_of(payment)
+        index = self._by_time.get(gateway)
+        if index is None:
+            index = self._by_time[gateway] = TimeIndex(self._lock)
+        index.add(payment.created_at.timestamp(), payment.payment_id)
+
+    def _unindex_time(self, payment: PaymentRecord) -> None:
+        index = self._by_time.get(gateway_of(payment))
+        if index is not None:
+            index.remove(payment.created_at.timestamp(), payment.payment_id)
+
+    def _index(self, payment: PaymentRecord) -> None:
+        if payment.external_payment_id:
+            self._by_external_id[payment.external_payment_id] = payment.payment_id
+        if payment.booking_id:
+            self._by_booking.setdefault(payment.booking_id, {})[payment.payment_id] = None
+
+    def _unindex(self, payment: PaymentRecord) -> None:
+        external_id = payment.external_payment_id
+        if external_id and self._by_external_id.get(external_id) == payment.payment_id:
+            del self._by_external_id[external_id]
+        booking_payments = self._by_booking.get(payment.booking_id)
+        if booking_payments is not None:
+            booking_payments.pop(payment.payment_id, None)
+            if not booking_payments:
+                del self._by_booking[payment.booking_id]
+
+
+def gateway_of(payment: PaymentRecord) -> str:
+    """Шлюз платежа (ключ индекса по времени); "" - шлюз не указан"""
+    return payment.payment_method.value if payment.payment_method else ""
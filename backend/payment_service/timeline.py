@@ -0,0 +1,68 @@
+"""
+Индекс по времени для выгрузок платежей и возвратов
+
+Метки времени хранятся в array("d") (8 байт на запись вместо объекта float),
+элементы - в параллельном списке; оба отсортированы по времени. Начало
+диапазона ищется бинарным поиском, обход идёт пачками: под блокировкой
+владельца копируется не больше batch_size элементов, поэтому выгрузка
+любого объёма занимает постоянную память и не держит блокировку надолго.
+
+Запись, вставленная в середину уже пройденного диапазона во время обхода,
+в выгрузку не попадает (или может сдвинуть на одну позицию соседнюю) -
+для выгрузки за закрытый период это не важно.
+"""
+import bisect
+import math
+from array import array
+from datetime import datetime
+from typing import Any, Iterator, List, Optional
+
+
+class TimeIndex:
+    """Отсортированные по времени (timestamp, элемент)"""
+
+    def __init__(self, lock, batch_size: int = 1000):
+        self._lock = lock
+        self._timestamps = array("d")
+        self._items: List[Any] = []
+        self.batch_size = batch_size
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, timestamp: float, item) -> None:
+        """Вызывается под блокировкой владельца; новые записи обычно идут в конец"""
+        if not self._timestamps or timestamp >= self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+            self._items.append(item)
+            return
+        position = bisect.bisect_right(self._timestamps, timestamp)
+        self._timestamps.insert(position, timestamp)
+        self._items.insert(position, item)
+
+    def remove(self, timestamp: float, item) -> None:
+        """Вызывается под блокировкой владельца"""
+        position = bisect.bisect_left(self._timestamps, timestamp)
+        while position < len(self._items) and self._timestamps[position] == timestamp:
+            if self._items[position] == item:
+                del self._timestamps[position]
+                del self._items[position]
+                return
+            position += 1
+
+    def iter_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[Any]:
+        """Элементы, добавленные с меткой start <= t < end, по возрастанию времени; None - без границы"""
+        start = start.timestamp() if start else -math.inf
+        end = end.timestamp() if end else math.inf
+        with self._lock:
+            position = bisect.bisect_left(self._timestamps, start)
+        while True:
+            with self._lock:
+                stop = min(position + self.batch_size, len(self._items))
+                if stop > position and self._timestamps[stop - 1] >= end:
+                    stop = bisect.bisect_left(self._timestamps, end, position, stop)
+                batch = self._items[position:stop]
+            if not batch:
+                return
+            yield from batch
+            position = stop
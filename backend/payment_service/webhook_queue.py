@@ -0,0 +1,287 @@
+"""
+Очередь приёма webhook-ов платёжных шлюзов
+
+Webhook записывается в журнал (fsync) и в очередь и только после этого
+подтверждается шлюзу; обновление платежа, подтверждение брони и публикацию
+события выполняет пул воркеров. Без журнала (каталог не задан) подтверждать
+до обработки нельзя - webhook потеряется при остановке: submit(wait=...)
+ждёт обработки и сообщает об ошибке (WebhookNotProcessed), шлюз повторит.
+
+Webhook, не обработанный за max_attempts попыток, не отмечается обработанным:
+шлюз уже получил 200 и повторять не будет. Он остаётся в журнале как
+dead-letter ({"op": "failed"}), переживает перезапуск, виден в dead_letters()
+и возвращается в очередь через replay(); on_failure - уведомление (сверка
+перепроверяет платёж).
+
+Порядок по платежу: webhook-и одного платежа (ключ - external_payment_id)
+всегда попадают в один и тот же шард и обрабатываются одним воркером по очереди.
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Callable, Optional
+
+from message_broker.metrics import Histogram
+
+JOURNAL_FILE = "webhooks.jsonl"
+
+
+class WebhookNotProcessed(Exception):
+    """Webhook не обработан за время ожидания или обработан с ошибкой"""
+
+
+class WebhookQueue:
+    """Шардированная очередь webhook-ов с журналом и метриками задержки"""
+
+    def __init__(
+        self,
+        handler: Callable[[dict], None],
+        workers: int = 4,
+        persistence_dir: Optional[str] = None,
+        max_attempts: int = 3,
+        retry_delay: float = 0.5,
+        compact_threshold: int = 10000,
+        fsync: bool = True,
+        on_failure: Optional[Callable[[dict, Exception], None]] = None,
+    ):
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.on_failure = on_failure
+        self._shards = [queue.Queue() for _ in range(max(1, workers))]
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_path = None
+        # Принятые, но ещё не обработанные webhook-и (для сжатия журнала)
+        self._pending: dict = {}
+        self._done_since_compact = 0
+        # Не обработанные после всех попыток: webhook_id -> {"record", "error", "failed_at"}
+        self._dead: dict = {}
+        # Ожидающие обработки submit(wait=...): webhook_id -> [событие, ошибка]
+        self._waiters: dict = {}
+
+        # Метрики
+        self.ingest_to_processed = Histogram()
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.recent_failures = deque(maxlen=100)
+
+        if persistence_dir:
+            os.makedirs(persistence_dir, exist_ok=True)
+            self._journal_path = os.path.join(persistence_dir, JOURNAL_FILE)
+            self._restore()
+
+    def start(self) -> None:
+        for i, shard in enumerate(self._shards):
+            threading.Thread(
+                target=self._run, args=(shard,), daemon=True, name=f"payment-webhook-{i}"
+            ).start()
+
+    @property
+    def persistent(self) -> bool:
+        return self._journal_path is not None
+
+    def submit(
+        self,
+        gateway: str,
+        ordering_key: str,
+        payload: dict,
+        signature: Optional[str] = None,
+        wait: Optional[float] = None,
+    ) -> str:
+        """
+        Принять webhook; возвращает его id сразу после записи в журнал.
+        wait - дождаться обработки (не дольше wait с), иначе WebhookNotProcessed
+        """
+        record = {
+            "webhook_id": str(uuid.uuid4()),
+            "gateway": gateway,
+            "key": ordering_key,
+            "payload": payload,
+            "signature": signature,
+            "received_at": time.time(),
+        }
+        waiter = [threading.Event(), None] if wait is not None else None
+        with self._lock:
+            self._write({"op": "add", "record": record}, sync=True)
+            self._pending[record["webhook_id"]] = record
+            self.received += 1
+            if waiter is not None:
+                self._waiters[record["webhook_id"]] = waiter
+            # Под той же блокировкой: порядок в шарде совпадает с порядком в журнале
+            self._shard_for(ordering_key).put(record)
+        if waiter is None:
+            return record["webhook_id"]
+
+        if not waiter[0].wait(wait):
+            # Обработка продолжится в очереди; повтор шлюза отсечёт идемпотентность
+            with self._lock:
+                self._waiters.pop(record["webhook_id"], None)
+            raise WebhookNotProcessed(f"Webhook {record['webhook_id']} не обработан за {wait} с")
+        if waiter[1] is not None:
+            raise WebhookNotProcessed(f"Webhook {record['webhook_id']} не обработан: {waiter[1]}")
+        return record["webhook_id"]
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._shards)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._shards),
+            "depth": self.depth(),
+            "shard_depths": [shard.qsize() for shard in self._shards],
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dead_letters": self.dead_letter_count(),
+            "persistent": self.persistent,
+            "ingest_to_processed": self.ingest_to_processed.summary(),
+            "recent_failures": list(self.recent_failures),
+        }
+
+    def dead_letter_count(self) -> int:
+        return len(self._dead)
+
+    def dead_letters(self, limit: int = 100) -> list:
+        """Не обработанные webhook-и (от самых старых): запись, ошибка, время отказа"""
+        with self._lock:
+            return [dict(entry) for entry in islice(self._dead.values(), limit)]
+
+    def replay(self, webhook_id: Optional[str] = None) -> int:
+        """Вернуть dead-letter (один или все) в очередь; возвращает число webhook-ов"""
+        with self._lock:
+            ids = [webhook_id] if webhook_id is not None else list(self._dead)
+            replayed = 0
+            for dead_id in ids:
+                entry = self._dead.pop(dead_id, None)
+                if entry is None:
+                    continue
+                record = entry["record"]
+                self._write({"op": "add", "record": record}, sync=True)
+                self._pending[dead_id] = record
+                self._shard_for(record["key"]).put(record)
+                replayed += 1
+        return replayed
+
+    def _shard_for(self, key: str) -> queue.Queue:
+        # Стабильный хеш (не hash()): после перезапуска шард тот же
+        digest = hashlib.blake2b((key or "").encode("utf-8"), digest_size=8).digest()
+        return self._shards[int.from_bytes(digest, "little") % len(self._shards)]
+
+    def _run(self, shard: queue.Queue) -> None:
+        while True:
+            record = shard.get()
+            error = None
+            for attempt in range(self.max_attempts):
+                try:
+                    self.handler(record)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    # Повтор в том же воркере: следующие webhook-и платежа ждут
+                    if attempt + 1 < self.max_attempts:
+                        time.sleep(self.retry_delay * (2 ** attempt))
+
+            self.ingest_to_processed.observe(time.time() - record["received_at"])
+            with self._lock:
+                if error is None:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                    self.recent_failures.append({
+                        "webhook_id": record["webhook_id"],
+                        "gateway": record["gateway"],
+                        "key": record["key"],
+                        "error": str(error),
+                    })
+                    print(f"❌ Webhook {record['webhook_id']} не обработан: {error}")
+                self._pending.pop(record["webhook_id"], None)
+                waiter = self._waiters.pop(record["webhook_id"], None)
+                if waiter is not None:
+                    waiter[1] = error
+                    waiter[0].set()
+                if error is not None and self.persistent:
+                    # Шлюз получил 200 и не повторит: webhook остаётся в журнале
+                    dead = {"record": record, "error": str(error), "failed_at": time.time()}
+                    self._dead[record["webhook_id"]] = dead
+                    self._write({"op": "failed", "id": record["webhook_id"], "error": dead["error"],
+                                 "failed_at": dead["failed_at"]}, sync=True)
+                else:
+                    # Потерянная отметка "done" - повтор обработки (идемпотентной), fsync не нужен
+                    self._write({"op": "done", "id": record["webhook_id"]})
+                self._done_since_compact += 1
+                if self._journal_path and self._done_since_compact >= self.compact_threshold:
+                    self._compact()
+            if error is not None and self.on_failure is not None:
+                try:
+                    self.on_failure(record, error)
+                except Exception as e:
+                    print(f"⚠️ Обработчик отказа webhook-а {record['webhook_id']}: {e}")
+
+    def _write(self, record: dict, sync: bool = False) -> None:
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if sync and self.fsync:
+            # Шлюз получит 200 только после записи на диск: при сбое питания webhook не теряется
+            os.fsync(self._journal.fileno())
+
+    def _restore(self) -> None:
+        """Вернуть в очередь webhook-и, принятые до перезапуска, но не обработанные"""
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Недописанная последняя строка после аварийной остановки
+                        continue
+                    if entry.get("op") == "add":
+                        # Повторное "add" того же webhook-а - replay() dead-letter-а
+                        self._dead.pop(entry["record"]["webhook_id"], None)
+                        self._pending[entry["record"]["webhook_id"]] = entry["record"]
+                    elif entry.get("op") == "done":
+                        self._pending.pop(entry.get("id"), None)
+                    elif entry.get("op") == "failed":
+                        record = self._pending.pop(entry.get("id"), None)
+                        if record is not None:
+                            self._dead[record["webhook_id"]] = {
+                                "record": record, "error": entry.get("error"), "failed_at": entry.get("failed_at"),
+                            }
+
+        # Записи журнала идут в порядке приёма - порядок по платежу сохраняется
+        for record in self._pending.values():
+            self._shard_for(record["key"]).put(record)
+        self._compact()
+        if self._pending:
+            print(f"ℹ️ Восстановлено необработанных webhook-ов: {len(self._pending)}")
+        if self._dead:
+            print(f"⚠️ В журнале не обработанных после всех попыток webhook-ов: {len(self._dead)}")
+
+    def _compact(self) -> None:
+        """Переписать журнал, оставив только необработанные webhook-и и dead-letter-ы"""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self._journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self._dead.values():
+                f.write(json.dumps({"op": "add", "record": entry["record"]}, ensure_ascii=False) + "\n")
+                failed = {"op": "failed", "id": entry["record"]["webhook_id"], "error": entry["error"],
+                          "failed_at": entry["failed_at"]}
+                f.write(json.dumps(failed, ensure_ascii=False) + "\n")
+            for record in self._pending.values():
+                f.write(json.dumps({"op": "add", "record": record}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+        self._done_since_compact = 0
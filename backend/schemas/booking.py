@@ -72,6 +72,7 @@ class BookingConfirmedEvent(BaseModel):
 class BookingCancelledEvent(BaseModel):
     event_type: str = "booking.cancelled"
     booking_id: str
+    hall_id: Optional[str] = None
     reason: Optional[str] = None
     timestamp: datetime
 
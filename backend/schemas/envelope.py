@@ -0,0 +1,205 @@
+"""
+Компактный конверт сообщений брокера (версия 1)
+
+Поля конверта:
+    v  - версия формата
+    id - message_id
+    t  - тип события
+    s  - сервис-источник
+    ts - время публикации, unix-время в миллисекундах
+    d  - данные события (без дублирования event_type / source_service)
+    z  - вместо d: сжатые zlib данные (для крупных payload)
+
+Кодировки выбираются по Content-Type:
+    application/vnd.photostudio.event.v1+json     - JSON (z передаётся в base64)
+    application/vnd.photostudio.event.v1+msgpack  - MessagePack (нужен пакет msgpack)
+Прежний формат (application/json c event_type на верхнем уровне) принимается для совместимости.
+"""
+import base64
+import json
+import time
+import uuid
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Optional
+
+try:
+    import msgpack
+except ImportError:  # двоичная кодировка - опциональна
+    msgpack = None
+
+ENVELOPE_VERSION = 1
+
+CONTENT_TYPE_JSON = "application/vnd.photostudio.event.v1+json"
+CONTENT_TYPE_MSGPACK = "application/vnd.photostudio.event.v1+msgpack"
+CONTENT_TYPE_LEGACY = "application/json"
+
+# Данные крупнее порога (в байтах после сериализации) сжимаются
+COMPRESS_THRESHOLD = 4096
+
+# Параметры публикации, которые не являются данными события
+# (idempotency_key - ключ производителя для дедупликации повторных публикаций)
+PUBLISH_OPTIONS = ("deliver_at", "delay_ms", "idempotency_key")
+
+
+class EnvelopeError(ValueError):
+    """Некорректный или неподдерживаемый конверт"""
+
+
+class UnsupportedContentType(EnvelopeError):
+    """Кодировка не поддерживается (неизвестный Content-Type или нет msgpack)"""
+
+
+def make_envelope(
+    event_type: str,
+    data: dict,
+    source_service: str = "unknown",
+    message_id: Optional[str] = None,
+    timestamp_ms: Optional[int] = None,
+) -> dict:
+    return {
+        "v": ENVELOPE_VERSION,
+        "id": message_id or str(uuid.uuid4()),
+        "t": event_type,
+        "s": source_service,
+        "ts": timestamp_ms if timestamp_ms is not None else int(time.time() * 1000),
+        "d": data,
+    }
+
+
+def from_event(event: dict, source_service: str = "unknown") -> dict:
+    """
+    Конверт из события в прежнем виде сервисов:
+    {"event_type": ..., "payload": {...}} или {"event_type": ..., <поля события>}.
+    Параметры публикации (deliver_at / delay_ms / idempotency_key) переносятся в конверт как есть.
+    """
+    event_type = event.get("event_type")
+    if not event_type:
+        raise EnvelopeError("event_type is required")
+
+    skip = ("event_type", "source_service") + PUBLISH_OPTIONS
+    if isinstance(event.get("payload"), dict):
+        data = event["payload"]
+    else:
+        data = {k: v for k, v in event.items() if k not in skip}
+
+    envelope = make_envelope(
+        event_type,
+        data,
+        event.get("source_service") or source_service,
+        # Сообщение брокера прежней версии уже несёт message_id
+        message_id=event.get("message_id"),
+    )
+    for option in PUBLISH_OPTIONS:
+        if event.get(option) is not None:
+            envelope[option] = event[option]
+    return envelope
+
+
+def to_message(envelope: dict) -> dict:
+    """Представление для обработчиков сервисов (поля как у /broker/consume раньше)"""
+    return {
+        "message_id": envelope["id"],
+        "event_type": envelope["t"],
+        "source_service": envelope["s"],
+        "payload": envelope["d"],
+        "timestamp": datetime.fromtimestamp(envelope["ts"] / 1000).isoformat(),
+    }
+
+
+def to_jsonable(obj: Any) -> Any:
+    """Привести datetime / Decimal / Enum к JSON-типам без кодирования в строку JSON"""
+    if isinstance(obj, dict):
+        return {k: to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    return _json_default(obj) if isinstance(obj, (datetime, date, Decimal, Enum)) else obj
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def binary_supported() -> bool:
+    return msgpack is not None
+
+
+def encode(
+    envelope: dict,
+    content_type: str = CONTENT_TYPE_JSON,
+    compress_threshold: int = COMPRESS_THRESHOLD,
+) -> bytes:
+    """Сериализация конверта; данные сериализуются один раз"""
+    header = {k: v for k, v in envelope.items() if k != "d"}
+
+    if content_type == CONTENT_TYPE_MSGPACK:
+        if msgpack is None:
+            raise UnsupportedContentType("msgpack не установлен")
+        body = msgpack.packb(envelope, default=_json_default)
+        if len(body) <= compress_threshold:
+            return body
+        header["z"] = zlib.compress(msgpack.packb(envelope["d"], default=_json_default))
+        return msgpack.packb(header, default=_json_default)
+
+    data = json.dumps(envelope["d"], ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    if len(data) > compress_threshold:
+        header["z"] = base64.b64encode(zlib.compress(data.encode("utf-8"))).decode("ascii")
+        return json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    head = json.dumps(header, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    return (head[:-1] + ',"d":' + data + "}").encode("utf-8")
+
+
+def decode(body: bytes, content_type: Optional[str] = None) -> dict:
+    """
+    Разбор тела запроса в конверт.
+    Прежний формат (обычный JSON с event_type) преобразуется через from_event.
+    """
+    media_type = (content_type or CONTENT_TYPE_LEGACY).split(";")[0].strip().lower()
+
+    if media_type == CONTENT_TYPE_MSGPACK:
+        if msgpack is None:
+            raise UnsupportedContentType("msgpack не установлен")
+        envelope = msgpack.unpackb(body, raw=False)
+        if "z" in envelope:
+            envelope["d"] = msgpack.unpackb(zlib.decompress(envelope.pop("z")), raw=False)
+    elif media_type in (CONTENT_TYPE_JSON, CONTENT_TYPE_LEGACY):
+        try:
+            envelope = json.loads(body or b"null")
+        except ValueError as e:
+            raise EnvelopeError(f"Невалидный JSON: {e}")
+        if not isinstance(envelope, dict):
+            raise EnvelopeError("No data provided")
+        if "v" not in envelope:
+            return from_event(envelope)
+        if "z" in envelope:
+            envelope["d"] = json.loads(zlib.decompress(base64.b64decode(envelope.pop("z"))))
+    else:
+        raise UnsupportedContentType(f"Неподдерживаемый Content-Type: {content_type}")
+
+    if envelope.get("v") != ENVELOPE_VERSION:
+        raise EnvelopeError(f"Неподдерживаемая версия конверта: {envelope.get('v')}")
+    if not envelope.get("t"):
+        raise EnvelopeError("event_type is required")
+    envelope.setdefault("d", {})
+    return envelope
+
+
+def decode_message(body: bytes, content_type: Optional[str] = None) -> dict:
+    """Тело /broker/consume -> сообщение для обработчика сервиса"""
+    return to_message(decode(body, content_type))
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Выбор кодировки доставки по предпочтению подписчика"""
+    if accept and CONTENT_TYPE_MSGPACK in accept and binary_supported():
+        return CONTENT_TYPE_MSGPACK
+    return CONTENT_TYPE_JSON
+
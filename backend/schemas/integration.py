@@ -15,7 +15,7 @@ class MessageType(str, Enum):
 
 class IntegrationMessage(BaseModel):
     message_id: str
-    message_type: MessageType
+    message_type: MessageType = MessageType.EVENT
     source_service: str
     target_service: Optional[str] = None
     event_type: Optional[str] = None
@@ -12,6 +12,7 @@ class PaymentStatus(str, Enum):
     PENDING = "pending"
     SUCCEEDED = "succeeded"
     FAILED = "failed"
+    PARTIALLY_REFUNDED = "partially_refunded"  # Возвращена часть суммы
     REFUNDED = "refunded"
 
 
@@ -44,6 +45,7 @@ class PaymentResponse(BaseModel):
     external_payment_id: Optional[str] = None  # ID из платежного шлюза
     created_at: datetime
     updated_at: Optional[datetime] = None
+    refunded_amount: Decimal = Decimal("0")  # Сумма успешных возвратов
 
 
 class PaymentWebhook(BaseModel):
@@ -83,4 +85,6 @@ class RefundResponse(BaseModel):
     amount: Decimal
     status: str
     timestamp: datetime
+    reason: Optional[str] = None
+    external_refund_id: Optional[str] = None  # ID возврата в платежном шлюзе
 
@@ -0,0 +1,49 @@
+"""
+Запуск всех сервисов в одном процессе (однопроцессная установка)
+
+Брокер встраивается в процесс (BROKER_TRANSPORT=inprocess): сервисы публикуют
+события вызовом функции, а брокер вызывает обработчики Integration и
+Notification Service напрямую - без HTTP-хопов и JSON-кодирования.
+HTTP API каждого сервиса доступен на прежних портах.
+"""
+import importlib
+import os
+import sys
+import threading
+
+os.environ.setdefault("BROKER_TRANSPORT", "inprocess")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from werkzeug.serving import make_server
+
+# Модуль сервиса -> порт
+SERVICES = [
+    ("message_broker.main", int(os.getenv("BROKER_PORT", 5050))),
+    ("integration_service.main", int(os.getenv("INTEGRATION_PORT", 5003))),
+    ("notification_service.main", int(os.getenv("NOTIFICATION_PORT", 5004))),
+    ("booking_service.main", int(os.getenv("BOOKING_PORT", 5001))),
+    ("payment_service.main", int(os.getenv("PAYMENT_PORT", 5002))),
+    ("api_gateway.main", int(os.getenv("GATEWAY_PORT", 5000))),
+]
+
+
+def main():
+    servers = []
+    for module_name, port in SERVICES:
+        module = importlib.import_module(module_name)
+        server = make_server("0.0.0.0", port, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True, name=module_name).start()
+        servers.append(server)
+        print(f"🚀 {module_name} на порту {port}")
+
+    print(f"Транспорт брокера: {os.environ['BROKER_TRANSPORT']}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Модульные тесты API Gateway: сквозной прокси к сервису, поднятому в тесте,
+и кэш ответов
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_gateway import main as gateway
+from api_gateway.async_gateway import serve
+from api_gateway.cache import ResponseCache
+from api_gateway.coalesce import AsyncSingleFlight, SingleFlight
+from api_gateway.ratelimit import RateLimiter, TokenBuckets
+
+upstream_app = Flask("upstream")
+upstream_calls = {"bookings": 0, "availability": 0}
+
+
+@upstream_app.route("/api/bookings/availability")
+def upstream_availability():
+    upstream_calls["availability"] += 1
+    time.sleep(0.3)
+    return {"hall_id": request.args.get("hall_id"), "slots": [], "read": upstream_calls["availability"]}
+
+
+@upstream_app.route("/api/bookings/<booking_id>")
+def upstream_booking(booking_id: str):
+    if booking_id == "missing":
+        return {"error": "Бронирование не найдено"}, 404
+    if booking_id.startswith("slow"):
+        time.sleep(0.3)
+    upstream_calls["bookings"] += 1
+    return {"booking_id": booking_id, "hall_id": "hall-001", "read": upstream_calls["bookings"]}
+
+
+@upstream_app.route("/api/payments", methods=["GET", "POST"])
+def upstream_payments():
+    if request.method == "POST":
+        return {"payment_id": "p9", "booking_id": request.get_json()["booking_id"]}, 201
+    if request.args["booking_id"].startswith("slow"):
+        time.sleep(0.3)
+    return {"booking_id": request.args["booking_id"], "payments": [{"payment_id": "p1"}]}
+
+
+@upstream_app.route("/api/notifications")
+def upstream_notifications():
+    time.sleep(0.3)
+    return {"notifications": [dict(request.args)], "total": 1}
+
+
+@upstream_app.route("/api/payments/export")
+def upstream_export():
+    rows = (f"payment,p{i},{'x' * 100}\n" for i in range(2000))
+    return Response(rows, mimetype="text/csv", headers={"X-Export-Rows": "2000"})
+
+
+@upstream_app.route("/api/payments/<payment_id>/refund", methods=["POST"])
+def upstream_refund(payment_id: str):
+    return Response(
+        request.get_data(),
+        status=400,
+        content_type=request.content_type,
+        headers={"X-Query": request.query_string.decode(), "Access-Control-Allow-Origin": "upstream"},
+    )
+
+
+@upstream_app.route("/api/payments/<payment_id>")
+def upstream_payment(payment_id: str):
+    if payment_id == "slow":
+        time.sleep(1)
+    return {"payment_id": payment_id}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    server = make_server("127.0.0.1", 0, upstream_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(gateway, "PAYMENT_SERVICE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(gateway, "BOOKING_SERVICE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(gateway, "NOTIFICATION_SERVICE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(gateway, "rate_limiter", None)
+    gateway.gateway_cache.cache.clear()
+    yield server
+    server.shutdown()
+
+
+def test_proxy_passes_body_status_and_headers_through(upstream):
+    client = gateway.app.test_client()
+    body = b'{"amount": 1.10, "reason": "\xd0\xbe\xd1\x82\xd0\xbc\xd0\xb5\xd0\xbd\xd0\xb0"}'
+    response = client.post("/api/payments/p1/refund?x=1", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert response.data == body, "Тело передаётся без разбора и повторной сериализации"
+    assert response.headers["X-Query"] == "x=1"
+    assert response.headers["Access-Control-Allow-Origin"] != "upstream", "CORS - заголовки gateway"
+
+
+def test_proxy_streams_non_json_bodies_without_truncation(upstream):
+    response = gateway.app.test_client().get("/api/payments/export?format=csv")
+    assert response.status_code == 200 and response.mimetype == "text/csv"
+    assert response.headers["X-Export-Rows"] == "2000"
+    assert "Transfer-Encoding" not in response.headers
+    assert len(response.data.splitlines()) == 2000
+
+
+def test_proxy_returns_502_when_service_is_down(monkeypatch):
+    monkeypatch.setattr(gateway, "PAYMENT_SERVICE_URL", "http://127.0.0.1:9")
+    response = gateway.app.test_client().get("/api/payments/p1")
+    assert response.status_code == 502 and "error" in response.get_json()
+
+
+def test_asyncio_mode_serves_the_same_routes(upstream):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(serve(gateway.app.url_map, gateway.upstreams(), "127.0.0.1", port, timeout=0.3))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{port}"
+    session = requests.Session()
+    for _ in range(50):
+        try:
+            session.get(f"{base}/health")
+            break
+        except requests.ConnectionError:
+            time.sleep(0.05)
+
+    try:
+        body = b'{"amount": 100}'
+        refund = session.post(f"{base}/api/payments/p1/refund?x=1", data=body, headers={"Content-Type": "application/json"})
+        assert (refund.status_code, refund.content, refund.headers["X-Query"]) == (400, body, "x=1")
+
+        export = session.get(f"{base}/api/payments/export")
+        assert len(export.content.splitlines()) == 2000, "Ответ без Content-Length передаётся chunked"
+
+        assert session.get(f"{base}/api/payments/p1").json() == {"payment_id": "p1"}
+        assert session.get(f"{base}/api/payments/slow").status_code == 504
+        assert session.get(f"{base}/api/unknown").status_code == 404
+        assert session.delete(f"{base}/api/payments/p1").status_code == 405
+        stats = session.get(f"{base}/health").json()["upstreams"]["/api/payments"]
+        assert stats["timeouts"] == 1 and stats["in_flight"] == 0
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+
+
+def test_response_cache_evicts_least_recently_used_and_expired_entries():
+    now = [0.0]
+    cache = ResponseCache(max_entries=2, clock=lambda: now[0])
+    for key in ("a", "b"):
+        assert cache.put(key, "route", 200, [], b"x", ttl=10, tags=[f"tag:{key}"], epoch=cache.epoch)
+    assert cache.get("a", "route") is not None
+    cache.put("c", "route", 200, [], b"x", ttl=1, tags=[], epoch=cache.epoch)
+    assert cache.get("b", "route") is None, "Вытесняется давно не читавшаяся запись"
+    now[0] = 5
+    assert cache.get("c", "route") is None and cache.get("a", "route") is not None
+
+    epoch = cache.epoch
+    assert cache.invalidate(["tag:a"]) == 1
+    assert not cache.put("a", "route", 200, [], b"x", ttl=10, tags=[], epoch=epoch), (
+        "Ответ, запрошенный до инвалидации, не кэшируется"
+    )
+    stats = cache.stats()
+    assert (stats["evictions"], stats["expirations"], stats["entries"], stats["bytes"]) == (1, 1, 0, 0)
+    assert stats["routes"]["route"] == {"hits": 2, "misses": 2, "hit_ratio": 0.5}
+
+
+def test_cache_is_invalidated_by_broker_events_and_writes(upstream):
+    client = gateway.app.test_client()
+    first = client.get("/api/bookings/b1")
+    second = client.get("/api/bookings/b1")
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("MISS", "HIT")
+    assert second.get_json() == first.get_json()
+
+    # Событие о другой брони ничего не сбрасывает, о своей - сбрасывает
+    client.post("/broker/consume", json={"event_type": "booking.cancelled", "payload": {"booking_id": "b2", "hall_id": "h"}})
+    assert client.get("/api/bookings/b1").headers["X-Cache"] == "HIT"
+    client.post("/broker/consume", json={"event_type": "booking.confirmed", "payload": {"booking_id": "b1"}})
+    assert client.get("/api/bookings/b1").headers["X-Cache"] == "MISS"
+
+    # Новый платёж через gateway сбрасывает список платежей бронирования
+    assert client.get("/api/payments?booking_id=b1").headers["X-Cache"] == "MISS"
+    assert client.get("/api/payments?booking_id=b1").headers["X-Cache"] == "HIT"
+    assert client.post("/api/payments", json={"booking_id": "b1"}).status_code == 201
+    assert client.get("/api/payments?booking_id=b1").headers["X-Cache"] == "MISS"
+
+    # Смена статуса платежа из списка - тоже
+    client.post("/broker/consume", json={"event_type": "payment.failed", "payload": {"payment_id": "p1", "booking_id": "b0"}})
+    assert client.get("/api/payments?booking_id=b1").headers["X-Cache"] == "MISS"
+
+    stats = client.get("/gateway/cache").get_json()
+    assert stats["routes"]["gw_booking_item"] == {"hits": 2, "misses": 2, "hit_ratio": 0.5}
+    assert stats["events"] == 3 and stats["entries"] == 2 and stats["bytes"] > 0
+
+
+def _start_async_gateway(**kwargs) -> str:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    loop.create_task(serve(gateway.app.url_map, gateway.upstreams(), "127.0.0.1", port, **kwargs))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(50):
+        try:
+            requests.get(f"{base}/health")
+            break
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    return base
+
+
+def test_identical_concurrent_reads_share_one_upstream_call(upstream, monkeypatch):
+    monkeypatch.setattr(gateway, "gateway_cache", None)
+    monkeypatch.setattr(gateway, "coalescer", SingleFlight(2**20, gateway.coalesced_total))
+    upstream_calls["availability"] = 0
+    clients = 20
+    barrier = threading.Barrier(clients)
+
+    def fetch(_):
+        barrier.wait()
+        return gateway.app.test_client().get("/api/bookings/availability?hall_id=hall-001")
+
+    with ThreadPoolExecutor(clients) as pool:
+        responses = list(pool.map(fetch, range(clients)))
+
+    assert upstream_calls["availability"] == 1
+    assert all(r.status_code == 200 and r.get_json()["read"] == 1 for r in responses)
+    assert sum(r.headers.get("X-Coalesced") == "1" for r in responses) == clients - 1
+
+    stats = gateway.app.test_client().get("/gateway/coalescing").get_json()
+    assert stats["routes"]["gw_bookings_availability"]["ratio"] == 0.95 and stats["in_flight"] == 0
+    text = gateway.app.test_client().get("/metrics").get_data(as_text=True)
+    assert 'gateway_coalescing_ratio{route="gw_bookings_availability"} 0.95' in text
+
+    # Другой зал - другой запрос
+    other = gateway.app.test_client().get("/api/bookings/availability?hall_id=hall-002")
+    assert other.get_json()["read"] == 2 and "X-Coalesced" not in other.headers
+
+
+def test_asyncio_mode_coalesces_identical_reads(upstream):
+    upstream_calls["availability"] = 0
+    base = _start_async_gateway(coalescer=AsyncSingleFlight(), read_routes=gateway.READ_ROUTES)
+    with ThreadPoolExecutor(10) as pool:
+        responses = list(pool.map(lambda _: requests.get(f"{base}/api/bookings/availability"), range(10)))
+
+    assert upstream_calls["availability"] == 1
+    assert all(r.status_code == 200 and r.json()["read"] == 1 for r in responses)
+    assert requests.get(f"{base}/health").json()["coalescing"]["follower"] == 9
+
+
+def test_token_buckets_refill_lazily_and_stay_bounded():
+    now = [0.0]
+    buckets = TokenBuckets(rate=2, burst=2, max_keys=2, clock=lambda: now[0])
+    assert (buckets.take("a"), buckets.take("a"), buckets.take("a")) == (0, 0, 0.5)
+    now[0] = 0.5
+    assert buckets.take("a") == 0, "За 0.5 с при 2 токенах/с начислен один токен"
+    buckets.take("b")
+    buckets.take("c")
+    assert len(buckets) == 2 and buckets.evictions == 1
+
+
+def test_rate_limit_and_load_shedding_return_retry_after(upstream, monkeypatch):
+    monkeypatch.setattr(gateway, "GATEWAY_CLIENT_ID_HEADER", "X-Forwarded-For")
+    monkeypatch.setattr(gateway, "rate_limiter", RateLimiter(0, 0, {"gw_get_payment": (0.5, 2)}))
+    client = gateway.app.test_client()
+    statuses = [client.get("/api/payments/p1", headers={"X-Forwarded-For": "10.0.0.1"}) for _ in range(3)]
+    assert [r.status_code for r in statuses] == [200, 200, 429]
+    assert statuses[-1].headers["Retry-After"] == "2"
+    assert client.get("/api/payments/p1", headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+    assert client.get("/health").status_code == 200, "Служебные маршруты не лимитируются"
+
+    # Один слот к сервису без очереди: второй одновременный запрос сбрасывается
+    monkeypatch.setattr(gateway, "rate_limiter", None)
+    monkeypatch.setattr(gateway, "admissions", {})
+    monkeypatch.setattr(gateway, "GATEWAY_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(gateway, "GATEWAY_QUEUE_SIZE", 0)
+    with ThreadPoolExecutor(1) as pool:
+        slow = pool.submit(lambda: gateway.app.test_client().get("/api/payments/slow"))
+        time.sleep(0.3)
+        shed = client.get("/api/payments/p2")
+        assert slow.result().status_code == 200
+    assert shed.status_code == 503 and shed.headers["Retry-After"] == "1"
+    assert gateway.app.test_client().get("/gateway/limits").get_json()["upstreams"][gateway.PAYMENT_SERVICE_URL]["shed"] == 1
+
+
+def test_asyncio_mode_limits_clients_and_sheds_load(upstream):
+    limiter = RateLimiter(0, 0, {"gw_list_refunds": (1, 1)})
+    base = _start_async_gateway(limit=1, queue=0, timeout=2, limiter=limiter)
+    assert requests.get(f"{base}/api/payments/p1/refunds").status_code == 404
+    limited = requests.get(f"{base}/api/payments/p1/refunds")
+    assert limited.status_code == 429 and limited.headers["Retry-After"] == "1"
+
+    with ThreadPoolExecutor(1) as pool:
+        slow = pool.submit(requests.get, f"{base}/api/payments/slow")
+        time.sleep(0.3)
+        shed = requests.get(f"{base}/api/payments/p2")
+        assert slow.result().status_code == 200
+    assert shed.status_code == 503 and shed.headers["Retry-After"] == "1"
+    assert requests.get(f"{base}/health").json()["upstreams"]["/api/payments"]["shed"] == 1
+
+
+def test_booking_details_fetches_parts_in_parallel_with_partial_failure(upstream, monkeypatch):
+    client = gateway.app.test_client()
+    started = time.perf_counter()
+    details = client.get("/api/bookings/slow-1/details")
+    assert time.perf_counter() - started < 0.6, "Три части по 0.3 с - одновременно, а не 0.9 с"
+    data = details.get_json()
+    assert details.status_code == 200 and data["partial"] is False and data["errors"] == {}
+    assert data["booking"]["booking_id"] == "slow-1" and data["payments"] == [{"payment_id": "p1"}]
+    assert data["notifications"] == [{"booking_id": "slow-1", "limit": "10"}]
+    # Бронь и платежи - через кэш отдельных маршрутов
+    assert client.get("/api/bookings/slow-1").headers["X-Cache"] == "HIT"
+    assert client.get("/api/payments?booking_id=slow-1").headers["X-Cache"] == "HIT"
+
+    monkeypatch.setattr(gateway, "NOTIFICATION_SERVICE_URL", "http://127.0.0.1:9")
+    partial = client.get("/api/bookings/b2/details").get_json()
+    assert partial["partial"] is True and partial["notifications"] is None
+    assert partial["errors"]["notifications"]["status"] == 502 and partial["booking"]["booking_id"] == "b2"
+    assert client.get("/api/bookings/missing/details").status_code == 404, "Без брони составного ответа нет"
+
+
+def test_asyncio_mode_serves_booking_details(upstream, monkeypatch):
+    base = _start_async_gateway(cache=gateway.gateway_cache, aggregates=gateway.aggregate_endpoints(), aggregate_timeout=0.2)
+    details = requests.get(f"{base}/api/bookings/b3/details?notifications_limit=5").json()
+    assert details["booking"]["booking_id"] == "b3" and details["payments"] == [{"payment_id": "p1"}]
+    assert details["partial"] is True and details["errors"]["notifications"]["status"] == 504, "Часть дольше таймаута"
+    assert requests.get(f"{base}/api/bookings/missing/details").status_code == 404
+    stats = requests.get(f"{base}/health").json()["upstreams"]
+    assert all(upstream["in_flight"] == 0 for upstream in stats.values())
+
+
+def test_broker_consume_is_accepted_only_from_the_broker(monkeypatch):
+    client = gateway.app.test_client()
+    event = {"event_type": "booking.confirmed", "payload": {"booking_id": "b1"}}
+    remote = {"REMOTE_ADDR": "203.0.113.7"}
+    assert client.post("/broker/consume", json=event, environ_base=remote).status_code == 403
+    assert client.post("/broker/consume", json=event).status_code == 200, "Без секрета - только с локального адреса"
+
+    monkeypatch.setattr(gateway, "BROKER_CONSUME_TOKEN", "s3cret")
+    assert client.post("/broker/consume", json=event).status_code == 403
+    assert client.post("/broker/consume", json=event, headers={"X-Broker-Token": "wrong"}).status_code == 403
+    allowed = client.post("/broker/consume", json=event, headers={"X-Broker-Token": "s3cret"}, environ_base=remote)
+    assert allowed.status_code == 200
+
+    base = _start_async_gateway(local=gateway.local_endpoints(), authorize=gateway.authorize)
+    assert requests.post(f"{base}/broker/consume", json=event).status_code == 403
+    assert requests.post(f"{base}/broker/consume", json=event, headers={"X-Broker-Token": "s3cret"}).status_code == 200
+    assert requests.get(f"{base}/gateway/cache").status_code == 200
+
+
+def test_cache_entries_are_not_shared_between_credentials(upstream):
+    client = gateway.app.test_client()
+
+    def cache_status(path, **headers):
+        return client.get(path, headers=headers).headers["X-Cache"]
+
+    assert cache_status("/api/bookings/b-auth", Authorization="Bearer alice") == "MISS"
+    assert cache_status("/api/bookings/b-auth", Authorization="Bearer alice") == "HIT"
+    assert cache_status("/api/bookings/b-auth", Authorization="Bearer bob") == "MISS", (
+        "Ответ, полученный с чужими учётными данными, не отдаётся из кэша"
+    )
+    assert cache_status("/api/bookings/b-auth") == "MISS"
+    assert cache_status("/api/bookings/b-auth", Authorization="Bearer alice", Accept="text/csv") == "MISS"
+
+    base = _start_async_gateway(cache=gateway.gateway_cache)
+    path = f"{base}/api/bookings/b-auth-async"
+    statuses = [
+        requests.get(path, headers={"Authorization": token}).headers["X-Cache"]
+        for token in ("Bearer alice", "Bearer bob", "Bearer alice")
+    ]
+    assert statuses == ["MISS", "MISS", "HIT"]
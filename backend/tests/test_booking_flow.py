@@ -8,6 +8,7 @@
 - Booking Service на этом endpoint выставляет booking.status = CONFIRMED. [file:17]
 """
 import json
+import time
 from datetime import datetime, timedelta
 
 import requests
@@ -135,14 +136,19 @@ def test_webhook_processing(payment: dict, booking: dict):
     )
     _print_response(resp)
 
-    assert resp.status_code == 200, "Webhook должен обработаться успешно"
-
-    # Проверяем, что платеж стал succeeded
-    resp2 = requests.get(f"{API_GATEWAY_URL}/api/payments/{payment['payment_id']}", timeout=10)
+    assert resp.status_code == 200, "Webhook должен быть принят"
+
+    # Webhook обрабатывается асинхронно - ждём, пока платеж станет succeeded
+    payment_status = None
+    for _ in range(50):
+        resp2 = requests.get(f"{API_GATEWAY_URL}/api/payments/{payment['payment_id']}", timeout=10)
+        assert resp2.status_code == 200, "Платеж должен успешно читаться"
+        payment_status = resp2.json().get("status")
+        if payment_status == "succeeded":
+            break
+        time.sleep(0.1)
     _print_response(resp2)
 
-    assert resp2.status_code == 200, "Платеж должен успешно читаться"
-    payment_status = resp2.json().get("status")
     assert payment_status == "succeeded", "Платеж должен стать succeeded"
 
     # Проверяем, что бронь стала confirmed (Payment Service дергает confirm endpoint). [file:14]
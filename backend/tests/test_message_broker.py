@@ -0,0 +1,293 @@
+"""
+Модульные тесты Message Broker (без запуска сервисов)
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_broker.consumer_groups import ConsumerGroup, WEIGHTED_ROUND_ROBIN
+from message_broker.config import LANE_WEIGHTS, EVENT_PRIORITIES, DEFAULT_LANE
+from message_broker.lanes import LaneScheduler
+from message_broker.delayed import DelayedQueue
+from message_broker.metrics import Registry
+from message_broker.dedup import LruSeenSet, BloomSeenSet
+from message_broker.ordering import OrderedDispatcher, ordering_key
+from message_broker import main as broker
+from schemas import envelope as envelopes
+
+
+def test_consumer_group_least_outstanding():
+    group = ConsumerGroup("notification")
+    group.join("http://replica-1/broker/consume")
+    group.join("http://replica-2/broker/consume")
+
+    first = group.acquire()
+    second = group.acquire()
+    assert first is not second, "Доставки должны распределяться по репликам"
+
+    group.release(first, success=True)
+    third = group.acquire()
+    assert third is first, "Должна выбираться реплика с наименьшим числом доставок в полёте"
+
+
+def test_consumer_group_weighted_round_robin():
+    group = ConsumerGroup("notification", strategy=WEIGHTED_ROUND_ROBIN)
+    group.join("http://big/broker/consume", weight=3)
+    group.join("http://small/broker/consume", weight=1)
+
+    picks = []
+    for _ in range(8):
+        member = group.acquire()
+        picks.append(member.callback_url)
+        group.release(member, success=True)
+
+    assert picks.count("http://big/broker/consume") == 6, "Распределение должно учитывать вес"
+
+
+def test_consumer_group_skips_expired_and_failing_members():
+    group = ConsumerGroup("notification", heartbeat_ttl=-1.0, max_failures=1)
+    static = group.join("http://static/broker/consume", static=True)
+    group.join("http://dynamic/broker/consume")
+
+    member = group.acquire()
+    assert member is static, "Реплика без heartbeat не должна получать сообщения"
+
+    group.release(member, success=False)
+    assert group.acquire() is None, "Сбойная реплика временно выводится из ротации"
+
+
+def test_subscribe_adds_member_instead_of_overwriting():
+    client = broker.app.test_client()
+    for url in ("http://n1/broker/consume", "http://n2/broker/consume"):
+        resp = client.post(
+            "/broker/subscribe",
+            json={"event_type": "booking.created", "subscriber": "notification-test", "callback_url": url},
+        )
+        assert resp.status_code == 200
+
+    groups = client.get("/broker/groups").get_json()
+    urls = [m["callback_url"] for m in groups["notification-test"]["members"]]
+    assert urls == ["http://n1/broker/consume", "http://n2/broker/consume"], "Обе реплики должны быть в группе"
+
+    resp = client.post(
+        "/broker/heartbeat",
+        json={"subscriber": "notification-test", "callback_url": "http://unknown/broker/consume"},
+    )
+    assert resp.status_code == 404, "Heartbeat неизвестной реплики требует повторной подписки"
+
+
+def test_lane_scheduler_prefers_high_priority_without_starvation():
+    scheduler = LaneScheduler(
+        {"high": 3, "low": 1},
+        {"payment.succeeded": "high", "booking.created": "low"},
+        "low",
+    )
+    for i in range(10):
+        scheduler.push({"id": f"b{i}", "t": "booking.created"})
+    for i in range(10):
+        scheduler.push({"id": f"p{i}", "t": "payment.succeeded"})
+
+    order = [scheduler.pop(timeout=0)[2]["t"] for _ in range(8)]
+    assert order[:3] == ["payment.succeeded"] * 3, "Высокий приоритет обслуживается первым"
+    assert order.count("booking.created") == 2, "Низкий приоритет получает свою долю в каждом раунде"
+    assert scheduler.lanes["high"].queue_wait.count == 6, "Задержка ожидания учитывается по полосам"
+
+
+def test_delayed_queue_fires_in_order_and_survives_restart(tmp_path):
+    fired = []
+    queue = DelayedQueue(fired.append, persistence_dir=str(tmp_path))
+    now = time.time()
+    queue.schedule({"id": "later", "t": "booking.reminder"}, now + 3600)
+    queue.schedule({"id": "soon", "t": "booking.reminder"}, now + 0.05)
+    queue.start()
+
+    deadline = time.time() + 2
+    while queue.fired < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [m["id"] for m in fired] == ["soon"], "Срабатывает только наступившее сообщение"
+
+    restored = DelayedQueue(fired.append, persistence_dir=str(tmp_path))
+    assert len(restored) == 1, "После перезапуска остаётся только невыполненное сообщение"
+    assert restored.next_due() == now + 3600
+
+
+def test_publish_with_delay_is_scheduled():
+    client = broker.app.test_client()
+    resp = client.post("/broker/publish", json={"event_type": "booking.reminder", "delay_ms": 60000})
+    assert resp.status_code == 200
+    assert resp.get_json()["status"] == "scheduled", "Сообщение с delay_ms должно быть отложено"
+
+    # Отложенная публикация учитывается в метриках при приёме
+    client.post("/broker/publish", json={"event_type": "booking.followup", "delay_ms": 60000})
+    assert broker.published_total.get(("booking.followup",)) == 1
+    assert client.get("/broker/stats").get_json()["event_types"]["booking.followup"]["published"] == 1
+
+    resp = client.post("/broker/publish", json={"event_type": "booking.reminder", "delay_ms": 1, "deliver_at": 1})
+    assert resp.status_code == 400, "deliver_at и delay_ms одновременно недопустимы"
+
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = Registry()
+    published = registry.counter("published_total", "Опубликовано", ("event_type",))
+    latency = registry.histogram("latency_seconds", "Задержка", ("subscriber",))
+    published.inc(("payment.succeeded",))
+    published.inc(("payment.succeeded",))
+    for value in (0.002, 0.004, 0.2):
+        latency.observe(("notification",), value)
+
+    text = registry.render()
+    assert 'published_total{event_type="payment.succeeded"} 2' in text
+    assert 'latency_seconds_bucket{subscriber="notification",le="0.005"} 2' in text
+    assert 'latency_seconds_bucket{subscriber="notification",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{subscriber="notification"} 3' in text
+
+    p99 = latency.get(("notification",)).quantile(0.99)
+    assert 0.1 < p99 <= 0.2, "p99 должен попасть в бакет самого медленного наблюдения"
+
+
+def test_envelope_round_trip_and_legacy_format():
+    event = {"event_type": "booking.created", "payload": {"booking": {"booking_id": "b-1"}}}
+    envelope = envelopes.from_event(event, "booking")
+    assert envelope["d"] == {"booking": {"booking_id": "b-1"}}, "Данные без дублирования event_type"
+
+    body = envelopes.encode(envelope)
+    decoded = envelopes.decode(body, envelopes.CONTENT_TYPE_JSON)
+    assert decoded == envelope
+
+    big = envelopes.make_envelope("booking.exported", {"rows": ["x" * 100] * 200})
+    compressed = envelopes.encode(big)
+    assert b'"z":' in compressed and len(compressed) < 2000, "Крупные данные сжимаются"
+    assert envelopes.decode(compressed, envelopes.CONTENT_TYPE_JSON)["d"] == big["d"]
+
+    legacy = envelopes.decode_message(json.dumps(event).encode(), "application/json")
+    assert legacy["event_type"] == "booking.created"
+    assert legacy["payload"] == {"booking": {"booking_id": "b-1"}}
+
+
+def test_publish_rejects_unknown_content_type():
+    client = broker.app.test_client()
+    resp = client.post("/broker/publish", data=b"x", headers={"Content-Type": "text/plain"})
+    assert resp.status_code == 415
+
+
+def test_seen_sets_are_bounded():
+    lru = LruSeenSet(window=3600, max_entries=2)
+    assert lru.add("a") and lru.add("b")
+    assert not lru.add("a"), "Повторный ключ - дубль"
+    lru.add("c")
+    assert "a" not in lru and len(lru) == 2, "Самый старый ключ вытесняется"
+
+    expiring = LruSeenSet(window=-1)
+    expiring.add("a")
+    assert expiring.add("a"), "Ключ вне окна забывается"
+
+    bloom = BloomSeenSet(window=3600, capacity=100, error_rate=1e-4)
+    assert bloom.add("m-1") and not bloom.add("m-1")
+    for i in range(250):
+        bloom.add(f"k-{i}")
+    assert bloom.rotations >= 2 and "m-1" not in bloom, "Старое поколение фильтра сбрасывается"
+    assert "k-249" in bloom
+
+
+def test_publish_deduplicates_by_idempotency_key():
+    client = broker.app.test_client()
+    headers = {"Idempotency-Key": "payment.succeeded:p-dedup"}
+    event = {"event_type": "booking.reminder", "delay_ms": 60000}
+
+    first = client.post("/broker/publish", json=event, headers=headers).get_json()
+    second = client.post("/broker/publish", json=event, headers=headers).get_json()
+    assert first["status"] == "scheduled"
+    assert second["status"] == "duplicate", "Ретрай производителя не публикуется повторно"
+
+    envelope = envelopes.make_envelope("booking.reminder", {}, "booking")
+    envelope["delay_ms"] = 60000
+    body = envelopes.encode(envelope)
+    statuses = [
+        client.post("/broker/publish", data=body, content_type=envelopes.CONTENT_TYPE_JSON).get_json()["status"]
+        for _ in range(2)
+    ]
+    assert statuses == ["scheduled", "duplicate"], "Без ключа дубль определяется по message_id"
+
+
+def test_retry_after_timeout_goes_to_the_same_replica(monkeypatch):
+    group = broker.get_group("integration-timeout-test", create=True)
+    group.join("http://i1/broker/consume", static=True)
+    group.join("http://i2/broker/consume", static=True)
+    calls = []
+
+    def post(url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            raise broker.requests.exceptions.ReadTimeout("read timed out")
+        return type("Response", (), {"status_code": 200})()
+
+    monkeypatch.setattr(broker.requests, "post", post)
+    message = envelopes.make_envelope("payment.succeeded", {"payment_id": "p-1"}, "payment")
+    assert broker.deliver_message("integration-timeout-test", message)
+    assert calls[0] == calls[1], "Реплика могла обработать сообщение - повтор только ей (её дедупликация)"
+
+    def post_failing(url, **kwargs):
+        calls.append(url)
+        return type("Response", (), {"status_code": 500 if len(calls) == 1 else 200})()
+
+    calls.clear()
+    monkeypatch.setattr(broker.requests, "post", post_failing)
+    assert broker.deliver_message("integration-timeout-test", message)
+    assert calls[0] != calls[1], "После ошибки (сообщение не обработано) - другая реплика"
+
+
+def test_ordered_dispatcher_keeps_order_per_booking():
+    delivered = []
+    done = threading.Event()
+
+    def deliver(subscriber, message):
+        if message["d"]["step"] == 0:
+            time.sleep(0.05)  # медленная первая доставка не должна пропустить вторую вперёд
+        delivered.append((subscriber, message["d"]["step"]))
+        if len(delivered) == 6:
+            done.set()
+
+    dispatcher = OrderedDispatcher(deliver, workers=4)
+    for step in range(3):
+        message = envelopes.make_envelope("booking.confirmed", {"booking_id": "b-1", "step": step}, "booking")
+        assert ordering_key(message) == "b-1"
+        for subscriber in ("integration", "notification"):
+            dispatcher.submit(subscriber, ordering_key(message), subscriber, message)
+
+    assert done.wait(2)
+    for subscriber in ("integration", "notification"):
+        steps = [step for name, step in delivered if name == subscriber]
+        assert steps == [0, 1, 2], "События одной брони доставляются подписчику по порядку"
+
+    payment = envelopes.make_envelope("payment.succeeded", {"payment": {"booking_id": "b-2"}})
+    assert ordering_key(payment) == "b-2"
+    other = envelopes.make_envelope("booking.reminder", {})
+    assert ordering_key(other) == other["id"]
+
+
+def test_lane_scheduler_keeps_booking_lifecycle_order_across_lanes():
+    scheduler = LaneScheduler(LANE_WEIGHTS, EVENT_PRIORITIES, DEFAULT_LANE)
+    # Низкая полоса занята созданием других броней
+    for i in range(20):
+        scheduler.push(envelopes.make_envelope("booking.created", {"booking": {"booking_id": f"b{i}"}}))
+    scheduler.push(envelopes.make_envelope("booking.created", {"booking": {"booking_id": "b-x"}}))
+    scheduler.push(envelopes.make_envelope("booking.cancelled", {"booking_id": "b-x", "hall_id": "h"}))
+    scheduler.push(envelopes.make_envelope("booking.cancelled", {"booking_id": "b-y", "hall_id": "h"}))
+    assert scheduler.sizes() == {"booking.created": 21, "booking.cancelled": 2}
+
+    released = []
+    while True:
+        item = scheduler.pop(timeout=0)
+        if item is None:
+            break
+        released.append((item[2]["t"], ordering_key(item[2])))
+
+    assert released.index(("booking.created", "b-x")) < released.index(("booking.cancelled", "b-x")), (
+        "Отмена брони не обгоняет ждущее в низкой полосе создание той же брони"
+    )
+    assert released[0] == ("booking.cancelled", "b-y"), "Между разными бронями приоритет полос сохраняется"
+    assert scheduler.sizes() == {"booking.created": 0, "booking.cancelled": 0}
@@ -0,0 +1,505 @@
+"""
+Модульные тесты Payment Service (без запуска остальных сервисов)
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Журнал webhook-ов - во временном каталоге, а не в payment_service/data
+os.environ.setdefault("WEBHOOK_QUEUE_DIR", tempfile.mkdtemp(prefix="webhooks-"))
+
+from payment_service import main as payment
+from payment_service import export, gateways
+from payment_service.circuit_breaker import CircuitBreaker
+from payment_service.gateways import Environment, GatewayRegistry
+from payment_service.reconciler import PaymentReconciler
+from payment_service.refunds import RefundLedger
+from payment_service.store import PaymentStore
+from payment_service.webhook_queue import WebhookQueue, WebhookNotProcessed, JOURNAL_FILE
+
+
+def test_store_indexes_follow_updates():
+    store = PaymentStore()
+    store.add({"payment_id": "p1", "booking_id": "b1", "external_payment_id": "ext-1", "status": "pending"})
+    store.add({"payment_id": "p2", "booking_id": "b1", "external_payment_id": "ext-2", "status": "pending"})
+
+    assert store.get_by_external_id("ext-2").payment_id == "p2"
+    assert [p.payment_id for p in store.list_by_booking("b1")] == ["p1", "p2"]
+
+    store.update("p2", booking_id="b2", external_payment_id="ext-2b")
+    assert store.get_by_external_id("ext-2") is None, "Старый ключ индекса удаляется"
+    assert store.get_by_external_id("ext-2b").payment_id == "p2"
+    assert [p.payment_id for p in store.list_by_booking("b1")] == ["p1"]
+    assert [p.payment_id for p in store.list_by_booking("b2")] == ["p2"]
+
+
+def test_payment_record_serialization_is_cached_until_update():
+    client = payment.app.test_client()
+    created = client.post(
+        "/api/payments",
+        json={"booking_id": "booking-rec", "amount": "1200.50", "payment_method": "tinkoff"},
+    ).get_json()
+    record = payment.payments_db.get(created["payment_id"])
+    assert record.amount == Decimal("1200.50") and isinstance(record.created_at, datetime)
+
+    first = client.get(f"/api/payments/{record.payment_id}")
+    assert first.get_json() == created
+    assert payment.payment_json(record) is payment.payment_json(record), "JSON берётся из кэша"
+
+    payment.payments_db.update(record.payment_id, status="failed", updated_at=datetime.now())
+    updated = client.get(f"/api/payments/{record.payment_id}").get_json()
+    assert updated["status"] == "failed" and updated["updated_at"]
+
+
+def test_batch_get_returns_payments_in_request_order(monkeypatch):
+    client = payment.app.test_client()
+    ids = [
+        client.post("/api/payments", json={"booking_id": "booking-batch", "amount": 100}).get_json()["payment_id"]
+        for _ in range(2)
+    ]
+    body = client.post("/api/payments/batch-get", json={"payment_ids": [ids[1], "missing", ids[0], ids[1]]}).get_json()
+    assert [p["payment_id"] for p in body["payments"]] == [ids[1], ids[0]]
+    assert body["payments"][0] == client.get(f"/api/payments/{ids[1]}").get_json()
+    assert (body["not_found"], body["total"]) == (["missing"], 2)
+
+    monkeypatch.setattr(payment, "PAYMENT_BATCH_GET_MAX_IDS", 1)
+    assert client.post("/api/payments/batch-get", json={"payment_ids": ids}).status_code == 400
+    assert client.post("/api/payments/batch-get", json={"payment_ids": "p1"}).status_code == 400
+
+
+def test_partial_refunds_are_ledgered_and_capped(monkeypatch):
+    monkeypatch.setattr(payment.broker_transport, "publish", lambda event: None)
+    client = payment.app.test_client()
+    created = client.post(
+        "/api/payments",
+        json={"booking_id": "booking-refund", "amount": "1000.00", "payment_method": "yookassa"},
+    ).get_json()
+    payment.apply_webhook({"payment_id": created["external_payment_id"], "status": "succeeded"})
+    url = f"/api/payments/{created['payment_id']}"
+
+    first = client.post(f"{url}/refund", json={"amount": 300, "reason": "часть"})
+    assert first.status_code == 200 and first.get_json()["external_refund_id"]
+    assert client.get(url).get_json()["status"] == "partially_refunded"
+
+    over = client.post(f"{url}/refund", json={"amount": 800})
+    assert over.status_code == 409, "Больше остатка нельзя"
+    assert float(over.get_json()["available"]) == 700
+    assert client.post(f"{url}/refund", json={"amount": -5}).status_code == 400
+    # Запоздавший webhook об оплате не перетирает статус, выведенный из журнала
+    payment.apply_webhook({"payment_id": created["external_payment_id"], "status": "succeeded"})
+
+    rest = client.post(f"{url}/refund", json={})
+    assert rest.get_json()["amount"] == "700.00"
+    refunded = client.get(url).get_json()
+    assert refunded["status"] == "refunded" and refunded["refunded_amount"] == "1000.00"
+
+    ledger = client.get(f"{url}/refunds").get_json()
+    assert (ledger["total"], ledger["available"]) == (2, "0.00")
+
+    totals = client.get("/api/payments/settlement?gateway=yookassa").get_json()["totals"]
+    assert totals["refunds"] >= 2 and totals["payments"] >= 1
+
+
+def test_export_streams_rows_by_gateway_and_time_with_totals():
+    store = PaymentStore()
+    ledger = RefundLedger()
+    for i, (method, status) in enumerate(
+        [("sberpay", "succeeded"), ("yookassa", "succeeded"), ("yookassa", "pending"), ("yookassa", "succeeded")]
+    ):
+        store.add({
+            "payment_id": f"p{i}", "amount": "100.00", "payment_method": method,
+            "status": status, "created_at": datetime(2026, 3, 1, 10 + i),
+        })
+    # Вне периода
+    store.add({"payment_id": "old", "amount": "1.00", "payment_method": "yookassa", "created_at": datetime(2026, 2, 1)})
+    refund = ledger.reserve("p1", Decimal("100.00"), Decimal("40.00"), gateway="yookassa")
+    ledger.complete(refund["refund_id"], "p1", "ext-refund")
+
+    rows = list(export.export_rows(store, ledger, datetime(2026, 3, 1), None))
+    assert [(r["type"], r.get("payment_id")) for r in rows] == [
+        ("payment", "p0"), ("total", None),
+        ("payment", "p1"), ("payment", "p2"), ("payment", "p3"), ("refund", "p1"), ("total", None),
+        ("total", None),
+    ]
+    assert rows[6]["gateway"] == "yookassa"
+    assert (rows[6]["payments"], rows[6]["gross"], rows[6]["net"]) == (2, Decimal("200.00"), Decimal("160.00"))
+    assert rows[-1]["net"] == Decimal("260.00")
+
+    filtered = list(export.export_rows(store, ledger, gateways=["yookassa"], statuses=["pending"], kinds=["payment"]))
+    assert [r.get("payment_id") for r in filtered] == ["old", "p2", None, None]
+
+    chunks = list(export.stream(iter(rows), "csv", chunk_size=64))
+    assert len(chunks) > 1, "Выгрузка отдаётся частями"
+    lines = "".join(chunks).splitlines()
+    assert lines[0].startswith("type,timestamp,gateway") and len(lines) == len(rows) + 1
+
+    response = payment.app.test_client().get("/api/payments/export?from=2026-03-01&to=2026-03-01&format=ndjson")
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    assert payment.app.test_client().get("/api/payments/export?format=xml").status_code == 400
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_webhook_and_list_by_booking():
+    client = payment.app.test_client()
+    created = client.post(
+        "/api/payments",
+        json={"booking_id": "booking-idx", "amount": "3000.00", "payment_method": "sberpay"},
+    ).get_json()
+
+    resp = client.post(
+        "/api/payments/webhook/sberpay",
+        json={"orderId": created["external_payment_id"], "status": 1, "amount": 300000},
+    )
+    assert resp.status_code == 200 and resp.get_json()["status"] == "accepted"
+    assert wait_for(lambda: payment.payments_db.get(created["payment_id"]).updated_at), (
+        "Платёж обновляется воркером очереди по external_payment_id"
+    )
+
+    resp = client.post("/api/payments/webhook/sberpay", json={"status": 1})
+    assert resp.status_code == 400, "Webhook без id платежа отклоняется сразу"
+
+    listed = client.get("/api/payments?booking_id=booking-idx").get_json()
+    assert listed["total"] == 1
+    assert listed["payments"][0]["payment_id"] == created["payment_id"]
+
+    assert client.get("/api/payments").status_code == 400
+
+
+def test_booking_read_model_replaces_amount_lookup(monkeypatch):
+    def no_booking_service(*args, **kwargs):
+        raise AssertionError("Сумма берётся из read-модели, без запроса в Booking Service")
+
+    monkeypatch.setattr(payment.requests, "get", no_booking_service)
+    client = payment.app.test_client()
+    booking = {"booking_id": "booking-rm", "total_amount": 4500.0, "status": "pending_payment"}
+    consumed = client.post(
+        "/broker/consume",
+        json={"message_id": "m1", "event_type": "booking.created", "payload": {"booking": booking}},
+    )
+    assert consumed.get_json()["status"] == "processed"
+
+    created = client.post("/api/payments", json={"booking_id": "booking-rm", "payment_method": "sberpay"})
+    assert created.status_code == 201
+    assert created.get_json()["amount"] == "4500.0"
+
+    payment.handle_broker_message({"event_type": "booking.cancelled", "payload": {"booking_id": "booking-rm"}})
+    # Отмена не перетирается запоздавшим booking.created
+    payment.handle_broker_message({"event_type": "booking.created", "payload": {"booking": booking}})
+    resp = client.post("/api/payments", json={"booking_id": "booking-rm", "amount": 4500})
+    assert resp.status_code == 409
+
+
+def test_webhook_queue_keeps_per_payment_order_and_restores(tmp_path):
+    seen = []
+    lock = threading.Lock()
+
+    def handler(record):
+        time.sleep(0.001 * (record["payload"]["seq"] % 3))
+        with lock:
+            seen.append((record["key"], record["payload"]["seq"]))
+
+    pending = WebhookQueue(handler, workers=3, persistence_dir=str(tmp_path))
+    for seq in range(30):
+        pending.submit("sberpay", f"ext-{seq % 4}", {"seq": seq})
+
+    # Не запущенная очередь "упала": новый экземпляр восстанавливает webhook-и из журнала
+    restored = WebhookQueue(handler, workers=3, persistence_dir=str(tmp_path))
+    restored.start()
+    assert wait_for(lambda: restored.processed == 30)
+
+    for key in {k for k, _ in seen}:
+        sequence = [seq for k, seq in seen if k == key]
+        assert sequence == sorted(sequence), "Webhook-и одного платежа обрабатываются по порядку"
+    assert restored.stats()["ingest_to_processed"]["count"] == 30
+
+
+def test_repeated_gateway_notification_is_short_circuited(monkeypatch):
+    published = []
+    monkeypatch.setattr(payment.broker_transport, "publish", published.append)
+    client = payment.app.test_client()
+    created = client.post(
+        "/api/payments",
+        json={"booking_id": "booking-replay", "amount": "1500.00", "payment_method": "yookassa"},
+    ).get_json()
+    notification = {
+        "event": "payment.canceled",
+        "object": {"id": created["external_payment_id"], "status": "canceled"},
+    }
+
+    first = client.post("/api/payments/webhook/yookassa", json=notification).get_json()
+    assert first["status"] == "accepted"
+    assert wait_for(lambda: published)
+
+    second = client.post("/api/payments/webhook/yookassa", json=notification).get_json()
+    assert second["status"] == "duplicate", "Повтор отвечается без очереди"
+    time.sleep(0.05)
+    assert [e["event_type"] for e in published] == ["payment.failed"], "payment.failed публикуется один раз"
+
+    stats = client.get("/api/payments/webhooks/stats").get_json()["idempotency"]
+    assert stats["duplicates"] >= 1 and stats["hit_rate"] > 0
+
+
+def test_reconciler_resolves_stale_pending_payments(monkeypatch):
+    store = PaymentStore()
+    old = (datetime.now() - timedelta(hours=1)).isoformat()
+    for i, status in enumerate(["pending", "succeeded", "pending", "pending"]):
+        store.add({"payment_id": f"r{i}", "booking_id": "b", "external_payment_id": f"ext-r{i}",
+                   "status": status, "created_at": old})
+    store.add({"payment_id": "fresh", "status": "pending", "created_at": datetime.now().isoformat()})
+    assert [p.payment_id for p in store.pending_older_than(datetime.now() - timedelta(minutes=30))] == ["r0", "r2", "r3"]
+
+    def check_status(p):
+        if p.payment_id == "r3":
+            raise ConnectionError("шлюз недоступен")
+        return {"payment_id": p.external_payment_id, "status": "succeeded" if p.payment_id == "r0" else "pending"}
+
+    applied = []
+    reconciler = PaymentReconciler(
+        store, check_status, lambda p, data: applied.append(p) or store.update(p.payment_id, status=data["status"]),
+        min_age=60, batch_size=2, concurrency=2,
+    )
+    summary = reconciler.run_once()
+    assert (summary["checked"], summary["resolved"], summary["still_pending"], summary["errors"]) == (3, 1, 1, 1)
+    assert [p.payment_id for p in applied] == ["r0"]
+    assert store.pending_count() == 3, "Успешный платёж уходит из индекса pending"
+
+
+def test_concurrent_reconcile_and_webhook_apply_payment_once(monkeypatch):
+    published = []
+    confirmed = []
+    monkeypatch.setattr(payment.broker_transport, "publish", published.append)
+    monkeypatch.setattr(payment.requests, "post", lambda url, **kwargs: confirmed.append(url))
+    created = payment.app.test_client().post(
+        "/api/payments", json={"booking_id": "booking-race", "amount": "900.00", "payment_method": "yookassa"},
+    ).get_json()
+    record = payment.payments_db.get(created["payment_id"])
+    result = {"payment_id": created["external_payment_id"], "status": "succeeded"}
+    update = payment.payments_db.update
+
+    def slow_update(payment_id, **changes):
+        # Окно между чтением статуса и записью: без compare-and-set оба обработчика видят pending
+        time.sleep(0.05)
+        return update(payment_id, **changes)
+
+    monkeypatch.setattr(payment.payments_db, "update", slow_update)
+    barrier = threading.Barrier(8)
+
+    def apply(i):
+        barrier.wait()
+        if i % 2:
+            payment.reconcile_payment(record, dict(result))
+        else:
+            payment.apply_webhook({**result, "event_id": f"evt-{i}"})
+
+    threads = [threading.Thread(target=apply, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert record.status == "succeeded"
+    assert len(confirmed) == 1, "Бронь подтверждается один раз"
+    assert [e["event_type"] for e in published] == ["payment.succeeded"]
+
+
+def test_reconciler_moves_still_pending_payments_to_the_back_of_the_queue():
+    store = PaymentStore()
+    hour_ago = datetime.now() - timedelta(hours=1)
+    for i in range(5):
+        store.add({"payment_id": f"stuck{i}", "status": "pending", "created_at": hour_ago + timedelta(seconds=i)})
+    store.add({"payment_id": "late", "status": "pending", "created_at": hour_ago + timedelta(minutes=1)})
+
+    def check_status(p):
+        return {"payment_id": p.payment_id, "status": "succeeded" if p.payment_id == "late" else "pending"}
+
+    def apply(p, data):
+        store.update(p.payment_id, status=data["status"])
+
+    reconciler = PaymentReconciler(store, check_status, apply, min_age=60, max_per_run=3)
+    first = reconciler.run_once()
+    assert (first["checked"], first["still_pending"]) == (3, 3)
+    second = reconciler.run_once()
+    assert (second["checked"], second["resolved"]) == (3, 1), "Зависшие в шлюзе не занимают каждый проход"
+    assert store.get("late").status == "succeeded"
+    assert reconciler.run_once()["checked"] == 0, "Следующая проверка - через retry_delay"
+    assert store.check_attempts("stuck0") == 1
+
+    # Попытки исчерпаны - сверка платежа прекращается
+    store.add({"payment_id": "stuck-new", "status": "pending", "created_at": hour_ago})
+    giving_up = PaymentReconciler(store, check_status, apply, min_age=60, retry_delay=0, max_attempts=2)
+    assert giving_up.run_once()["abandoned"] == 0
+    assert giving_up.run_once()["abandoned"] == 1
+    assert (store.pending_count(), store.abandoned_count()) == (5, 1)
+
+
+def test_gateway_registry_reuses_clients():
+    registry = GatewayRegistry(max_concurrency=1)
+    client = registry.get("YooKassa", Environment.TEST)
+    assert registry.get("yookassa", Environment.TEST) is client, "Один клиент на (шлюз, режим)"
+    assert registry.get("yookassa", Environment.MOCK) is not client
+    assert client.session.headers["Authorization"].startswith("Basic "), "Заголовок посчитан заранее"
+
+
+def test_circuit_breaker_opens_on_errors_and_slow_calls():
+    breaker = CircuitBreaker("test", latency_threshold=1.0, window=10, min_calls=4, open_for=60)
+    for _ in range(4):
+        breaker.record(False, 0.01)
+    assert not breaker.allow(), "Открыт после серии ошибок"
+
+    slow = CircuitBreaker("slow", latency_threshold=1.0, window=10, min_calls=4, open_for=0)
+    for _ in range(4):
+        slow.record(True, 5.0)
+    assert slow.to_dict()["state"] == "half_open", "Медленные вызовы тоже открывают breaker"
+    assert slow.allow() and not slow.allow(), "В half_open пропускается один пробный вызов"
+    slow.record(True, 0.01)
+    assert slow.to_dict()["state"] == "closed"
+
+
+def test_unpinned_payment_is_routed_around_open_breaker(monkeypatch):
+    registry = GatewayRegistry()
+    monkeypatch.setattr(gateways, "registry", registry)
+    monkeypatch.setattr(payment, "gateway_registry", registry)
+    monkeypatch.setattr(payment, "GATEWAY_ROUTING", True)
+    yookassa = registry.get("yookassa", payment.PAYMENT_ENV)
+    yookassa.breaker.open_for = 60
+    for _ in range(yookassa.breaker.min_calls):
+        yookassa.breaker.record(False, 0.01)
+
+    client = payment.app.test_client()
+    routed = client.post("/api/payments", json={"booking_id": "b-route", "amount": "100"}).get_json()
+    assert routed["payment_method"] != "yookassa", "Платёж уходит в доступный шлюз"
+
+    pinned = client.post(
+        "/api/payments", json={"booking_id": "b-route", "amount": "100", "payment_method": "yookassa"}
+    )
+    assert pinned.status_code == 201, "Явно выбранный шлюз не подменяется (в mock-режиме вызова нет)"
+
+    health = client.get("/health").get_json()
+    assert health["status"] == "degraded" and health["open_breakers"] == ["yookassa:mock"]
+
+
+def test_gateway_notifications_map_failures():
+    sber = gateways.SberPayGateway(Environment.TEST)
+    assert sber.process_webhook({"orderId": "o1", "status": 2})["status"] == "succeeded"
+    assert sber.process_webhook({"orderId": "o1", "status": 6})["status"] == "failed"
+
+    tinkoff = gateways.TinkoffGateway(Environment.TEST)
+    declined = tinkoff.process_webhook({"PaymentId": 123, "Status": "REJECTED"})
+    assert declined == {**declined, "payment_id": "123", "status": "failed"}
+    assert tinkoff.process_webhook({"PaymentId": 123, "Status": "AUTHORIZED"})["status"] == "pending"
+
+
+def test_webhook_is_acknowledged_only_once_it_cannot_be_lost(monkeypatch):
+    client = payment.app.test_client()
+    created = client.post(
+        "/api/payments",
+        json={"booking_id": "booking-durable", "amount": "700.00", "payment_method": "sberpay"},
+    ).get_json()
+    notification = {"orderId": created["external_payment_id"], "status": 1}
+
+    # С журналом (по умолчанию): 200 - после записи webhook-а в журнал
+    accepted = client.post("/api/payments/webhook/sberpay", json=notification)
+    assert accepted.status_code == 200 and accepted.get_json()["status"] == "accepted"
+    with open(os.path.join(os.environ["WEBHOOK_QUEUE_DIR"], JOURNAL_FILE), encoding="utf-8") as f:
+        journal = [json.loads(line) for line in f]
+    added = [entry["record"]["webhook_id"] for entry in journal if entry["op"] == "add"]
+    assert accepted.get_json()["webhook_id"] in added
+
+    # Без журнала: ответ после обработки, ошибка обработки - 503 (шлюз повторит)
+    def failing(record):
+        raise RuntimeError("Booking Service недоступен")
+
+    memory_only = WebhookQueue(failing, workers=1, max_attempts=1)
+    memory_only.start()
+    monkeypatch.setattr(payment, "webhook_queue", memory_only)
+    unprocessed = {"orderId": "sberpay-not-processed", "status": 1}
+    assert client.post("/api/payments/webhook/sberpay", json=unprocessed).status_code == 503
+
+    processed = WebhookQueue(lambda record: None, workers=1)
+    processed.start()
+    assert processed.submit("sberpay", "ext-1", {}, wait=1)
+    assert processed.processed == 1
+    with pytest.raises(WebhookNotProcessed):
+        WebhookQueue(lambda record: None).submit("sberpay", "ext-1", {}, wait=0.05)
+
+
+def test_failed_webhook_is_kept_as_dead_letter_and_rechecked(tmp_path):
+    failures = []
+    attempts = []
+
+    def failing(record):
+        attempts.append(record["webhook_id"])
+        raise RuntimeError("Booking Service недоступен")
+
+    pending = WebhookQueue(
+        failing, workers=1, persistence_dir=str(tmp_path), max_attempts=2, retry_delay=0,
+        on_failure=lambda record, error: failures.append(record["key"]),
+    )
+    pending.start()
+    webhook_id = pending.submit("sberpay", "ext-dead", {"seq": 1})
+    assert wait_for(lambda: pending.failed == 1) and failures == ["ext-dead"]
+    assert [entry["record"]["webhook_id"] for entry in pending.dead_letters()] == [webhook_id]
+
+    # После перезапуска dead-letter не потерян и не обрабатывается сам по себе, replay() - обрабатывается
+    processed = []
+    restored = WebhookQueue(processed.append, workers=1, persistence_dir=str(tmp_path))
+    restored.start()
+    assert restored.dead_letter_count() == 1 and restored.stats()["dead_letters"] == 1
+    time.sleep(0.05)
+    assert processed == []
+    assert restored.replay() == 1
+    assert wait_for(lambda: restored.processed == 1) and restored.dead_letter_count() == 0
+    assert WebhookQueue(processed.append, persistence_dir=str(tmp_path)).dead_letter_count() == 0
+
+    # Платёж отказавшего webhook-а сверка проверит при ближайшем проходе, даже недавний
+    client = payment.app.test_client()
+    created = client.post(
+        "/api/payments",
+        json={"booking_id": "booking-dead", "amount": "900.00", "payment_method": "sberpay"},
+    ).get_json()
+
+    def due():
+        now = datetime.now()
+        return [p.payment_id for p in payment.payments_db.pending_due(now - timedelta(hours=1), now)]
+
+    assert created["payment_id"] not in due()
+    payment.recheck_failed_webhook({"key": created["external_payment_id"]}, RuntimeError("timeout"))
+    assert created["payment_id"] in due()
+
+
+def test_reconciler_keeps_rechecking_unrecognised_gateway_status():
+    store = PaymentStore()
+    store.add({"payment_id": "capture", "status": "pending", "created_at": datetime.now() - timedelta(hours=1)})
+    statuses = iter(["waiting_for_capture", "succeeded"])
+
+    def check_status(p):
+        return {"payment_id": p.payment_id, "status": next(statuses)}
+
+    def apply(p, data):
+        # Как apply_webhook: нераспознанный статус шлюза -> pending
+        store.update(p.payment_id, status=data["status"] if data["status"] == "succeeded" else "pending")
+
+    reconciler = PaymentReconciler(store, check_status, apply, min_age=60, retry_delay=60)
+    first = reconciler.run_once()
+    assert (first["still_pending"], first["resolved"]) == (1, 0), "Платёж не вышел из pending - не resolved"
+    assert store.check_attempts("capture") == 1 and store.pending_count() == 1
+    assert reconciler.run_once()["checked"] == 0, "Повтор - с backoff"
+
+    store.reschedule_check("capture", datetime.now() - timedelta(seconds=1))
+    assert reconciler.run_once()["resolved"] == 1 and store.get("capture").status == "succeeded"
+    assert reconciler.stats()["resolved"] == 1